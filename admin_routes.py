@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends
+from typing import Optional
+
+from database import User
+from auth_utils import get_current_admin_user
+from auth_cache import auth_cache_stats
+from write_behind import user_writes
+from catalog_cache import invalidate_catalogs, catalog_cache_stats
+from catalog_summaries import catalog_summary_stats
+from form_cache import invalidate_forms, form_cache_stats
+from inbox_stream import stream_stats
+from pyrus_async import single_flight_stats
+from rate_limit import rate_limit_stats
+from task_mirror import task_mirror_stats
+
+# Данные и сброс кэшей всех аккаунтов — только для администраторов (ADMIN_LOGINS)
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+@router.get("/cache")
+async def get_cache_stats(current_user: User = Depends(get_current_admin_user)):
+    """Статистика серверных кэшей"""
+    return {
+        "catalogs": catalog_cache_stats(),
+        "catalog_summaries": catalog_summary_stats(),
+        "forms": form_cache_stats(),
+        "inbox_stream": stream_stats(),
+        "pyrus_single_flight": single_flight_stats(),
+        "pyrus_rate_limit": rate_limit_stats(),
+        "task_mirror": task_mirror_stats(),
+        "auth": auth_cache_stats(),
+        "user_writes": user_writes.stats(),
+    }
+
+@router.delete("/cache/catalogs")
+async def invalidate_catalog_cache(
+    catalog_id: Optional[int] = None,
+    account: Optional[str] = None,
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Сброс кэша каталогов (всех, конкретного каталога и/или аккаунта)"""
+    removed = invalidate_catalogs(catalog_id=catalog_id, account=account)
+    return {"removed": removed}
+
+@router.delete("/cache/forms")
+async def invalidate_form_cache(
+    form_id: Optional[int] = None,
+    account: Optional[str] = None,
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Сброс кэша определений форм"""
+    removed = invalidate_forms(form_id=form_id, account=account)
+    return {"removed": removed}
@@ -0,0 +1,54 @@
+"""Task mirror tables
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('task_mirror',
+    sa.Column('account', sa.String(), nullable=False),
+    sa.Column('task_id', sa.Integer(), nullable=False),
+    sa.Column('form_id', sa.Integer(), nullable=False),
+    sa.Column('step', sa.Integer(), nullable=True),
+    sa.Column('due', sa.DateTime(), nullable=True),
+    sa.Column('closed', sa.Boolean(), nullable=False),
+    sa.Column('responsible_id', sa.Integer(), nullable=True),
+    sa.Column('create_date', sa.DateTime(), nullable=True),
+    sa.Column('last_modified_date', sa.DateTime(), nullable=False),
+    sa.Column('fields', sa.JSON(), nullable=True),
+    sa.Column('synced_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('account', 'task_id')
+    )
+    op.create_index('ix_task_mirror_form_modified', 'task_mirror', ['account', 'form_id', 'last_modified_date'], unique=False)
+    op.create_index('ix_task_mirror_form_step', 'task_mirror', ['account', 'form_id', 'closed', 'step'], unique=False)
+    op.create_index('ix_task_mirror_form_due', 'task_mirror', ['account', 'form_id', 'due'], unique=False)
+    op.create_table('task_mirror_sync',
+    sa.Column('account', sa.String(), nullable=False),
+    sa.Column('form_id', sa.Integer(), nullable=False),
+    sa.Column('cursor', sa.DateTime(), nullable=True),
+    sa.Column('last_sync_at', sa.DateTime(), nullable=True),
+    sa.Column('last_full_sync_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('task_count', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('account', 'form_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('task_mirror_sync')
+    op.drop_index('ix_task_mirror_form_due', table_name='task_mirror')
+    op.drop_index('ix_task_mirror_form_step', table_name='task_mirror')
+    op.drop_index('ix_task_mirror_form_modified', table_name='task_mirror')
+    op.drop_table('task_mirror')
@@ -0,0 +1,80 @@
+"""
+Кэш проверенных JWT-токенов и строк пользователей для быстрой авторизации по куке
+"""
+import hashlib
+import os
+import time
+
+from sqlalchemy import event, inspect, select
+
+from cache import TTLCache
+from database import User
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "1024"))
+# Изменения, сделанные другим процессом, видны не позже чем через это время
+AUTH_USER_CACHE_TTL_SECONDS = int(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "60"))
+
+# sha256(токен) -> логин; запись живет до exp токена
+_tokens = TTLCache(max_entries=AUTH_TOKEN_CACHE_SIZE, name="auth_tokens")
+# логин -> отсоединенная от сессии копия User
+_users = TTLCache(max_entries=AUTH_USER_CACHE_SIZE, ttl=AUTH_USER_CACHE_TTL_SECONDS, name="auth_users")
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_verified_login(token: str):
+    """Логин из ранее проверенного токена или None"""
+    return _tokens.get(_token_key(token))
+
+
+def remember_token(token: str, login: str, exp):
+    """Запоминание проверенного токена до момента его истечения"""
+    if exp is None:
+        return
+    ttl = float(exp) - time.time()
+    if ttl > 0:
+        _tokens.set(_token_key(token), login, ttl=ttl)
+
+
+def _detached_copy(user: User) -> User:
+    """Копия строки пользователя, не привязанная к сессии БД"""
+    return User(
+        id=user.id,
+        login=user.login,
+        security_key=user.security_key,
+        is_active=user.is_active,
+        created_at=user.created_at,
+        last_login=user.last_login,
+    )
+
+
+async def get_user(db, login: str):
+    """Пользователь по логину: из кэша или из БД (найденная строка кэшируется)"""
+    user = _users.get(login)
+    if user is not None:
+        return _detached_copy(user)
+    user = (await db.execute(select(User).where(User.login == login))).scalars().first()
+    if user is None:
+        return None
+    _users.set(login, _detached_copy(user))
+    return user
+
+
+def invalidate_user(login: str):
+    _users.pop(login)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    # Сбрасываем и прежний логин, если он менялся (массовые query.update() события не вызывают)
+    history = inspect(target).attrs.login.history
+    for login in {target.login, *(history.deleted or ())}:
+        invalidate_user(login)
+
+
+def auth_cache_stats():
+    return {"tokens": _tokens.stats(), "users": _users.stats()}
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from pyrus import client
 
-from database import get_db, User
+from database import get_async_db, User
+from pyrus_async import run_in_pyrus_pool
+from pyrus_clients import CachedPyrusAPI
+from write_behind import user_writes
 from schemas import UserCreate, UserLogin, UserResponse, Token
 from auth_utils import (
     create_access_token, 
@@ -18,14 +21,14 @@ from auth_utils import (
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 @router.post("/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Регистрация нового пользователя"""
     # Очищаем пробелы из входных данных
     login_clean = user.login.strip()
     security_key_clean = user.security_key.strip()
     
     # Проверяем, существует ли пользователь
-    db_user = db.query(User).filter(User.login == login_clean).first()
+    db_user = (await db.execute(select(User).where(User.login == login_clean))).scalars().first()
     if db_user:
         raise HTTPException(
             status_code=400,
@@ -34,11 +37,12 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
     
     # Проверяем валидность учетных данных Pyrus
     try:
-        pyrus_client = client.PyrusAPI(
+        pyrus_client = CachedPyrusAPI(
             login=login_clean,
             security_key=security_key_clean
         )
-        auth_response = pyrus_client.auth()
+        # auth() — сетевой вызов, выполняем его вне цикла событий
+        auth_response = await run_in_pyrus_pool(pyrus_client.auth)
         if not auth_response.success:
             raise HTTPException(
                 status_code=400,
@@ -56,20 +60,20 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         security_key=security_key_clean  # Сохраняем ключ как есть для API Pyrus
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 @router.post("/login", response_model=Token)
-async def login(user: UserLogin, response: Response, db: Session = Depends(get_db)):
+async def login(user: UserLogin, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Авторизация пользователя"""
     # Очищаем пробелы из входных данных
     login_clean = user.login.strip()
     security_key_clean = user.security_key.strip()
     
     # Находим пользователя
-    db_user = db.query(User).filter(User.login == login_clean).first()
+    db_user = (await db.execute(select(User).where(User.login == login_clean))).scalars().first()
     if not db_user or security_key_clean != db_user.security_key:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -90,9 +94,8 @@ async def login(user: UserLogin, response: Response, db: Session = Depends(get_d
         data={"sub": db_user.login}, expires_delta=access_token_expires
     )
     
-    # Обновляем время последнего входа
-    db_user.last_login = datetime.utcnow()
-    db.commit()
+    # Время последнего входа пишется в фоне пакетом, не задерживая ответ
+    user_writes.update(db_user.id, last_login=datetime.utcnow())
     
     # Устанавливаем куки
     response.set_cookie(
@@ -122,7 +125,7 @@ async def read_users_me(current_user: User = Depends(get_current_active_user_fro
     return current_user
 
 @router.get("/users", response_model=list[UserResponse])
-async def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def read_users(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)):
     """Получение списка всех пользователей (только для админов)"""
-    users = db.query(User).offset(skip).limit(limit).all()
+    users = (await db.execute(select(User).offset(skip).limit(limit))).scalars().all()
     return users
@@ -4,16 +4,19 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 
-from database import get_db, User
+from database import get_async_db, User
 from schemas import TokenData
+from auth_cache import get_user, get_verified_login, remember_token
 
 # Настройки для JWT
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Логины администраторов через запятую: только им доступны /api/admin (статистика и сброс кэшей всех аккаунтов)
+ADMIN_LOGINS = {login.strip().lower() for login in os.getenv("ADMIN_LOGINS", "").split(",") if login.strip()}
 
 # Настройки для хеширования паролей
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -41,7 +44,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 def verify_token(token: str, credentials_exception):
-    """Проверка JWT токена"""
+    """Проверка JWT токена; уже проверенные токены берутся из кэша до истечения exp"""
+    login = get_verified_login(token)
+    if login is not None:
+        return TokenData(login=login)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         login: str = payload.get("sub")
@@ -50,6 +56,7 @@ def verify_token(token: str, credentials_exception):
         token_data = TokenData(login=login)
     except JWTError:
         raise credentials_exception
+    remember_token(token, login, payload.get("exp"))
     return token_data
 
 def get_token_from_cookie(request: Request) -> Optional[str]:
@@ -62,7 +69,7 @@ def get_token_from_cookie(request: Request) -> Optional[str]:
         return access_token
     return None
 
-def get_current_user_from_cookie(request: Request, db: Session = Depends(get_db)):
+async def get_current_user_from_cookie(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Получение текущего пользователя из куки"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -76,12 +83,12 @@ def get_current_user_from_cookie(request: Request, db: Session = Depends(get_db)
     
     token_data = verify_token(token, credentials_exception)
     
-    user = db.query(User).filter(User.login == token_data.login).first()
+    user = await get_user(db, token_data.login)
     if user is None:
         raise credentials_exception
     return user
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_async_db)):
     """Получение текущего пользователя из токена"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -92,19 +99,25 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     token = credentials.credentials
     token_data = verify_token(token, credentials_exception)
     
-    user = db.query(User).filter(User.login == token_data.login).first()
+    user = await get_user(db, token_data.login)
     if user is None:
         raise credentials_exception
     return user
 
-def get_current_active_user(current_user: User = Depends(get_current_user)):
+async def get_current_active_user(current_user: User = Depends(get_current_user)):
     """Получение активного пользователя"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-def get_current_active_user_from_cookie(current_user: User = Depends(get_current_user_from_cookie)):
+async def get_current_active_user_from_cookie(current_user: User = Depends(get_current_user_from_cookie)):
     """Получение активного пользователя из куки"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user_from_cookie)):
+    """Текущий пользователь, если он администратор (ADMIN_LOGINS)"""
+    if current_user.login.lower() not in ADMIN_LOGINS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав")
+    return current_user
@@ -0,0 +1,88 @@
+"""
+Сравнение сериализации ответа /api/catalogs/{catalog_id} на каталоге из 10 000 элементов:
+response_model (CatalogResponse) + stdlib json против быстрого пути fast_json
+
+Запуск из корня репозитория: python benchmarks/bench_catalog_json.py [--items 10000] [--repeat 5]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pyrus.models.responses import CatalogResponse as PyrusCatalogResponse
+
+import fast_json
+from catalog_items import catalog_payload
+from schemas import CatalogHeader, CatalogItem, CatalogResponse
+
+
+def make_catalog(items_count):
+    return PyrusCatalogResponse(
+        catalog_id=1,
+        source_type="user",
+        catalog_headers=[{"name": "Название", "type": "text"}, {"name": "Код", "type": "text"}, {"name": "Город", "type": "text"}],
+        items=[
+            {"item_id": 1000000 + i, "values": [f"Организация №{i}", f"ORG-{i:06d}", "Москва"]}
+            for i in range(items_count)
+        ],
+    )
+
+
+response_field = create_response_field(name="Response_get_catalog_by_id", type_=CatalogResponse)
+
+
+def model_path(catalog):
+    """Текущий путь обработчика: модели pydantic, повторная валидация response_model и json.dumps"""
+    model = CatalogResponse(
+        catalog_id=catalog.catalog_id,
+        items=[
+            CatalogItem(item_id=item.item_id, values=item.values, headers=getattr(item, "headers", None), rows=item.rows)
+            for item in catalog.items
+        ],
+        catalog_headers=[CatalogHeader(name=header.name, type=header.type) for header in catalog.catalog_headers],
+        source_type=catalog.source_type,
+    )
+    content = asyncio.run(serialize_response(field=response_field, response_content=model))
+    return JSONResponse(content).body
+
+
+def fast_path(catalog):
+    """Быстрый путь: словарь без валидации и orjson"""
+    return fast_json.dumps(catalog_payload(catalog))
+
+
+def measure(func, catalog, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = func(catalog)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    catalog = make_catalog(args.items)
+    model_time, model_size = measure(model_path, catalog, args.repeat)
+    fast_time, fast_size = measure(fast_path, catalog, args.repeat)
+
+    print(f"Элементов: {args.items}, orjson: {'да' if fast_json.orjson is not None else 'нет'}")
+    print(f"response_model + json: {model_time * 1000:8.1f} мс, {model_size} байт")
+    print(f"fast_json:             {fast_time * 1000:8.1f} мс, {fast_size} байт")
+    print(f"Ускорение: x{model_time / fast_time:.1f}")
+    # Повторные запросы той же версии каталога отдают уже сериализованное тело (entry.json_body)
+
+
+if __name__ == "__main__":
+    main()
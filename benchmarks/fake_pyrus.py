@@ -0,0 +1,256 @@
+"""
+Локальная замена Pyrus API для нагрузочных тестов: настраиваемые задержка, размеры данных и доля ошибок.
+Считает число запросов по методам (GET /__stats, сброс — POST /__reset)
+
+Запуск отдельно: python benchmarks/fake_pyrus.py --port 8900 --latency-ms 80
+Приложение направляется на него переменной PYRUS_BASE_URL=http://127.0.0.1:8900
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INBOX_FORM_ID = 829354
+FIRST_CATALOG_ID = 5000
+
+
+class FakePyrusData:
+    """Формы, каталоги и задачи, которые отдает сервер"""
+
+    def __init__(self, forms=3, catalog_items=1000, inbox_size=100, tasks=500, seed=1):
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.forms = {}
+        self.catalogs = {}
+        for index in range(forms):
+            form_id = INBOX_FORM_ID if index == 0 else INBOX_FORM_ID + index
+            catalog_id = FIRST_CATALOG_ID + index
+            self.forms[form_id] = {
+                "id": form_id,
+                "name": f"Форма {index + 1}",
+                "fields": [
+                    {"id": 1, "name": "Описание/ Description", "type": "text"},
+                    {"id": 2, "name": "Срок/Term", "type": "due_date_time"},
+                    {"id": 3, "name": "Этап/Stage", "type": "step"},
+                    {"id": 4, "name": "Клиент", "type": "catalog", "info": {"catalog_id": catalog_id}},
+                    {"id": 5, "name": "Сумма", "type": "money"},
+                ],
+            }
+            self.catalogs[catalog_id] = {
+                "catalog_id": catalog_id,
+                "source_type": "user",
+                "catalog_headers": [{"name": "Название", "type": "text"}, {"name": "Код", "type": "text"}],
+                "items": [
+                    {"item_id": catalog_id * 1000000 + i, "values": [f"Организация {i}", f"ORG-{i:06d}"]}
+                    for i in range(catalog_items)
+                ],
+            }
+
+        now = datetime.now(timezone.utc)
+        form_ids = list(self.forms)
+        self.tasks = {}
+        for task_id in range(1, tasks + 1):
+            form_id = form_ids[task_id % len(form_ids)] if task_id > inbox_size else INBOX_FORM_ID
+            self.tasks[task_id] = {
+                "id": task_id,
+                "text": f"Задача {task_id}",
+                "create_date": _iso(now - timedelta(days=30)),
+                "last_modified_date": _iso(now - timedelta(minutes=task_id)),
+                "form_id": form_id,
+                "author": {"id": 1, "first_name": "Нагрузочный", "last_name": "Тест"},
+                "responsible": {"id": 2, "first_name": "Исполнитель"},
+                "fields": [
+                    {"id": 1, "type": "text", "value": f"Описание задачи {task_id}"},
+                    {"id": 2, "type": "due_date_time", "value": _iso(now + timedelta(days=rng.randint(-5, 20)))},
+                    {"id": 3, "type": "step", "value": rng.randint(1, 3)},
+                    {"id": 5, "type": "money", "value": rng.randint(100, 100000)},
+                ],
+                "comments": [],
+            }
+        self.inbox_ids = list(range(1, inbox_size + 1))
+
+    def registry(self, form_id, body):
+        task_ids = body.get("task_ids")
+        if task_ids is not None:
+            tasks = [self.tasks[task_id] for task_id in task_ids if task_id in self.tasks]
+        else:
+            tasks = [task for task in self.tasks.values() if task["form_id"] == form_id]
+        field_ids = body.get("field_ids")
+        if field_ids:
+            tasks = [{**task, "fields": [field for field in task["fields"] if field["id"] in field_ids]} for task in tasks]
+        return {"tasks": tasks}
+
+    def comment(self, task_id, body):
+        with self.lock:
+            task = self.tasks[task_id]
+            comment_id = len(task["comments"]) + 1
+            task["comments"].append({"id": comment_id, "text": body.get("text"), "create_date": _iso(datetime.now(timezone.utc))})
+            task["last_modified_date"] = _iso(datetime.now(timezone.utc))
+            return {"task": task}
+
+
+def _iso(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakePyrusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data, latency_ms=50.0, jitter_ms=10.0, error_rate=0.0):
+        super().__init__(address, FakePyrusHandler)
+        self.data = data
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.errors = Counter()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key, error=False):
+        with self._stats_lock:
+            self.calls[key] += 1
+            if error:
+                self.errors[key] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {"calls": dict(self.calls), "errors": dict(self.errors), "total": sum(self.calls.values())}
+
+    def reset(self):
+        with self._stats_lock:
+            self.calls.clear()
+            self.errors.clear()
+
+
+class FakePyrusHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    ROUTES = [
+        ("POST", re.compile(r"^/v4/auth$"), "auth"),
+        ("GET", re.compile(r"^/v4/forms$"), "get_forms"),
+        ("GET", re.compile(r"^/v4/forms/(\d+)$"), "get_form"),
+        ("POST", re.compile(r"^/v4/forms/(\d+)/register$"), "get_registry"),
+        ("GET", re.compile(r"^/v4/catalogs/(\d+)$"), "get_catalog"),
+        ("GET", re.compile(r"^/v4/inbox$"), "get_inbox"),
+        ("GET", re.compile(r"^/v4/tasks/(\d+)$"), "get_task"),
+        ("POST", re.compile(r"^/v4/tasks/(\d+)/comments$"), "comment_task"),
+        ("POST", re.compile(r"^/v4/tasks$"), "create_task"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        path, _, query = self.path.partition("?")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        if path == "/__stats":
+            return self._send(200, self.server.stats())
+        if path == "/__reset":
+            self.server.reset()
+            return self._send(200, {"ok": True})
+
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(path) if route_method == method else None
+            if match:
+                break
+        else:
+            self.server.count("unknown", error=True)
+            return self._send(404, {"error": "not found", "error_code": "not_found"})
+
+        server = self.server
+        delay = max(0.0, server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)) / 1000
+        if delay:
+            time.sleep(delay)
+        if name != "auth" and random.random() < server.error_rate:
+            server.count(name, error=True)
+            return self._send(503, {"error": "Service temporarily unavailable", "error_code": "server_error"})
+        server.count(name)
+
+        data = server.data
+        arg = int(match.group(1)) if match.groups() else None
+        if name == "auth":
+            return self._send(200, {"access_token": "fake-token", "api_url": f"{server.base_url}/v4/"})
+        if name == "get_forms":
+            return self._send(200, {"forms": list(data.forms.values())})
+        if name == "get_form":
+            form = data.forms.get(arg)
+            return self._send(200, form) if form else self._send(404, {"error": "form not found", "error_code": "not_found"})
+        if name == "get_registry":
+            return self._send(200, data.registry(arg, body))
+        if name == "get_catalog":
+            catalog = data.catalogs.get(arg)
+            return self._send(200, catalog) if catalog else self._send(404, {"error": "catalog not found", "error_code": "not_found"})
+        if name == "get_inbox":
+            count = int(dict(part.split("=", 1) for part in query.split("&") if "=" in part).get("item_count", 50))
+            return self._send(200, {"tasks": [data.tasks[task_id] for task_id in data.inbox_ids[:count]]})
+        if name == "get_task":
+            task = data.tasks.get(arg)
+            return self._send(200, {"task": task}) if task else self._send(404, {"error": "task not found", "error_code": "not_found"})
+        if name == "comment_task":
+            if arg not in data.tasks:
+                return self._send(404, {"error": "task not found", "error_code": "not_found"})
+            return self._send(200, data.comment(arg, body))
+        if name == "create_task":
+            return self._send(200, {"task": {"id": max(data.tasks) + 1, "text": body.get("text")}})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def add_data_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="задержка ответа Pyrus")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="разброс задержки (±)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--forms", type=int, default=3)
+    parser.add_argument("--catalog-items", type=int, default=1000)
+    parser.add_argument("--inbox-size", type=int, default=100)
+    parser.add_argument("--tasks", type=int, default=500)
+
+
+def start_server(args, host="127.0.0.1", port=0) -> FakePyrusServer:
+    """Запуск сервера в фоновом потоке"""
+    data = FakePyrusData(forms=args.forms, catalog_items=args.catalog_items, inbox_size=args.inbox_size, tasks=max(args.tasks, args.inbox_size))
+    server = FakePyrusServer((host, port), data, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate)
+    threading.Thread(target=server.serve_forever, name="fake-pyrus", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_data_arguments(parser)
+    args = parser.parse_args()
+    server = start_server(args, args.host, args.port)
+    print(f"Fake Pyrus: {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
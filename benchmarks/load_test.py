@@ -0,0 +1,297 @@
+"""
+Сквозной нагрузочный тест: приложение (uvicorn) против локальной замены Pyrus (fake_pyrus.py).
+Смесь запросов /api/inbox_full, /api/tasks/{id}/form, /api/forms/{id}/task-form и комментариев;
+результат — JSON с p50/p95/p99, пропускной способностью и числом запросов к Pyrus.
+Ограничение запросов к Pyrus по умолчанию выключено (замеряется приложение, а не лимит);
+--rate-limit 10 — прогон с лимитом как в развертывании
+
+Запуск из корня репозитория:
+    python benchmarks/load_test.py --duration 30 --concurrency 20 --latency-ms 80
+    python benchmarks/load_test.py --rate-limit 10 --mix inbox_full=1
+    python benchmarks/load_test.py --env FAST_JSON_RESPONSES=1 --compare benchmarks/results/<файл>.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_pyrus import INBOX_FORM_ID, add_data_arguments, start_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = "inbox_full=40,task_form=30,form_template=20,comment=10"
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий {name!r}, доступны: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# Сценарий -> (метод, путь, тело); data — параметры фейкового Pyrus
+SCENARIOS = {
+    "inbox_full": lambda rng, data: ("GET", "/api/inbox_full?tasks_count=100", None),
+    "inbox_delta": lambda rng, data: ("GET", "/api/inbox_full?tasks_count=100&delta=true", None),
+    "task_form": lambda rng, data: ("GET", f"/api/tasks/{rng.randint(1, data.tasks)}/form", None),
+    "form_template": lambda rng, data: ("GET", f"/api/forms/{INBOX_FORM_ID + rng.randrange(data.forms)}/task-form", None),
+    "comment": lambda rng, data: (
+        "POST",
+        f"/api/tasks/{rng.randint(1, data.inbox_size)}/comment",
+        {"text": f"Нагрузочный комментарий {rng.random():.6f}", "action": None, "field_updates": None},
+    ),
+}
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, duration):
+    latencies = sorted(sample[1] for sample in samples)
+    errors = sum(1 for sample in samples if sample[2] >= 400 or sample[2] == 0)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "p50": _ms(percentile(latencies, 0.50)),
+            "p95": _ms(percentile(latencies, 0.95)),
+            "p99": _ms(percentile(latencies, 0.99)),
+            "max": _ms(latencies[-1] if latencies else None),
+            "mean": _ms(sum(latencies) / len(latencies) if latencies else None),
+        },
+        "bytes": sum(sample[3] for sample in samples),
+    }
+
+
+def _ms(value):
+    return None if value is None else round(value * 1000, 2)
+
+
+def start_app(args, pyrus_base_url, db_path):
+    env = {
+        **os.environ,
+        "PYRUS_BASE_URL": pyrus_base_url,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SECRET_KEY": "load-test-secret",
+        "PYRUS_RATE_LIMIT_PER_SECOND": str(args.rate_limit),
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(args.app_port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Приложение завершилось с кодом {process.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.app_port}/metrics", timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Приложение не запустилось за 30 секунд")
+
+
+def api_request(port, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        payload = json.dumps(body).encode() if body is not None else None
+        connection.request(method, path, body=payload, headers={"Content-Type": "application/json", **(headers or {})})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def login_users(args):
+    """Регистрация и вход пользователей нагрузочного теста; возвращает куки по пользователю"""
+    cookies = []
+    for index in range(args.users):
+        credentials = {"login": f"load{index}@example.com", "security_key": f"key-{index}"}
+        status, body = api_request(args.app_port, "POST", "/api/auth/register", credentials)
+        if status not in (200, 400):
+            raise RuntimeError(f"Регистрация: {status} {body[:200]!r}")
+        status, body = api_request(args.app_port, "POST", "/api/auth/login", credentials)
+        if status != 200:
+            raise RuntimeError(f"Вход: {status} {body[:200]!r}")
+        cookies.append(f"access_token=Bearer {json.loads(body)['access_token']}")
+    return cookies
+
+
+def worker(index, args, mix, cookies, stop_at, measure_from, samples, lock):
+    rng = random.Random(args.seed + index)
+    names, weights = list(mix), list(mix.values())
+    headers = {"Cookie": cookies[index % len(cookies)], "Accept-Encoding": "gzip", "Content-Type": "application/json"}
+    connection = http.client.HTTPConnection("127.0.0.1", args.app_port, timeout=60)
+    local = []
+    while True:
+        started = time.perf_counter()
+        if started >= stop_at:
+            break
+        scenario = rng.choices(names, weights)[0]
+        method, path, body = SCENARIOS[scenario](rng, args)
+        try:
+            connection.request(method, path, body=json.dumps(body).encode() if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            size = len(response.read())
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", args.app_port, timeout=60)
+            size, status = 0, 0
+        if started >= measure_from:
+            local.append((scenario, time.perf_counter() - started, status, size))
+    connection.close()
+    with lock:
+        samples.extend(local)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def format_rate_limit(value):
+    if value is None:
+        return "не записан"
+    return f"{value:g} в секунду" if value > 0 else "выключен"
+
+
+def compare(result, baseline_path):
+    """Разница с прошлым прогоном по ключевым показателям"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows = [("throughput_rps", result["overall"]["throughput_rps"], baseline["overall"]["throughput_rps"])]
+    for key in ("p50", "p95", "p99"):
+        rows.append((f"latency_{key}_ms", result["overall"]["latency_ms"][key], baseline["overall"]["latency_ms"][key]))
+    rows.append(("upstream_per_request", result["upstream"]["per_request"], baseline["upstream"]["per_request"]))
+    print(f"\nСравнение с {baseline_path} ({baseline.get('commit')}):")
+    current_limit, previous_limit = result["config"]["rate_limit"], baseline["config"].get("rate_limit")
+    print(f"  лимит запросов к Pyrus   {format_rate_limit(previous_limit)} -> {format_rate_limit(current_limit)}")
+    if previous_limit is not None and previous_limit != current_limit:
+        print("  Внимание: прогоны с разным лимитом запросов к Pyrus несопоставимы")
+    for name, current, previous in rows:
+        change = f"{(current - previous) / previous * 100:+.1f}%" if current is not None and previous else "n/a"
+        print(f"  {name:24} {previous!s:>10} -> {current!s:>10}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_data_arguments(parser)
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность замера, секунды")
+    parser.add_argument("--warmup", type=float, default=5.0, help="прогрев перед замером, секунды")
+    parser.add_argument("--concurrency", type=int, default=20, help="число одновременных клиентов")
+    parser.add_argument("--users", type=int, default=1, help="число пользователей (аккаунтов Pyrus)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"веса сценариев, по умолчанию {DEFAULT_MIX}")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="число процессов uvicorn")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="лимит запросов к Pyrus в секунду на аккаунт (PYRUS_RATE_LIMIT_PER_SECOND), 0 — без лимита")
+    parser.add_argument("--env", action="append", default=[], help="переменная окружения приложения KEY=VALUE")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл результата (по умолчанию benchmarks/results/load-<commit>-<время>.json)")
+    parser.add_argument("--compare", help="результат прошлого прогона для сравнения")
+    args = parser.parse_args()
+    args.tasks = max(args.tasks, args.inbox_size)
+    # --env PYRUS_RATE_LIMIT_PER_SECOND=... имеет приоритет; в отчет попадает действующее значение
+    for item in args.env:
+        key, _, value = item.partition("=")
+        if key == "PYRUS_RATE_LIMIT_PER_SECOND":
+            args.rate_limit = float(value)
+
+    server = start_server(args)
+    db_path = os.path.join(tempfile.mkdtemp(prefix="pyrus-load-"), "load.db")
+    app = start_app(args, server.base_url, db_path)
+    try:
+        cookies = login_users(args)
+        samples, lock = [], threading.Lock()
+        now = time.perf_counter()
+        measure_from = now + args.warmup
+        stop_at = measure_from + args.duration
+        # Счетчики Pyrus обнуляются после прогрева
+        threading.Timer(args.warmup, server.reset).start()
+        threads = [
+            threading.Thread(target=worker, args=(i, args, args.mix, cookies, stop_at, measure_from, samples, lock))
+            for i in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        upstream = server.stats()
+    finally:
+        app.terminate()
+        app.wait(timeout=10)
+        server.shutdown()
+
+    by_scenario = defaultdict(list)
+    for sample in samples:
+        by_scenario[sample[0]].append(sample)
+    overall = summarize(samples, args.duration)
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "duration": args.duration, "warmup": args.warmup, "concurrency": args.concurrency, "users": args.users,
+            "workers": args.workers, "mix": args.mix, "env": args.env, "rate_limit": args.rate_limit,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms, "error_rate": args.error_rate, "forms": args.forms,
+            "catalog_items": args.catalog_items, "inbox_size": args.inbox_size, "tasks": args.tasks,
+        },
+        "overall": overall,
+        "scenarios": {name: summarize(items, args.duration) for name, items in sorted(by_scenario.items())},
+        "upstream": {
+            **upstream,
+            "per_request": round(upstream["total"] / overall["requests"], 3) if overall["requests"] else None,
+        },
+    }
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"load-{commit or 'nogit'}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    latency = overall["latency_ms"]
+    print(f"Лимит запросов к Pyrus: {format_rate_limit(args.rate_limit)}")
+    print(f"{overall['requests']} запросов, {overall['throughput_rps']} rps, ошибок {overall['errors']}")
+    print(f"p50 {latency['p50']} мс, p95 {latency['p95']} мс, p99 {latency['p99']} мс")
+    for name, summary in result["scenarios"].items():
+        print(f"  {name:14} {summary['requests']:6} p50 {summary['latency_ms']['p50']:>8} p99 {summary['latency_ms']['p99']:>8} ошибок {summary['errors']}")
+    print(f"Запросов к Pyrus: {upstream['total']} ({result['upstream']['per_request']} на запрос) {upstream['calls']}")
+    print(f"Результат: {output}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Пакетные комментарии к задачам (смена этапа, изменение полей) с ограниченной параллельностью
+"""
+import asyncio
+import json
+import os
+
+import pyrus.models
+
+from http_cache import forget_task_version
+from pyrus_async import PYRUS_FANOUT_CONCURRENCY, AsyncPyrusClient, gather_limited
+from rate_limit import PRIORITY_BACKGROUND
+from schemas import BulkCommentResponse, BulkCommentResult
+
+# Сколько комментариев пакета отправляется в Pyrus одновременно (частоту дополнительно ограничивает rate_limit)
+BULK_COMMENT_CONCURRENCY = int(os.getenv("BULK_COMMENT_CONCURRENCY", str(PYRUS_FANOUT_CONCURRENCY)))
+
+
+async def comment_one(pyrus_client, index, item) -> BulkCommentResult:
+    """Комментарий к одной задаче; ошибка возвращается в результате, а не исключением"""
+    request = pyrus.models.requests.TaskCommentRequest(
+        text=item.text,
+        action=item.action,
+        field_updates=item.field_updates,
+    )
+    try:
+        response = await pyrus_client.comment_task(item.task_id, request)
+    except Exception as e:
+        return BulkCommentResult(index=index, task_id=item.task_id, ok=False, error=str(e))
+    finally:
+        # Задача могла измениться: прежняя версия больше не годится для ETag
+        forget_task_version(pyrus_client.account, item.task_id)
+
+    error_code = getattr(response, "error_code", None)
+    if error_code:
+        error = getattr(response, "error", None) or error_code
+        return BulkCommentResult(index=index, task_id=item.task_id, ok=False, error=str(error))
+    task = getattr(response, "task", None)
+    return BulkCommentResult(
+        index=index,
+        task_id=item.task_id,
+        ok=True,
+        last_modified_date=getattr(task, "last_modified_date", None),
+    )
+
+
+def _summary(results, total):
+    succeeded = sum(1 for result in results if result.ok)
+    return {"total": total, "succeeded": succeeded, "failed": len(results) - succeeded}
+
+
+def _worker_client(pyrus_client):
+    """Пакет идет с фоновым приоритетом, чтобы не вытеснять интерактивные запросы пользователей"""
+    return AsyncPyrusClient(pyrus_client.sync_client, account=pyrus_client.account, priority=PRIORITY_BACKGROUND)
+
+
+async def run_bulk_comments(pyrus_client, items) -> BulkCommentResponse:
+    """Все комментарии пакета; результаты в порядке элементов запроса"""
+    worker_client = _worker_client(pyrus_client)
+    try:
+        results = await gather_limited(
+            (comment_one(worker_client, index, item) for index, item in enumerate(items)),
+            limit=BULK_COMMENT_CONCURRENCY,
+        )
+    finally:
+        # Вызовы пакета учитываются в X-Pyrus-Calls запроса
+        pyrus_client.upstream_calls += worker_client.upstream_calls
+    return BulkCommentResponse(**_summary(results, len(items)), results=results)
+
+
+async def stream_bulk_comments(pyrus_client, items):
+    """
+    NDJSON: строка {"type": "result", ...} на каждую задачу по мере готовности и итоговая {"type": "summary", ...}.
+    Если клиент отключился, еще не начатые комментарии отменяются; уже отправленные в Pyrus завершаются
+    """
+    worker_client = _worker_client(pyrus_client)
+    semaphore = asyncio.Semaphore(BULK_COMMENT_CONCURRENCY)
+    started = set()
+
+    async def run(index, item):
+        async with semaphore:
+            started.add(index)
+            return await comment_one(worker_client, index, item)
+
+    tasks = {index: asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)}
+    results = []
+    try:
+        for next_done in asyncio.as_completed(tasks.values()):
+            result = await next_done
+            results.append(result)
+            yield json.dumps({"type": "result", **result.model_dump(mode="json")}, ensure_ascii=False) + "\n"
+        yield json.dumps({"type": "summary", **_summary(results, len(items))}, ensure_ascii=False) + "\n"
+    finally:
+        for index, task in tasks.items():
+            if index not in started:
+                task.cancel()
@@ -0,0 +1,113 @@
+"""
+Потокобезопасный LRU-кэш с ограничением времени жизни записей
+"""
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+class TTLCache:
+    """LRU-кэш с TTL, ограничением числа записей и (опционально) суммарного веса"""
+
+    # Все созданные кэши — для экспорта метрик
+    instances = weakref.WeakSet()
+
+    def __init__(self, max_entries=128, ttl=None, max_weight=None, weigher=None, sliding=False, name="cache"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigher = weigher
+        # sliding=True продлевает жизнь записи при каждом обращении (idle TTL)
+        self.sliding = sliding
+        self.name = name
+        self._data = OrderedDict()  # key -> [value, expires_at, weight, ttl]
+        self._weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        TTLCache.instances.add(self)
+
+    def get(self, key, default=None):
+        """Получение значения; просроченные записи удаляются"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            now = time.monotonic()
+            if entry[1] is not None and entry[1] <= now:
+                self._remove(key)
+                self.misses += 1
+                return default
+            if self.sliding and entry[3] is not None:
+                entry[1] = now + entry[3]
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Сохранение значения; ttl переопределяет TTL кэша для этой записи"""
+        ttl = self.ttl if ttl is None else ttl
+        weight = self.weigher(value) if self.weigher else 1
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            expires_at = time.monotonic() + ttl if ttl is not None else None
+            self._data[key] = [value, expires_at, weight, ttl]
+            self._weight += weight
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Удаление записи с возвратом значения"""
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def discard_where(self, predicate):
+        """Удаление всех записей, ключ которых удовлетворяет условию; возвращает их число"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def weight(self):
+        return self._weight
+
+    def stats(self):
+        """Статистика кэша для диагностики"""
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "weight": self._weight,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key):
+        value, _, weight, _ = self._data.pop(key)
+        self._weight -= weight
+        return value
+
+    def _evict(self):
+        # Вытесняем самые давно использованные записи, последнюю добавленную не трогаем
+        while len(self._data) > 1 and (
+            len(self._data) > self.max_entries
+            or (self.max_weight is not None and self._weight > self.max_weight)
+        ):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
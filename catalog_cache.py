@@ -0,0 +1,94 @@
+"""
+Общий для процесса кэш каталогов Pyrus
+"""
+import itertools
+import os
+import time
+
+from cache import TTLCache
+from server_timing import record_timing
+
+CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "256"))
+# Ограничение памяти: суммарное число элементов всех каталогов в кэше
+CATALOG_CACHE_MAX_ITEMS = int(os.getenv("CATALOG_CACHE_MAX_ITEMS", "500000"))
+
+_versions = itertools.count(1)
+
+
+class CachedCatalog:
+    """Каталог Pyrus вместе с номером версии и временем загрузки"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        # Версия меняется при каждой загрузке каталога из Pyrus
+        self.version = next(_versions)
+        self.fetched_at = time.time()
+        self._positions = None
+        # Поисковый индекс строится один раз для версии (см. catalog_search)
+        self.search_index_future = None
+        # Сериализованный ответ /api/catalogs/{catalog_id} (быстрый путь, см. fast_json)
+        self.json_body = None
+
+    @property
+    def error_code(self):
+        return getattr(self.catalog, "error_code", None)
+
+    @property
+    def items_count(self):
+        return len(self.catalog.items) if self.catalog.items else 0
+
+    def position_of(self, item_id):
+        """Позиция элемента в каталоге по item_id (индекс строится при первом обращении)"""
+        if self._positions is None:
+            self._positions = {item.item_id: position for position, item in enumerate(self.catalog.items or [])}
+        return self._positions.get(item_id)
+
+
+_catalogs = TTLCache(
+    max_entries=CATALOG_CACHE_MAX_ENTRIES,
+    ttl=CATALOG_CACHE_TTL_SECONDS,
+    max_weight=CATALOG_CACHE_MAX_ITEMS,
+    weigher=lambda entry: max(entry.items_count, 1),
+    name="catalogs",
+)
+
+
+async def get_catalog_entry(pyrus_client, catalog_id: int) -> CachedCatalog:
+    """Получение каталога через кэш по ключу (аккаунт, catalog_id); ответы с ошибкой не кэшируются"""
+    key = (pyrus_client.account, catalog_id)
+    started = time.perf_counter()
+    entry = _catalogs.get(key)
+    record_timing("cache.catalogs", time.perf_counter() - started, f"{'hit' if entry is not None else 'miss'} {catalog_id}", started)
+    if entry is not None:
+        return entry
+
+    entry = CachedCatalog(await pyrus_client.get_catalog(catalog_id))
+    if not entry.error_code:
+        _catalogs.set(key, entry)
+    return entry
+
+
+def store_catalog(account, catalog_id: int, catalog) -> CachedCatalog:
+    """Помещение в кэш каталога, загруженного в фоне (например, при обновлении сводок)"""
+    entry = CachedCatalog(catalog)
+    if not entry.error_code:
+        _catalogs.set((account, catalog_id), entry)
+    return entry
+
+
+async def get_cached_catalog(pyrus_client, catalog_id: int):
+    """Получение ответа Pyrus с каталогом через кэш"""
+    entry = await get_catalog_entry(pyrus_client, catalog_id)
+    return entry.catalog
+
+
+def invalidate_catalogs(catalog_id=None, account=None) -> int:
+    """Сброс кэша каталогов; без аргументов очищается весь кэш. Возвращает число удаленных записей"""
+    return _catalogs.discard_where(
+        lambda key: (catalog_id is None or key[1] == catalog_id) and (account is None or key[0] == account)
+    )
+
+
+def catalog_cache_stats():
+    return _catalogs.stats()
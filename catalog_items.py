@@ -0,0 +1,131 @@
+"""
+Постраничная и потоковая выдача элементов каталога без построения всего ответа в памяти
+"""
+import base64
+import json
+
+CATALOG_ITEMS_DEFAULT_LIMIT = 500
+CATALOG_ITEMS_MAX_LIMIT = 5000
+# Сколько строк NDJSON отправляется одним фрагментом ответа
+NDJSON_CHUNK_ROWS = 200
+
+
+class CursorError(ValueError):
+    """Элемент, на который указывает курсор, удален из каталога"""
+
+
+def encode_cursor(offset, item_id):
+    raw = f"{offset}:{item_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def resolve_cursor(entry, cursor):
+    """Позиция в каталоге, с которой продолжается выдача"""
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset, item_id = base64.urlsafe_b64decode(padded.encode()).decode().split(":", 1)
+        offset, item_id = int(offset), int(item_id)
+    except Exception:
+        raise ValueError("Некорректный курсор")
+
+    items = entry.catalog.items or []
+    # Быстрый путь: каталог не менялся и элемент на прежнем месте
+    if 0 < offset <= len(items) and items[offset - 1].item_id == item_id:
+        return offset
+    position = entry.position_of(item_id)
+    if position is None:
+        raise CursorError("Элемент курсора удален из каталога, начните выдачу заново")
+    return position + 1
+
+
+def catalog_payload(catalog) -> dict:
+    """Каталог целиком в виде словаря по схеме CatalogResponse"""
+    return {
+        "catalog_id": catalog.catalog_id,
+        "items": [
+            {
+                "item_id": getattr(item, "item_id", None),
+                "values": getattr(item, "values", None),
+                "headers": getattr(item, "headers", None),
+                "rows": getattr(item, "rows", None),
+            }
+            for item in (catalog.items or [])
+        ],
+        "catalog_headers": [
+            {"name": header.name, "type": header.type}
+            for header in (catalog.catalog_headers or [])
+        ],
+        "source_type": catalog.source_type,
+    }
+
+
+def resolve_columns(catalog, columns):
+    """Индексы столбцов по списку имен заголовков или номеров через запятую; None — все столбцы"""
+    if not columns:
+        return None
+    header_names = [header.name for header in (catalog.catalog_headers or [])]
+    indexes = []
+    for column in columns.split(","):
+        column = column.strip()
+        if not column:
+            continue
+        if column.isdigit():
+            index = int(column)
+        elif column in header_names:
+            index = header_names.index(column)
+        else:
+            raise ValueError(f"Неизвестный столбец: {column}")
+        if index >= len(header_names):
+            raise ValueError(f"Неизвестный столбец: {column}")
+        indexes.append(index)
+    return indexes
+
+
+def project_headers(catalog, column_indexes):
+    headers = [{"name": header.name, "type": header.type} for header in (catalog.catalog_headers or [])]
+    if column_indexes is None:
+        return headers
+    return [headers[index] for index in column_indexes]
+
+
+def iter_item_rows(catalog, start, stop, column_indexes=None):
+    """Генератор строк {"item_id", "values"} для элементов [start, stop)"""
+    items = catalog.items or []
+    for position in range(start, min(stop, len(items))):
+        item = items[position]
+        values = getattr(item, "values", None) or []
+        if column_indexes is not None:
+            values = [values[index] if index < len(values) else None for index in column_indexes]
+        yield {"item_id": item.item_id, "values": values}
+
+
+def build_items_page(entry, start, limit, column_indexes=None):
+    """Одна страница элементов каталога с курсором на следующую"""
+    catalog = entry.catalog
+    rows = list(iter_item_rows(catalog, start, start + limit, column_indexes))
+    stop = start + len(rows)
+    next_cursor = None
+    if rows and stop < entry.items_count:
+        next_cursor = encode_cursor(stop, rows[-1]["item_id"])
+    return {
+        "catalog_id": catalog.catalog_id,
+        "headers": project_headers(catalog, column_indexes),
+        "items": rows,
+        "total_count": entry.items_count,
+        "next_cursor": next_cursor,
+    }
+
+
+def iter_items_ndjson(entry, start, limit=None, column_indexes=None):
+    """Потоковая выдача элементов в формате NDJSON, фрагментами по NDJSON_CHUNK_ROWS строк"""
+    stop = entry.items_count if limit is None else start + limit
+    chunk = []
+    for row in iter_item_rows(entry.catalog, start, stop, column_indexes):
+        chunk.append(json.dumps(row, ensure_ascii=False))
+        if len(chunk) >= NDJSON_CHUNK_ROWS:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
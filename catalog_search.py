@@ -0,0 +1,128 @@
+"""
+Поисковый индекс по элементам каталога для выпадающих списков: префиксы слов и триграммы
+"""
+import asyncio
+import bisect
+import heapq
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+CATALOG_SEARCH_DEFAULT_LIMIT = 20
+CATALOG_SEARCH_MAX_LIMIT = 200
+# Минимальная доля совпавших триграмм для нечеткого совпадения
+TRIGRAM_MIN_SIMILARITY = 0.5
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Построение индекса нагружает CPU, поэтому не занимает потоки ввода-вывода Pyrus
+_index_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="catalog-index")
+
+
+def normalize(text):
+    return (text or "").casefold().replace("ё", "е")
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CatalogSearchIndex:
+    """Индекс по значениям элементов одной версии каталога"""
+
+    def __init__(self, catalog):
+        self.items = catalog.items or []
+        self.texts = []
+        self.values = []  # нормализованные значения элемента для точного совпадения
+        # Отсортированный список (слово, позиция элемента) для поиска по префиксу через bisect
+        self.tokens = []
+        self.trigram_postings = defaultdict(list)
+
+        for position, item in enumerate(self.items):
+            values = [normalize(value).strip() for value in (getattr(item, "values", None) or []) if value]
+            text = " ".join(values)
+            self.texts.append(text)
+            self.values.append(frozenset(values))
+            for token in set(_TOKEN_RE.findall(text)):
+                self.tokens.append((token, position))
+            for trigram in trigrams(text):
+                self.trigram_postings[trigram].append(position)
+        self.tokens.sort()
+
+    def _prefix_matches(self, prefix):
+        """Позиции элементов, содержащих слово с указанным префиксом"""
+        matches = set()
+        index = bisect.bisect_left(self.tokens, (prefix, -1))
+        while index < len(self.tokens) and self.tokens[index][0].startswith(prefix):
+            matches.add(self.tokens[index][1])
+            index += 1
+        return matches
+
+    def search(self, query, limit=CATALOG_SEARCH_DEFAULT_LIMIT):
+        """Лучшие limit совпадений: [(score, position)] по убыванию релевантности"""
+        query = normalize(query).strip()
+        if not query:
+            return []
+
+        scores = {}
+
+        # Каждое слово запроса должно быть префиксом какого-нибудь слова элемента
+        query_tokens = _TOKEN_RE.findall(query)
+        candidates = None
+        for token in query_tokens:
+            matches = self._prefix_matches(token)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                break
+        for position in candidates or ():
+            text = self.texts[position]
+            if text == query or query in self.values[position]:
+                scores[position] = 100.0
+            elif text.startswith(query):
+                scores[position] = 80.0
+            else:
+                scores[position] = 60.0
+
+        # Нечеткий поиск по триграммам (опечатки, часть слова в середине)
+        query_trigrams = trigrams(query)
+        if len(query) >= 3:
+            shared = Counter()
+            for trigram in query_trigrams:
+                for position in self.trigram_postings.get(trigram, ()):
+                    shared[position] += 1
+            for position, count in shared.items():
+                similarity = count / len(query_trigrams)
+                if similarity >= TRIGRAM_MIN_SIMILARITY:
+                    scores[position] = max(scores.get(position, 0.0), 40.0 * similarity)
+
+        # При равной релевантности выше более короткие значения
+        return heapq.nlargest(
+            limit,
+            ((score, position) for position, score in scores.items()),
+            key=lambda match: (match[0], -len(self.texts[match[1]]), -match[1]),
+        )
+
+
+async def get_search_index(entry) -> CatalogSearchIndex:
+    """Индекс для версии каталога из кэша; строится один раз в отдельном потоке"""
+    if entry.search_index_future is None:
+        entry.search_index_future = _index_executor.submit(CatalogSearchIndex, entry.catalog)
+    try:
+        return await asyncio.wrap_future(entry.search_index_future)
+    except Exception:
+        entry.search_index_future = None
+        raise
+
+
+async def search_catalog(entry, query, limit=CATALOG_SEARCH_DEFAULT_LIMIT):
+    """Поиск по каталогу: элементы с оценкой релевантности"""
+    index = await get_search_index(entry)
+    return [
+        {
+            "item_id": index.items[position].item_id,
+            "values": getattr(index.items[position], "values", None),
+            "score": round(score, 2),
+        }
+        for score, position in index.search(query, limit)
+    ]
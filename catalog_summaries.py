@@ -0,0 +1,154 @@
+"""
+Сводки каталогов для GET /api/catalogs: хранятся в памяти по аккаунтам и обновляются фоновой задачей
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+from catalog_cache import store_catalog
+from pyrus_async import gather_limited
+from pyrus_clients import get_background_client
+from schemas import CatalogHeader, CatalogSummary
+
+CATALOG_SUMMARY_REFRESH_SECONDS = float(os.getenv("CATALOG_SUMMARY_REFRESH_SECONDS", "300"))
+# Сводки аккаунта, к которым не обращались дольше этого времени, перестают обновляться и удаляются
+CATALOG_SUMMARY_IDLE_TTL_SECONDS = float(os.getenv("CATALOG_SUMMARY_IDLE_TTL_SECONDS", "3600"))
+
+
+def collect_catalog_fields(forms):
+    """catalog_id -> имя первого поля формы, ссылающегося на каталог"""
+    catalog_names = {}
+    for form in forms or []:
+        for field in getattr(form, "fields", None) or []:
+            if getattr(field, "type", None) != "catalog":
+                continue
+            catalog_info = getattr(field, "info", None)
+            catalog_id = getattr(catalog_info, "catalog_id", None) if catalog_info else None
+            if catalog_id and catalog_id not in catalog_names:
+                catalog_names[catalog_id] = field.name
+    return catalog_names
+
+
+def build_catalog_summary(catalog, name):
+    headers = [
+        CatalogHeader(name=header.name, type=header.type)
+        for header in (catalog.catalog_headers or [])
+    ]
+    return CatalogSummary(
+        id=catalog.catalog_id,
+        name=name,
+        items_count=len(catalog.items) if catalog.items else 0,
+        headers_count=len(headers),
+        source_type=catalog.source_type or "default",
+        headers=headers,
+    )
+
+
+class CatalogSummaryTable:
+    """Материализованные сводки каталогов одного аккаунта"""
+
+    def __init__(self, account):
+        self.account = account
+        self.pyrus_client = None
+        self.summaries = []
+        self.updated_at = None
+        self.last_access = time.monotonic()
+        self.last_error = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def age_seconds(self):
+        if self.updated_at is None:
+            return None
+        return (datetime.now(timezone.utc) - self.updated_at).total_seconds()
+
+    async def refresh(self, only_if_empty=False, pyrus_client=None):
+        """Полный пересчет сводок; при ошибке остаются прежние данные"""
+        pyrus_client = pyrus_client or self.pyrus_client
+        async with self.lock:
+            if only_if_empty and self.updated_at is not None:
+                # Сводки уже загрузил параллельный запрос
+                return
+            try:
+                forms_response = await pyrus_client.get_forms()
+                if forms_response.error_code:
+                    raise RuntimeError(f"Ошибка получения форм: {forms_response.error_code}")
+                catalog_names = collect_catalog_fields(forms_response.forms)
+
+                catalog_ids = list(catalog_names)
+                results = await gather_limited(
+                    pyrus_client.get_catalog(catalog_id) for catalog_id in catalog_ids
+                )
+                summaries = []
+                for catalog_id, catalog in zip(catalog_ids, results):
+                    if isinstance(catalog, Exception):
+                        print(f"Ошибка получения каталога {catalog_id}: {str(catalog)}")
+                        continue
+                    if catalog.error_code:
+                        print(f"Ошибка получения каталога {catalog_id}: {catalog.error_code}")
+                        continue
+                    # Свежие каталоги заодно прогревают общий кэш каталогов
+                    store_catalog(self.account, catalog_id, catalog)
+                    summaries.append(build_catalog_summary(catalog, catalog_names[catalog_id]))
+
+                self.summaries = summaries
+                self.updated_at = datetime.now(timezone.utc)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Ошибка обновления сводок каталогов {self.account}: {str(e)}")
+                if self.updated_at is None:
+                    raise
+
+
+_tables = {}
+
+
+async def get_catalog_summaries(pyrus_client) -> CatalogSummaryTable:
+    """Сводки каталогов аккаунта; при первом обращении загружаются сразу, дальше — в фоне"""
+    table = _tables.get(pyrus_client.account)
+    if table is None:
+        table = _tables[pyrus_client.account] = CatalogSummaryTable(pyrus_client.account)
+    table.last_access = time.monotonic()
+    if table.updated_at is None:
+        # Первая загрузка идет через клиент запроса, чтобы ее вызовы учитывались в X-Pyrus-Calls
+        await table.refresh(only_if_empty=True, pyrus_client=pyrus_client)
+    return table
+
+
+async def refresh_catalog_summaries_forever():
+    """Фоновая задача: периодическое обновление сводок активных аккаунтов"""
+    while True:
+        await asyncio.sleep(CATALOG_SUMMARY_REFRESH_SECONDS)
+        now = time.monotonic()
+        for account, table in list(_tables.items()):
+            if now - table.last_access > CATALOG_SUMMARY_IDLE_TTL_SECONDS:
+                del _tables[account]
+                continue
+            try:
+                # Актуальный ключ пользователя: после смены ключа или вытеснения из реестра клиент создается заново
+                table.pyrus_client = await get_background_client(account, table.pyrus_client)
+            except Exception as e:
+                table.last_error = str(e)
+                print(f"Сводки каталогов: нет клиента Pyrus для {account}: {str(e)}")
+                continue
+            try:
+                await table.refresh()
+            except Exception:
+                pass
+
+
+def catalog_summary_stats():
+    return {
+        "accounts": len(_tables),
+        "tables": [
+            {
+                "account": table.account,
+                "catalogs": len(table.summaries),
+                "age_seconds": table.age_seconds,
+                "last_error": table.last_error,
+            }
+            for table in _tables.values()
+        ],
+    }
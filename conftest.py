@@ -0,0 +1,7 @@
+"""
+Общие настройки тестов: временная база вместо pyrus_users.db (задается до импорта database)
+"""
+import os
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="pyrus-tests-"), "test.db"))
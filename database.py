@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, JSON, Index
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -7,15 +8,47 @@ import os
 # Получаем URL базы данных из переменных окружения
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./pyrus_users.db")
 
+# Настройки пула соединений (для PostgreSQL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Проверка соединения перед выдачей из пула и пересоздание соединений старше DB_POOL_RECYCLE секунд
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def get_async_database_url(url: str) -> str:
+    """URL базы данных с асинхронным драйвером (asyncpg / aiosqlite)"""
+    if url.startswith("postgresql"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+ASYNC_DATABASE_URL = get_async_database_url(DATABASE_URL)
+
 # Создание движка базы данных
 if DATABASE_URL.startswith("postgresql"):
     # Для PostgreSQL
-    engine = create_engine(DATABASE_URL)
+    pool_options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    engine = create_engine(DATABASE_URL, **pool_options)
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options)
 else:
     # Для SQLite (fallback)
     engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
 
+# Синхронные сессии — для скриптов (init_user, migrate) и alembic
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Асинхронные сессии — для обработчиков запросов
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -29,6 +62,40 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     last_login = Column(DateTime)
 
+class TaskMirror(Base):
+    """Локальная копия задач Pyrus (основные атрибуты и значения ключевых полей) по аккаунту"""
+    __tablename__ = "task_mirror"
+
+    account = Column(String, primary_key=True)
+    task_id = Column(Integer, primary_key=True)
+    form_id = Column(Integer, nullable=False)
+    step = Column(Integer)
+    due = Column(DateTime)  # UTC
+    closed = Column(Boolean, default=False, nullable=False)
+    responsible_id = Column(Integer)
+    create_date = Column(DateTime)
+    last_modified_date = Column(DateTime, nullable=False)
+    fields = Column(JSON)  # id поля -> значение
+    synced_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_task_mirror_form_modified", "account", "form_id", "last_modified_date"),
+        Index("ix_task_mirror_form_step", "account", "form_id", "closed", "step"),
+        Index("ix_task_mirror_form_due", "account", "form_id", "due"),
+    )
+
+class TaskMirrorSync(Base):
+    """Состояние синхронизации зеркала задач для формы аккаунта"""
+    __tablename__ = "task_mirror_sync"
+
+    account = Column(String, primary_key=True)
+    form_id = Column(Integer, primary_key=True)
+    cursor = Column(DateTime)  # наибольший last_modified_date среди полученных задач
+    last_sync_at = Column(DateTime)  # окончание последней успешной синхронизации
+    last_full_sync_at = Column(DateTime)
+    last_error = Column(String)
+    task_count = Column(Integer, default=0)
+
 # Создание таблиц
 Base.metadata.create_all(bind=engine)
 
@@ -38,3 +105,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
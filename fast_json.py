@@ -0,0 +1,44 @@
+"""
+Быстрая сериализация больших ответов: orjson (если установлен) без повторной валидации через response_model
+"""
+import datetime
+import json
+import os
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+# Включение быстрого пути для /api/tasks, /api/inbox и /api/catalogs/{catalog_id}
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "0") == "1"
+
+
+def _default(obj):
+    """Сериализация того, что не поддерживает кодировщик: модели pyrus и pydantic, даты"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "__dict__"):
+        # Модели pyrus — простые объекты с атрибутами, как их отдает jsonable_encoder
+        return vars(obj)
+    raise TypeError(f"Тип {type(obj).__name__} не сериализуется в JSON")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ, который сериализует данные как есть, без jsonable_encoder"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,136 @@
+"""
+Кэш определений форм Pyrus с предвычисленными индексами полей
+"""
+import itertools
+import os
+import time
+from collections import defaultdict
+
+from cache import TTLCache
+from server_timing import record_timing
+
+# Через это время определение формы перезапрашивается у Pyrus
+FORM_CACHE_TTL_SECONDS = int(os.getenv("FORM_CACHE_TTL_SECONDS", "600"))
+FORM_CACHE_MAX_ENTRIES = int(os.getenv("FORM_CACHE_MAX_ENTRIES", "512"))
+
+_versions = itertools.count(1)
+
+
+class FormSchema:
+    """Определение формы с индексами: имя → id, id → поле, тип → поля"""
+
+    def __init__(self, form):
+        self.form = form
+        self.version = next(_versions)
+        self.fetched_at = time.monotonic()
+        self.field_ids_by_name = {}
+        self.fields_by_id = {}
+        self.fields_by_type = defaultdict(list)
+
+        # flat_fields включает вложенные поля (заголовки, таблицы, поля вариантов выбора)
+        flat_fields = getattr(form, "flat_fields", None) or getattr(form, "fields", None) or []
+        for field in flat_fields:
+            if field.id is None:
+                continue
+            self.fields_by_id.setdefault(field.id, field)
+            if field.name:
+                self.field_ids_by_name.setdefault(field.name, field.id)
+            if field.type:
+                self.fields_by_type[field.type].append(field)
+
+    @property
+    def error_code(self):
+        return getattr(self.form, "error_code", None)
+
+    @property
+    def fields(self):
+        """Поля верхнего уровня в порядке формы"""
+        return getattr(self.form, "fields", None) or []
+
+    @property
+    def is_stale(self):
+        return time.monotonic() - self.fetched_at >= FORM_CACHE_TTL_SECONDS
+
+    def field_id(self, name):
+        return self.field_ids_by_name.get(name)
+
+    def field(self, field_id):
+        return self.fields_by_id.get(field_id)
+
+    def fields_of_type(self, field_type):
+        return self.fields_by_type.get(field_type, [])
+
+
+_schemas = TTLCache(max_entries=FORM_CACHE_MAX_ENTRIES, name="forms")
+# Список форм аккаунта (GET /forms): версия записи служит валидатором ответа /api/forms
+_form_lists = TTLCache(max_entries=FORM_CACHE_MAX_ENTRIES, ttl=FORM_CACHE_TTL_SECONDS, name="form_lists")
+
+
+class FormList:
+    """Ответ Pyrus со списком форм и номером версии"""
+
+    def __init__(self, response):
+        self.response = response
+        self.version = next(_versions)
+
+    @property
+    def error_code(self):
+        return getattr(self.response, "error_code", None)
+
+    @property
+    def forms(self):
+        return getattr(self.response, "forms", None) or []
+
+
+async def get_form_schema(pyrus_client, form_id: int) -> FormSchema:
+    """
+    Получение определения формы через кэш по ключу (аккаунт, form_id).
+    Устаревшая запись перезапрашивается; если Pyrus недоступен, отдается последняя известная версия
+    """
+    key = (pyrus_client.account, form_id)
+    started = time.perf_counter()
+    schema = _schemas.get(key)
+    fresh = schema is not None and not schema.is_stale
+    record_timing("cache.forms", time.perf_counter() - started, f"{'hit' if fresh else 'miss'} {form_id}", started)
+    if fresh:
+        return schema
+
+    try:
+        form = await pyrus_client.get_form(form_id)
+    except Exception:
+        if schema is not None:
+            return schema
+        raise
+
+    fresh_schema = FormSchema(form)
+    if fresh_schema.error_code:
+        return fresh_schema
+    _schemas.set(key, fresh_schema)
+    return fresh_schema
+
+
+async def get_form_list(pyrus_client) -> FormList:
+    """Список форм аккаунта через кэш; ответы с ошибкой не кэшируются"""
+    started = time.perf_counter()
+    form_list = _form_lists.get(pyrus_client.account)
+    record_timing("cache.form_lists", time.perf_counter() - started, "hit" if form_list is not None else "miss", started)
+    if form_list is not None:
+        return form_list
+
+    form_list = FormList(await pyrus_client.get_forms())
+    if not form_list.error_code:
+        _form_lists.set(pyrus_client.account, form_list)
+    return form_list
+
+
+def invalidate_forms(form_id=None, account=None) -> int:
+    """Сброс кэша форм; без аргументов очищается весь кэш. Возвращает число удаленных записей"""
+    # Список форм содержит и саму форму, поэтому сбрасывается вместе с ней
+    _form_lists.discard_where(lambda key: account is None or key == account)
+    return _schemas.discard_where(
+        lambda key: (form_id is None or key[1] == form_id) and (account is None or key[0] == account)
+    )
+
+
+def form_cache_stats():
+    return _schemas.stats()
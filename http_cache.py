@@ -0,0 +1,159 @@
+"""
+HTTP-кэширование ответов на чтение: ETag / If-None-Match (304) и gzip-сжатие больших ответов
+"""
+import gzip
+import hashlib
+import os
+import re
+
+from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+
+from cache import TTLCache
+
+# Ответы меньше этого размера не сжимаются
+HTTP_GZIP_MIN_SIZE = int(os.getenv("HTTP_GZIP_MIN_SIZE", "1024"))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", "5"))
+# Данные пользовательские, поэтому кэш только в браузере и с обязательной перепроверкой
+CACHE_CONTROL = "private, no-cache"
+
+# Пути, для ответов которых ETag вычисляется по содержимому, если обработчик не задал его сам
+CACHEABLE_PATHS = [
+    re.compile(r"^/api/forms(/.*)?$"),
+    re.compile(r"^/api/catalogs(/.*)?$"),
+    re.compile(r"^/api/tasks/\d+/form$"),
+]
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# Ответы этих типов отдаются потоком: заголовки и данные передаются без задержки
+STREAMING_TYPES = ("text/event-stream", "application/x-ndjson")
+
+# Сколько известная версия задачи (last_modified_date) служит валидатором без запроса к Pyrus.
+# Изменения через приложение и замеченные опросом inbox сбрасывают версию сразу
+TASK_VERSION_TTL_SECONDS = int(os.getenv("TASK_VERSION_TTL_SECONDS", "30"))
+TASK_VERSION_MAX_ENTRIES = int(os.getenv("TASK_VERSION_MAX_ENTRIES", "10000"))
+
+_task_versions = TTLCache(max_entries=TASK_VERSION_MAX_ENTRIES, ttl=TASK_VERSION_TTL_SECONDS, name="task_versions")
+
+
+def make_etag(*parts) -> str:
+    """Слабый ETag из версий данных в серверном кэше (или любых других частей)"""
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match, etag) -> bool:
+    """Сравнение ETag с заголовком If-None-Match (слабое сравнение, как требует RFC 9110)"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def not_modified(request: Request, etag: str):
+    """Ответ 304, если у клиента актуальная версия, иначе None"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+
+def set_validators(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def remember_task_version(account, task_id, form_id, last_modified_date):
+    """Версия задачи, полученной из Pyrus, для проверки If-None-Match без повторного запроса"""
+    if last_modified_date is not None:
+        _task_versions.set((account, task_id), (form_id, last_modified_date))
+
+
+def known_task_version(account, task_id):
+    """(form_id, last_modified_date) недавно полученной задачи или None"""
+    return _task_versions.get((account, task_id))
+
+
+def forget_task_version(account, task_id, last_modified_date=None):
+    """Сброс версии задачи: после изменения или если известна более новая last_modified_date"""
+    known = _task_versions.get((account, task_id))
+    if known is not None and (last_modified_date is None or known[1] != last_modified_date):
+        _task_versions.pop((account, task_id))
+
+
+class HTTPCacheMiddleware:
+    """
+    Условные ответы и сжатие для обычных (не потоковых) ответов.
+    Потоковые ответы (SSE, NDJSON) пропускаются без изменений, чтобы не задерживать события
+    """
+
+    def __init__(self, app, minimum_size=HTTP_GZIP_MIN_SIZE, compresslevel=HTTP_GZIP_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        accepts_gzip = "gzip" in request_headers.get("accept-encoding", "")
+        if_none_match = request_headers.get("if-none-match")
+        cacheable = scope["method"] == "GET" and any(path.match(scope["path"]) for path in CACHEABLE_PATHS)
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                if Headers(raw=message.get("headers", [])).get("content-type", "").startswith(STREAMING_TYPES):
+                    # SSE и NDJSON: заголовки уходят сразу, не дожидаясь первого события
+                    passthrough = True
+                    await send(message)
+                    return
+                # Заголовки отправим, когда станет ясно, обычный это ответ или потоковый
+                start_message = message
+                return
+            passthrough = True
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                start_message, message = self._process(
+                    start_message, message.get("body", b""), accepts_gzip, if_none_match, cacheable
+                )
+            await send(start_message)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _process(self, start_message, body, accepts_gzip, if_none_match, cacheable):
+        status = start_message["status"]
+        headers = MutableHeaders(raw=list(start_message.get("headers", [])))
+
+        if status == 200 and cacheable:
+            if "etag" not in headers:
+                headers["ETag"] = make_etag(hashlib.sha1(body).hexdigest())
+            if "cache-control" not in headers:
+                headers["Cache-Control"] = CACHE_CONTROL
+            if etag_matches(if_none_match, headers["etag"]):
+                for name in ("content-length", "content-type", "content-encoding"):
+                    if name in headers:
+                        del headers[name]
+                return {**start_message, "status": 304, "headers": headers.raw}, {"type": "http.response.body", "body": b""}
+
+        content_type = headers.get("content-type", "")
+        if (
+            status == 200
+            and accepts_gzip
+            and len(body) >= self.minimum_size
+            and "content-encoding" not in headers
+            and content_type.startswith(COMPRESSIBLE_TYPES)
+        ):
+            body = gzip.compress(body, compresslevel=self.compresslevel)
+            headers["Content-Encoding"] = "gzip"
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+
+        return {**start_message, "headers": headers.raw}, {"type": "http.response.body", "body": body}
@@ -0,0 +1,311 @@
+"""
+Расширенный inbox (дедлайн, этап, заморозка, цвет) и снапшоты для инкрементальной синхронизации
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pyrus.models
+
+from cache import TTLCache
+from form_cache import get_form_schema
+from http_cache import forget_task_version
+
+INBOX_FORM_ID = 829354
+# Сколько версий назад хранятся сведения об удаленных задачах; более старый sync_token ведет к полной выдаче
+INBOX_TOMBSTONE_VERSIONS = int(os.getenv("INBOX_TOMBSTONE_VERSIONS", "100"))
+INBOX_SNAPSHOT_IDLE_TTL_SECONDS = int(os.getenv("INBOX_SNAPSHOT_IDLE_TTL_SECONDS", "3600"))
+INBOX_SNAPSHOT_MAX_ENTRIES = int(os.getenv("INBOX_SNAPSHOT_MAX_ENTRIES", "1000"))
+
+# Токены синхронизации действительны только в пределах одного процесса
+_EPOCH = uuid.uuid4().hex[:8]
+
+
+def parse_due(due):
+    """Приведение значения поля срока к datetime"""
+    if not due:
+        return None
+    if isinstance(due, str):
+        try:
+            return datetime.fromisoformat(due)
+        except Exception:
+            return None
+    return due
+
+
+def due_color(due_dt, now):
+    """Цвет строки по оставшемуся до срока времени"""
+    if not due_dt:
+        return 'white'
+    time_left = (due_dt - now).total_seconds()
+    if time_left < 0:
+        return 'red'
+    if time_left < 2 * 3600:
+        return 'yellow'
+    return 'white'
+
+
+def build_inbox_row(task, description_id, due_id, step_id, now):
+    """Строка расширенного inbox для задачи из реестра"""
+    fields = {f.id: f.value for f in (getattr(task, 'fields', None) or [])}
+    text = fields.get(description_id)
+    due_dt = parse_due(fields.get(due_id))
+    step = fields.get(step_id)
+
+    # step — это номер этапа (int или str)
+    try:
+        step_num = int(step) if step is not None else None
+    except Exception:
+        step_num = None
+
+    # Заморожена: если этап == 2 и нет срока
+    is_frozen = (step_num == 2 and due_dt is None)
+
+    return {
+        "id": task.id,
+        "text": text,
+        "due": due_dt.isoformat() if due_dt else None,
+        "step": step,
+        "is_frozen": is_frozen,
+        "color": due_color(due_dt, now),
+        "last_modified_date": task.last_modified_date.isoformat() if getattr(task, "last_modified_date", None) else None,
+    }
+
+
+async def fetch_inbox_rows(pyrus_client, task_ids, form_id=INBOX_FORM_ID):
+    """Загрузка строк расширенного inbox для указанных задач одним запросом к реестру формы"""
+    if not task_ids:
+        return []
+
+    # Получаем структуру формы (из кэша) и нужные field_ids
+    form_schema = await get_form_schema(pyrus_client, form_id)
+    if form_schema.error_code:
+        raise RuntimeError(f"Ошибка получения формы {form_id}: {form_schema.error_code}")
+    description_id = form_schema.field_id("Описание/ Description")
+    due_id = form_schema.field_id("Срок/Term")
+    step_id = form_schema.field_id("Этап/Stage")
+
+    req = pyrus.models.requests.FormRegisterRequest(
+        task_ids=list(task_ids),
+        field_ids=[field_id for field_id in (description_id, due_id, step_id) if field_id is not None]
+    )
+    reg_resp = await pyrus_client.get_registry(form_id, req)
+    if reg_resp.error_code:
+        raise RuntimeError(f"Ошибка получения реестра формы {form_id}: {reg_resp.error_code}")
+    detailed_tasks = reg_resp.tasks if reg_resp.tasks else []
+
+    now = datetime.now(timezone.utc)
+    return [build_inbox_row(task, description_id, due_id, step_id, now) for task in detailed_tasks]
+
+
+class _InboxEntry:
+    __slots__ = ("last_modified_date", "due", "row", "added_in", "changed_in")
+
+    def __init__(self, last_modified_date, row, version):
+        self.last_modified_date = last_modified_date
+        self.due = parse_due(row["due"])
+        self.row = row
+        self.added_in = version
+        self.changed_in = version
+
+
+class InboxSnapshot:
+    """
+    Последнее известное состояние inbox пользователя.
+    Задачи перезапрашиваются из реестра только если изменился их last_modified_date,
+    строки неизменившихся задач повторно не собираются
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.min_version = 0
+        self.entries = {}       # task_id -> _InboxEntry
+        self.foreign = {}       # task_id -> last_modified_date задач других форм
+        self.removed = {}       # task_id -> версия, в которой задача пропала из inbox
+        self.order = []         # порядок задач в inbox по последнему ответу Pyrus
+        self.loaded = False     # была успешная синхронизация (пустой inbox не меняет версию)
+        self._refreshing = None  # синхронизация, которую ждут одновременные запросы
+
+    @property
+    def sync_token(self):
+        return f"{_EPOCH}.{self.version}"
+
+    def parse_token(self, sync_token):
+        """Версия из токена или None, если по токену нельзя выдать дельту"""
+        try:
+            epoch, version = sync_token.split(".", 1)
+            version = int(version)
+        except (AttributeError, ValueError):
+            return None
+        if epoch != _EPOCH or version < self.min_version or version > self.version:
+            return None
+        return version
+
+    async def refresh(self, pyrus_client, tasks_count):
+        """Синхронизация снапшота с Pyrus; возвращает порядок задач в inbox"""
+        inbox_response = await pyrus_client.get_inbox(tasks_count=tasks_count)
+        if inbox_response.error_code:
+            # Пустой inbox из-за ошибки нельзя принимать за удаление всех задач
+            raise RuntimeError(f"Ошибка получения inbox: {inbox_response.error_code}")
+        tasks = inbox_response.tasks or []
+        modified = {task.id: getattr(task, "last_modified_date", None) for task in tasks}
+        for task_id, last_modified_date in modified.items():
+            # Изменение, замеченное в inbox, сразу сбрасывает версию задачи, по которой отвечаем 304
+            forget_task_version(pyrus_client.account, task_id, last_modified_date)
+
+        to_fetch = []
+        for task_id, last_modified_date in modified.items():
+            entry = self.entries.get(task_id)
+            if entry is not None:
+                if entry.last_modified_date != last_modified_date:
+                    to_fetch.append(task_id)
+            elif self.foreign.get(task_id, object()) != last_modified_date:
+                to_fetch.append(task_id)
+
+        rows = await fetch_inbox_rows(pyrus_client, to_fetch)
+        version = self.version + 1
+        changed = False
+
+        fetched_ids = set()
+        for row in rows:
+            task_id = row["id"]
+            fetched_ids.add(task_id)
+            entry = self.entries.get(task_id)
+            if entry is None:
+                self.entries[task_id] = _InboxEntry(modified.get(task_id), row, version)
+                self.removed.pop(task_id, None)
+                changed = True
+            else:
+                entry.last_modified_date = modified.get(task_id)
+                if entry.row != row:
+                    entry.row = row
+                    entry.due = parse_due(row["due"])
+                    entry.changed_in = version
+                    changed = True
+
+        # Задачи из inbox, которых нет в успешном ответе реестра формы, запоминаем, чтобы не запрашивать их повторно
+        for task_id in to_fetch:
+            if task_id not in fetched_ids and task_id not in self.entries:
+                self.foreign[task_id] = modified[task_id]
+
+        for task_id in list(self.entries):
+            if task_id not in modified:
+                del self.entries[task_id]
+                self.removed[task_id] = version
+                changed = True
+        for task_id in list(self.foreign):
+            if task_id not in modified:
+                del self.foreign[task_id]
+
+        # Цвет зависит от текущего времени, поэтому пересчитывается и без изменения задачи
+        now = datetime.now(timezone.utc)
+        for entry in self.entries.values():
+            color = due_color(entry.due, now)
+            if color != entry.row["color"]:
+                entry.row = dict(entry.row, color=color)
+                entry.changed_in = version
+                changed = True
+
+        if changed:
+            self.version = version
+            self._prune_tombstones()
+
+        self.order = [task_id for task_id in modified if task_id in self.entries]
+        self.loaded = True
+        return self.order
+
+    async def shared_refresh(self, pyrus_client, tasks_count):
+        """
+        refresh, общий для одновременных запросов: пока идет обращение к Pyrus, новые вызовы ждут его результата,
+        а не выстраиваются в очередь за собственными запросами
+        """
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self.refresh(pyrus_client, tasks_count))
+            self._refreshing.add_done_callback(self._refresh_done)
+        # Отключение одного клиента не отменяет синхронизацию, которую ждут остальные
+        return await asyncio.shield(self._refreshing)
+
+    def _refresh_done(self, future):
+        if self._refreshing is future:
+            self._refreshing = None
+        if not future.cancelled():
+            # Ошибку получают ожидающие; если их не осталось, она не должна попадать в лог как необработанная
+            future.exception()
+
+    def rows(self, order=None):
+        task_ids = order if order is not None else self.order
+        return [self.entries[task_id].row for task_id in task_ids]
+
+    def delta(self, since_version):
+        """Изменения после версии since_version"""
+        added, changed = [], []
+        for entry in self.entries.values():
+            if entry.added_in > since_version:
+                added.append(entry.row)
+            elif entry.changed_in > since_version:
+                changed.append(entry.row)
+        removed = [task_id for task_id, version in self.removed.items() if version > since_version]
+        return added, changed, removed
+
+    def _prune_tombstones(self):
+        threshold = self.version - INBOX_TOMBSTONE_VERSIONS
+        if threshold <= self.min_version:
+            return
+        self.removed = {task_id: version for task_id, version in self.removed.items() if version > threshold}
+        self.min_version = threshold
+
+
+_snapshots = TTLCache(
+    max_entries=INBOX_SNAPSHOT_MAX_ENTRIES,
+    ttl=INBOX_SNAPSHOT_IDLE_TTL_SECONDS,
+    sliding=True,
+    name="inbox_snapshots",
+)
+
+
+def get_inbox_snapshot(account, tasks_count) -> InboxSnapshot:
+    """Снапшот inbox пользователя (отдельный для каждого размера выборки)"""
+    key = (account, tasks_count)
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        snapshot = InboxSnapshot()
+        _snapshots.set(key, snapshot)
+    return snapshot
+
+
+async def sync_inbox(pyrus_client, tasks_count, sync_token=None):
+    """
+    Синхронизация inbox по токену.
+    Если токен действителен, возвращаются только добавленные, измененные и удаленные задачи,
+    иначе — полный список (full=True); order — порядок всех задач inbox
+    """
+    snapshot = get_inbox_snapshot(pyrus_client.account, tasks_count)
+    order = await snapshot.shared_refresh(pyrus_client, tasks_count)
+    # После await снапшот не меняется до конца функции: токен и дельта относятся к одной версии
+    since_version = snapshot.parse_token(sync_token) if sync_token else None
+    if since_version is None:
+        return {
+            "sync_token": snapshot.sync_token,
+            "full": True,
+            "added": snapshot.rows(order),
+            "changed": [],
+            "removed": [],
+            "order": order,
+        }
+    added, changed, removed = snapshot.delta(since_version)
+    return {
+        "sync_token": snapshot.sync_token,
+        "full": False,
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "order": order,
+    }
+
+
+async def load_inbox(pyrus_client, tasks_count):
+    """Полный расширенный inbox (через снапшот, чтобы последующие дельты были корректны)"""
+    snapshot = get_inbox_snapshot(pyrus_client.account, tasks_count)
+    order = await snapshot.shared_refresh(pyrus_client, tasks_count)
+    return snapshot.rows(order)
@@ -0,0 +1,139 @@
+"""
+Рассылка изменений inbox по Server-Sent Events: один общий опрос Pyrus на пользователя
+"""
+import asyncio
+import contextvars
+import json
+import os
+
+from inbox import get_inbox_snapshot
+from pyrus_clients import get_background_client
+
+INBOX_STREAM_POLL_SECONDS = float(os.getenv("INBOX_STREAM_POLL_SECONDS", "10"))
+# Интервал служебных сообщений, чтобы прокси не закрывали простаивающее соединение
+INBOX_STREAM_HEARTBEAT_SECONDS = float(os.getenv("INBOX_STREAM_HEARTBEAT_SECONDS", "4"))
+INBOX_STREAM_QUEUE_SIZE = 16
+
+
+def format_sse(event, data):
+    """Сообщение в формате text/event-stream"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class _Subscriber:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=INBOX_STREAM_QUEUE_SIZE)
+        # Новому или отставшему подписчику отправляется полный список задач
+        self.needs_snapshot = True
+
+    def send(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: сбрасываем очередь и отправим полный список
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.needs_snapshot = True
+
+
+class InboxPoller:
+    """Периодический опрос inbox одного пользователя, общий для всех его вкладок"""
+
+    def __init__(self, account, tasks_count):
+        self.account = account
+        self.tasks_count = tasks_count
+        self.subscribers = set()
+        self.pyrus_client = None
+        self.task = None
+
+    def subscribe(self) -> _Subscriber:
+        subscriber = _Subscriber()
+        self.subscribers.add(subscriber)
+        if self.task is None or self.task.done():
+            # Чистый контекст: общий опрос не должен попадать в хронологию (Server-Timing) первого подписчика
+            self.task = asyncio.create_task(self._run(), context=contextvars.Context())
+        else:
+            self._send_snapshots()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        snapshot = get_inbox_snapshot(self.account, self.tasks_count)
+        last_version = last_order = None
+        while self.subscribers:
+            try:
+                # Клиент берется из реестра на каждом опросе: ключ пользователя мог смениться
+                self.pyrus_client = await get_background_client(self.account, self.pyrus_client)
+                await snapshot.shared_refresh(self.pyrus_client, self.tasks_count)
+                if last_version is not None and (snapshot.version != last_version or snapshot.order != last_order):
+                    added, changed, removed = snapshot.delta(last_version)
+                    message = format_sse("delta", {
+                        "sync_token": snapshot.sync_token,
+                        "added": added,
+                        "changed": changed,
+                        "removed": removed,
+                        "order": snapshot.order,
+                    })
+                    for subscriber in list(self.subscribers):
+                        if not subscriber.needs_snapshot:
+                            subscriber.send(message)
+                last_version, last_order = snapshot.version, snapshot.order
+                self._send_snapshots(snapshot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка опроса inbox {self.account}: {str(e)}")
+                message = format_sse("error", {"detail": str(e)})
+                for subscriber in list(self.subscribers):
+                    subscriber.send(message)
+            await asyncio.sleep(INBOX_STREAM_POLL_SECONDS)
+
+    def _send_snapshots(self, snapshot=None):
+        snapshot = snapshot or get_inbox_snapshot(self.account, self.tasks_count)
+        if not snapshot.loaded:
+            # Снапшот еще не загружен — подписчики получат его после первого опроса
+            return
+        message = None
+        for subscriber in list(self.subscribers):
+            if subscriber.needs_snapshot:
+                message = message or format_sse("snapshot", {
+                    "sync_token": snapshot.sync_token,
+                    "rows": snapshot.rows(),
+                })
+                subscriber.needs_snapshot = False
+                subscriber.send(message)
+
+
+_pollers = {}
+
+
+async def stream_inbox(pyrus_client, tasks_count):
+    """Генератор SSE-сообщений для одного подключения"""
+    key = (pyrus_client.account, tasks_count)
+    poller = _pollers.get(key)
+    if poller is None:
+        poller = _pollers[key] = InboxPoller(pyrus_client.account, tasks_count)
+    subscriber = poller.subscribe()
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), timeout=INBOX_STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                message = ": ping\n\n"
+            yield message
+    finally:
+        poller.unsubscribe(subscriber)
+        if not poller.subscribers and _pollers.get(key) is poller:
+            del _pollers[key]
+
+
+def stream_stats():
+    return {
+        "pollers": len(_pollers),
+        "subscribers": sum(len(poller.subscribers) for poller in _pollers.values()),
+    }
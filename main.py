@@ -1,24 +1,98 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, File, Query, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timezone
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from pyrus import client
 import pyrus.models
 from collections import defaultdict
 from sqlalchemy.orm import Session
 
-from database import get_db, User
+from database import get_db, async_engine, User
 from auth_routes import router as auth_router
+from admin_routes import router as admin_router
+from mirror_routes import router as mirror_router
+from middleware import PyrusCallsMiddleware
+from write_behind import user_writes
+from fast_json import FAST_JSON_RESPONSES, FastJSONResponse, dumps
+from metrics import MetricsMiddleware, render_metrics
+from server_timing import ServerTimingMiddleware
+from http_cache import (
+    CACHE_CONTROL,
+    HTTPCacheMiddleware,
+    forget_task_version,
+    known_task_version,
+    make_etag,
+    not_modified,
+    remember_task_version,
+    set_validators,
+)
 from auth_utils import get_current_active_user, get_current_active_user_from_cookie
-from schemas import CatalogsListResponse, CatalogResponse, CatalogSummary, CatalogHeader, CatalogItem, TaskFormResponse, TaskForm, TaskFormField, TaskCreateRequest
+from pyrus_async import AsyncPyrusClient, gather_limited
+from pyrus_clients import get_pyrus_client
+from catalog_cache import get_cached_catalog, get_catalog_entry
+from catalog_items import (
+    CATALOG_ITEMS_DEFAULT_LIMIT,
+    CATALOG_ITEMS_MAX_LIMIT,
+    CursorError,
+    build_items_page,
+    catalog_payload,
+    iter_items_ndjson,
+    resolve_columns,
+    resolve_cursor,
+)
+from catalog_summaries import get_catalog_summaries, refresh_catalog_summaries_forever
+from catalog_search import CATALOG_SEARCH_DEFAULT_LIMIT, CATALOG_SEARCH_MAX_LIMIT, search_catalog
+from form_cache import get_form_list, get_form_schema
+from inbox import load_inbox, sync_inbox
+from inbox_stream import stream_inbox
+from task_query import (
+    DUE_FIELD_TYPES,
+    TASK_LIST_MAX_LIMIT,
+    TaskQuery,
+    TaskQueryError,
+    form_field_id,
+    inbox_row_values,
+    registry_task_values,
+)
+from task_mirror import sync_task_mirror_forever
+from bulk_comments import run_bulk_comments, stream_bulk_comments
+from task_import import (
+    FieldMapper,
+    TaskImportError,
+    detect_format,
+    iter_import_results,
+    iter_report_ndjson,
+    prepare_rows,
+    summarize as summarize_import,
+    take_upload_file,
+)
+from schemas import CatalogsListResponse, CatalogResponse, CatalogSummary, CatalogHeader, CatalogItem, TaskFormResponse, TaskForm, TaskFormField, TaskCreateRequest, BulkCommentRequest, BulkCommentResponse
 
 # Загрузка переменных окружения
 load_dotenv()
 
-app = FastAPI(title="Pyrus Tasks API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Фоновое обновление сводок каталогов, синхронизация зеркала задач и отложенная запись изменений пользователей
+    summaries_task = asyncio.create_task(refresh_catalog_summaries_forever())
+    mirror_task = asyncio.create_task(sync_task_mirror_forever())
+    writes_task = asyncio.create_task(user_writes.run_forever())
+    yield
+    summaries_task.cancel()
+    mirror_task.cancel()
+    writes_task.cancel()
+    await asyncio.gather(writes_task, return_exceptions=True)
+    # Дописываем все, что осталось в буфере
+    await user_writes.flush()
+    await async_engine.dispose()
+
+app = FastAPI(title="Pyrus Tasks API", lifespan=lifespan)
 
 # Настройка CORS для работы с frontend
 app.add_middleware(
@@ -34,28 +108,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Pyrus-Calls", "X-Pyrus-Memo-Hits", "ETag", "Server-Timing", "X-Mirror-Age", "X-Next-Cursor", "X-Failed-Forms"],
 )
+app.add_middleware(PyrusCallsMiddleware)
+# Хронология вызовов Pyrus и обращений к кэшам в заголовке Server-Timing
+app.add_middleware(ServerTimingMiddleware)
+# ETag/304 и gzip для обычных ответов; потоковые (SSE, NDJSON) проходят без изменений
+app.add_middleware(HTTPCacheMiddleware)
+# Внешний слой: задержка запроса целиком, включая сжатие
+app.add_middleware(MetricsMiddleware)
 
 # Подключение роутов авторизации
 app.include_router(auth_router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
+app.include_router(mirror_router, prefix="/api")
 
-def get_pyrus_client(current_user: User = Depends(get_current_active_user_from_cookie)):
-    """Получение клиента Pyrus для текущего пользователя"""
-    # Используем учетные данные из базы данных
-    login = current_user.login
-    security_key = current_user.security_key
-    
-    pyrus_client = client.PyrusAPI(login=login, security_key=security_key)
-    
-    # Проверяем авторизацию
-    try:
-        auth_response = pyrus_client.auth()
-        if not auth_response.success:
-            raise HTTPException(status_code=401, detail=f"Ошибка авторизации в Pyrus: {auth_response.error}")
-    except Exception as e:
-        raise HTTPException(status_code=401, detail=f"Ошибка подключения к Pyrus: {str(e)}")
-    
-    return pyrus_client
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 class TaskResponse(BaseModel):
     id: int
@@ -66,45 +137,113 @@ class TaskResponse(BaseModel):
     responsible: Optional[dict]
     due_date: Optional[datetime]
 
+def _person_payload(person):
+    return dict(vars(person)) if person is not None else None
+
+def _task_payload(task) -> dict:
+    """Задача Pyrus в виде словаря по схеме TaskResponse"""
+    return {
+        "id": task.id,
+        "text": getattr(task, 'text', None),
+        "subject": getattr(task, 'subject', None),
+        "create_date": task.create_date,
+        "author": _person_payload(getattr(task, 'author', None)),
+        "responsible": _person_payload(getattr(task, 'responsible', None)),
+        "due_date": getattr(task, 'due_date', None),
+    }
+
 class TaskCommentRequest(BaseModel):
     text: str
     action: Optional[str]
     field_updates: Optional[List[Dict[str, Any]]]
 
+def _task_query(**params) -> TaskQuery:
+    try:
+        return TaskQuery(**params)
+    except TaskQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/tasks", response_model=List[TaskResponse])
-async def get_tasks(pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_tasks(
+    response: Response,
+    form_id: Optional[List[int]] = Query(None),
+    step: Optional[List[int]] = Query(None),
+    due_after: Optional[datetime] = None,
+    due_before: Optional[datetime] = None,
+    responsible_id: Optional[int] = None,
+    modified_after: Optional[datetime] = None,
+    include_archived: bool = False,
+    sort: Optional[str] = Query(None, pattern="^-?(id|create_date|last_modified_date|due)$"),
+    limit: Optional[int] = Query(None, ge=1, le=TASK_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
     """
-    Получить список всех задач
+    Получить список задач.
+    Формы, этапы, даты изменения, архивные задачи (include_archived) и диапазон id передаются в реестр Pyrus,
+    остальные условия, сортировка и limit применяются на сервере; курсор следующей страницы — в X-Next-Cursor.
+    Реестры форм загружаются параллельно; формы, которые не удалось загрузить,
+    перечисляются в заголовке X-Failed-Forms
     """
+    query = _task_query(
+        form_ids=form_id, steps=step, due_after=due_after, due_before=due_before,
+        responsible_id=responsible_id, modified_after=modified_after, include_archived=include_archived,
+        sort=sort, limit=limit, cursor=cursor,
+    )
     try:
         # Получаем все формы
-        forms_response = pyrus_client.get_forms()
+        forms_response = await pyrus_client.get_forms()
         if not forms_response.forms:
             return []
-            
+
+        forms = [form for form in forms_response.forms if query.wants_form(form.id)]
+        registry_responses = await gather_limited(
+            pyrus_client.get_registry(form.id, query.register_request(form)) for form in forms
+        )
+
+        # Склеиваем результаты в порядке форм
         all_tasks = []
-        
-        # Для каждой формы получаем задачи
-        for form in forms_response.forms:
-            request = pyrus.models.requests.FormRegisterRequest(
-                include_archived=False
-            )
-            tasks_response = pyrus_client.get_registry(form.id, request)
-            if tasks_response.tasks:
-                all_tasks.extend(tasks_response.tasks)
-                
-        return all_tasks
+        task_values = {}
+        failed_form_ids = []
+        for form, tasks_response in zip(forms, registry_responses):
+            if isinstance(tasks_response, Exception):
+                print(f"Ошибка получения реестра формы {form.id}: {str(tasks_response)}")
+                failed_form_ids.append(form.id)
+                continue
+            if tasks_response.error_code:
+                print(f"Ошибка получения реестра формы {form.id}: {tasks_response.error_code}")
+                failed_form_ids.append(form.id)
+                continue
+            due_field_id = form_field_id(form, DUE_FIELD_TYPES)
+            for task in tasks_response.tasks or []:
+                all_tasks.append(task)
+                task_values[id(task)] = registry_task_values(task, due_field_id)
+
+        selected, next_cursor = query.select(all_tasks, lambda task: task_values[id(task)])
+
+        headers = {}
+        if failed_form_ids:
+            headers["X-Failed-Forms"] = ",".join(str(form_id) for form_id in failed_form_ids)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+
+        tasks = [_task_payload(task) for task in selected]
+        if FAST_JSON_RESPONSES:
+            # Данные Pyrus уже проверены, повторная валидация через TaskResponse не нужна
+            return FastJSONResponse(tasks, headers=headers)
+        response.headers.update(headers)
+        return tasks
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/tasks/{task_id}")
-async def get_task(task_id: int, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_task(task_id: int, pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client)):
     """
     Получить конкретную задачу по ID
     """
     try:
-        task_response = pyrus_client.get_task(task_id)
+        task_response = await pyrus_client.get_task(task_id)
         if not task_response.task:
             raise HTTPException(status_code=404, detail="Задача не найдена")
         return task_response.task
@@ -112,110 +251,79 @@ async def get_task(task_id: int, pyrus_client: client.PyrusAPI = Depends(get_pyr
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/inbox")
-async def get_inbox(tasks_count: int = 50, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_inbox(tasks_count: int = 50, pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client)):
     """
     Получить задачи из входящих
     """
     try:
-        inbox_response = pyrus_client.get_inbox(tasks_count=tasks_count)
+        inbox_response = await pyrus_client.get_inbox(tasks_count=tasks_count)
         # print("[DEBUG] Pyrus inbox_response.tasks:")
         # for t in inbox_response.tasks:
         #     print(t)
+        if FAST_JSON_RESPONSES:
+            return FastJSONResponse(inbox_response.tasks)
         return inbox_response.tasks
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/inbox_full")
-async def get_inbox_full(tasks_count: int = 100, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_inbox_full(
+    response: Response,
+    tasks_count: int = 100,
+    sync_token: Optional[str] = None,
+    delta: bool = False,
+    step: Optional[List[int]] = Query(None),
+    due_after: Optional[datetime] = None,
+    due_before: Optional[datetime] = None,
+    modified_after: Optional[datetime] = None,
+    sort: Optional[str] = Query(None, pattern="^-?(id|last_modified_date|due)$"),
+    limit: Optional[int] = Query(None, ge=1, le=TASK_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
     """
-    Получить inbox с расширенной информацией (дедлайн, этап, заморозка, цвет)
+    Получить inbox с расширенной информацией (дедлайн, этап, заморозка, цвет).
+    В режиме дельты (delta=true или передан sync_token) возвращаются только задачи,
+    добавленные, измененные или удаленные после выдачи sync_token.
+    Фильтры, сортировка и limit (курсор следующей страницы — в X-Next-Cursor) применяются к полному списку
     """
+    filtered = any(value is not None for value in (step, due_after, due_before, modified_after, sort, limit, cursor))
+    if filtered and (delta or sync_token):
+        raise HTTPException(status_code=400, detail="Фильтры и постраничная выдача недоступны в режиме дельты")
+    query = _task_query(
+        steps=step, due_after=due_after, due_before=due_before, modified_after=modified_after,
+        sort=sort, limit=limit, cursor=cursor,
+    ) if filtered else None
     try:
-        inbox_response = pyrus_client.get_inbox(tasks_count=tasks_count)
-        tasks = inbox_response.tasks
-
-        task_ids = [t.id for t in tasks]
-        if not task_ids:
-            return []
-
-        form_id = 829354
-
-        # Получаем структуру формы и нужные field_ids
-        form = pyrus_client.get_form(form_id)
-        field_map = {f.name: f.id for f in form.fields}
-        description_id = field_map.get("Описание/ Description")
-        due_id = field_map.get("Срок/Term")
-        step_id = field_map.get("Этап/Stage")
-
-        req = pyrus.models.requests.FormRegisterRequest(
-            task_ids=task_ids,
-            field_ids=[description_id, due_id, step_id]
-        )
-        reg_resp = pyrus_client.get_registry(form_id, req)
-        detailed_tasks = reg_resp.tasks if reg_resp.tasks else []
-
-        result = []
-        now = datetime.now(timezone.utc)
-        for task in detailed_tasks:
-            fields = {f.id: f.value for f in getattr(task, 'fields', [])}
-            text = fields.get(description_id)
-            due = fields.get(due_id)
-            step = fields.get(step_id)
-
-            due_dt = None
-            if due:
-                if isinstance(due, str):
-                    try:
-                        due_dt = datetime.fromisoformat(due)
-                    except Exception:
-                        due_dt = None
-                else:
-                    due_dt = due
-
-            if due_dt:
-                time_left = (due_dt - now).total_seconds()
-                if time_left < 0:
-                    color = 'red'
-                elif time_left < 2 * 3600:
-                    color = 'yellow'
-                else:
-                    color = 'white'
-            else:
-                color = 'white'
-
-            # step — это номер этапа (int или str)
-            try:
-                step_num = int(step) if step is not None else None
-            except Exception:
-                step_num = None
-
-            # # Для фронта: если этап 2 — пишем "Пауза", иначе None
-            # if step_num == 2:
-            #     step_name = "Пауза"
-            # else:
-            #     step_name = None
-            step_name = step
-
-            # Заморожена: если этап == 2 и нет срока
-            is_frozen = (step_num == 2 and due_dt is None)
-
-            result.append({
-                "id": task.id,
-                "text": text,
-                "due": due_dt.isoformat() if due_dt else None,
-                "step": step_name,
-                "is_frozen": is_frozen,
-                "color": color,
-                "last_modified_date": task.last_modified_date.isoformat() if getattr(task, "last_modified_date", None) else None,
-            })
-
-        return result
+        if delta or sync_token:
+            return await sync_inbox(pyrus_client, tasks_count, sync_token)
+        rows = await load_inbox(pyrus_client, tasks_count)
+        if query is None:
+            return rows
+        # Снапшот inbox нужен целиком для дельт, поэтому отбор — по готовым строкам
+        rows, next_cursor = query.select(rows, inbox_row_values)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return rows
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/inbox_full/stream")
+async def stream_inbox_full(tasks_count: int = 100, pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client)):
+    """
+    Поток изменений расширенного inbox (Server-Sent Events).
+    События: snapshot — полный список задач, delta — добавленные, измененные и удаленные задачи.
+    Pyrus опрашивается одним общим поллером на пользователя, независимо от числа вкладок
+    """
+    return StreamingResponse(
+        stream_inbox(pyrus_client, tasks_count),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/api/tasks/{task_id}/comment")
-async def comment_task(task_id: int, comment_request: TaskCommentRequest, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def comment_task(task_id: int, comment_request: TaskCommentRequest, pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client)):
     """
     Добавить комментарий к задаче
     """
@@ -225,37 +333,69 @@ async def comment_task(task_id: int, comment_request: TaskCommentRequest, pyrus_
             action=comment_request.action,
             field_updates=comment_request.field_updates
         )
-        response = pyrus_client.comment_task(task_id, request)
+        response = await pyrus_client.comment_task(task_id, request)
         return response.task
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Задача могла измениться: прежняя версия больше не годится для ETag
+        forget_task_version(pyrus_client.account, task_id)
+
+@app.post("/api/tasks/bulk-comment", response_model=BulkCommentResponse)
+async def bulk_comment_tasks(
+    bulk_request: BulkCommentRequest,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
+    """
+    Добавить комментарии (действия, изменения полей) к нескольким задачам за один запрос.
+    Результат по каждой задаче; ошибка одной задачи не прерывает остальные.
+    format=ndjson — результаты потоком по мере выполнения и итоговая строка summary
+    """
+    if response_format == "ndjson":
+        return StreamingResponse(
+            stream_bulk_comments(pyrus_client, bulk_request.items),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    return await run_bulk_comments(pyrus_client, bulk_request.items)
 
 @app.get("/api/forms")
-async def get_forms(pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_forms(request: Request, response: Response, pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client)):
     """
     Получить все формы
     """
     try:
-        forms_response = pyrus_client.get_forms()
-        return forms_response.forms
+        # Список форм из кэша: ответ 304 не требует запроса к Pyrus
+        form_list = await get_form_list(pyrus_client)
+        if form_list.error_code:
+            return form_list.response.forms
+        etag = make_etag("forms", pyrus_client.account, form_list.version)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+        set_validators(response, etag)
+        return form_list.forms
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def _build_task_form(form_id: int, pyrus_client: client.PyrusAPI) -> TaskFormResponse:
+async def _build_task_form(form_id: int, pyrus_client: AsyncPyrusClient, include_catalog_items: bool = True) -> TaskFormResponse:
     """
-    Внутренняя функция для построения структуры формы задачи
+    Внутренняя функция для построения структуры формы задачи.
+    include_catalog_items=False — элементы каталогов не загружаются, их ищут через /api/catalogs/{catalog_id}/search
     """
-    # Получаем структуру формы
-    form_response = pyrus_client.get_form(form_id)
-    if not form_response:
+    # Получаем структуру формы (из кэша)
+    form_schema = await get_form_schema(pyrus_client, form_id)
+    if form_schema.error_code:
         raise HTTPException(status_code=404, detail="Форма не найдена")
+    form_response = form_schema.form
     
     # Собираем информацию о полях
     task_form_fields = []
     catalog_ids_to_load = set()
     
     # Проверяем наличие полей
-    fields = getattr(form_response, 'fields', [])
+    fields = form_schema.fields
     if not fields:
         raise HTTPException(status_code=404, detail="Поля формы не найдены")
     
@@ -294,31 +434,32 @@ def _build_task_form(form_id: int, pyrus_client: client.PyrusAPI) -> TaskFormRes
         
         task_form_fields.append(field_info)
     
-    # Загружаем данные каталогов (после цикла по полям)
-    catalogs = []
-    for catalog_id in catalog_ids_to_load:
-        try:
-            catalog_response = pyrus_client.get_catalog(catalog_id)
-            if catalog_response and not getattr(catalog_response, 'error_code', None):
-                # Получаем элементы каталога
-                catalog_items = []
-                if catalog_response.items:
-                    for item in catalog_response.items:
-                        catalog_items.append(CatalogItem(
-                            item_id=item.item_id,
-                            values=item.values if hasattr(item, 'values') else None,
-                            headers=item.headers if hasattr(item, 'headers') else None,
-                            rows=item.rows if hasattr(item, 'rows') else None
-                        ))
-                
-                # Добавляем catalog_items к соответствующему полю
-                for field in task_form_fields:
-                    if field.catalog_id == catalog_id:
-                        field.catalog_items = catalog_items
-                
-        except Exception as e:
-            print(f"Ошибка загрузки каталога {catalog_id}: {str(e)}")
+    if not include_catalog_items:
+        catalog_ids_to_load = set()
+
+    # Загружаем каждый каталог один раз (параллельно) и раздаем его элементы всем полям, которые на него ссылаются
+    catalog_ids = list(catalog_ids_to_load)
+    results = await gather_limited(get_cached_catalog(pyrus_client, catalog_id) for catalog_id in catalog_ids)
+    items_by_catalog = {}
+    for catalog_id, catalog_response in zip(catalog_ids, results):
+        if isinstance(catalog_response, Exception):
+            print(f"Ошибка загрузки каталога {catalog_id}: {str(catalog_response)}")
+            continue
+        if not catalog_response or getattr(catalog_response, 'error_code', None):
             continue
+        items_by_catalog[catalog_id] = [
+            CatalogItem(
+                item_id=item.item_id,
+                values=item.values if hasattr(item, 'values') else None,
+                headers=item.headers if hasattr(item, 'headers') else None,
+                rows=item.rows if hasattr(item, 'rows') else None
+            )
+            for item in (catalog_response.items or [])
+        ]
+    
+    for field in task_form_fields:
+        if field.catalog_id in items_by_catalog:
+            field.catalog_items = items_by_catalog[field.catalog_id]
     
     # Создаем объект TaskForm
     task_form = TaskForm(
@@ -332,13 +473,50 @@ def _build_task_form(form_id: int, pyrus_client: client.PyrusAPI) -> TaskFormRes
         catalogs=[]
     )
 
+async def _task_form_version(form_id: int, pyrus_client: AsyncPyrusClient, include_catalog_items: bool = True):
+    """
+    Версия структуры формы для ETag: версии формы и ее каталогов в серверном кэше.
+    None — версию определить не удалось (ошибка Pyrus), ETag не выдается
+    """
+    form_schema = await get_form_schema(pyrus_client, form_id)
+    if form_schema.error_code:
+        return None
+    version = [form_id, form_schema.version, include_catalog_items]
+    if include_catalog_items:
+        catalog_ids = sorted({
+            getattr(field.info, 'catalog_id', None)
+            for field in form_schema.fields or []
+            if field.type == 'catalog' and getattr(field, 'info', None)
+        } - {None})
+        entries = await gather_limited(get_catalog_entry(pyrus_client, catalog_id) for catalog_id in catalog_ids)
+        for catalog_id, entry in zip(catalog_ids, entries):
+            if isinstance(entry, Exception) or entry.error_code:
+                return None
+            version.append((catalog_id, entry.version))
+    return version
+
 @app.get("/api/forms/{form_id}/task-form", response_model=TaskFormResponse)
-async def get_task_form(form_id: int, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_task_form(
+    request: Request,
+    response: Response,
+    form_id: int,
+    include_catalog_items: bool = True,
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
     """
-    Получить структуру формы для создания/редактирования задачи
+    Получить структуру формы для создания/редактирования задачи.
+    include_catalog_items=false — без элементов каталогов (списки подгружаются поиском)
     """
     try:
-        return _build_task_form(form_id, pyrus_client)
+        # Валидатор строится по версиям из кэша: ответ 304 не требует запросов к Pyrus
+        version = await _task_form_version(form_id, pyrus_client, include_catalog_items)
+        if version is not None:
+            etag = make_etag("task-form", pyrus_client.account, version)
+            cached = not_modified(request, etag)
+            if cached is not None:
+                return cached
+            set_validators(response, etag)
+        return await _build_task_form(form_id, pyrus_client, include_catalog_items)
     except HTTPException:
         raise
     except Exception as e:
@@ -348,21 +526,47 @@ async def get_task_form(form_id: int, pyrus_client: client.PyrusAPI = Depends(ge
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/tasks/{task_id}/form")
-async def get_task_form_data(task_id: int, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_task_form_data(
+    request: Request,
+    response: Response,
+    task_id: int,
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
     """
     Получить форму задачи с текущими значениями полей
     """
     try:
+        # Недавно полученная версия задачи позволяет ответить 304 без запроса к Pyrus
+        known = known_task_version(pyrus_client.account, task_id) if request.headers.get("if-none-match") else None
+        if known is not None:
+            known_form_id, last_modified_date = known
+            version = await _task_form_version(known_form_id, pyrus_client)
+            if version is not None:
+                cached = not_modified(request, make_etag("task-form-data", pyrus_client.account, task_id, last_modified_date, version))
+                if cached is not None:
+                    return cached
+
         # Получаем задачу
-        task_response = pyrus_client.get_task(task_id)
+        task_response = await pyrus_client.get_task(task_id)
         if not task_response or not task_response.task:
             raise HTTPException(status_code=404, detail="Задача не найдена")
         
         task = task_response.task
         form_id = task.form_id
+        last_modified_date = getattr(task, 'last_modified_date', None)
+        remember_task_version(pyrus_client.account, task_id, form_id, last_modified_date)
+        
+        # Сборка формы и передача ответа пропускаются, если задача не менялась
+        version = await _task_form_version(form_id, pyrus_client)
+        if version is not None:
+            etag = make_etag("task-form-data", pyrus_client.account, task_id, last_modified_date, version)
+            cached = not_modified(request, etag)
+            if cached is not None:
+                return cached
+            set_validators(response, etag)
         
         # Получаем структуру формы через внутреннюю функцию
-        form_data = _build_task_form(form_id, pyrus_client)
+        form_data = await _build_task_form(form_id, pyrus_client)
         
         # Извлекаем текущие значения полей из задачи
         current_values = {}
@@ -498,101 +702,60 @@ async def get_task_form_data(task_id: int, pyrus_client: client.PyrusAPI = Depen
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/catalogs", response_model=CatalogsListResponse)
-async def get_catalogs(pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_catalogs(request: Request, response: Response, pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client)):
     """
-    Получить список всех доступных каталогов с их структурой
+    Получить список всех доступных каталогов с их структурой.
+    Сводки обновляются в фоне; updated_at и age_seconds показывают их возраст
     """
     try:
-        # Получаем все формы для определения доступных каталогов
-        forms_response = pyrus_client.get_forms()
-        if forms_response.error_code:
-            raise HTTPException(status_code=500, detail=f"Ошибка получения форм: {forms_response.error_code}")
-        
-        if not forms_response.forms:
-            return CatalogsListResponse(catalogs=[], total_count=0)
-        
-        # Собираем все уникальные catalog_ids из форм
-        catalog_ids = set()
-        catalog_names = {}
-        
-        print(f"[DEBUG] Найдено форм: {len(forms_response.forms)}")
-        
-        for form in forms_response.forms:
-            print(f"[DEBUG] Форма {form.id}: {form.name}")
-            if hasattr(form, 'fields') and form.fields:
-                print(f"[DEBUG] Поля формы: {len(form.fields)}")
-                for field in form.fields:
-                    print(f"[DEBUG] Поле: {field.name}, тип: {getattr(field, 'type', 'N/A')}")
-                    if hasattr(field, 'type') and field.type == 'catalog':
-                        catalog_info = getattr(field, 'info', {})
-                        catalog_id = getattr(catalog_info, 'catalog_id', None) if catalog_info else None
-                        print(f"[DEBUG] Найден каталог: {catalog_id} для поля {field.name}")
-                        if catalog_id:
-                            catalog_ids.add(catalog_id)
-                            catalog_names[catalog_id] = field.name
-        
-        print(f"[DEBUG] Итого найдено каталогов: {len(catalog_ids)}")
-        print(f"[DEBUG] ID каталогов: {list(catalog_ids)}")
-        
-        if not catalog_ids:
-            print("[DEBUG] Возвращаем пустой список каталогов")
-            return CatalogsListResponse(catalogs=[], total_count=0)
-        
-        # Получаем информацию о каталогах
-        catalogs = []
-        
-        for catalog_id in catalog_ids:
-            try:
-                catalog_response = pyrus_client.get_catalog(catalog_id)
-                if catalog_response.error_code:
-                    print(f"Ошибка получения каталога {catalog_id}: {catalog_response.error_code}")
-                    continue
-                
-                catalog = catalog_response
-                items_count = len(catalog.items) if catalog.items else 0
-                headers_count = len(catalog.catalog_headers) if catalog.catalog_headers else 0
-                
-                # Преобразуем заголовки в наши схемы
-                headers = []
-                if catalog.catalog_headers:
-                    headers = [
-                        CatalogHeader(name=header.name, type=header.type)
-                        for header in catalog.catalog_headers
-                    ]
-                
-                catalog_summary = CatalogSummary(
-                    id=catalog.catalog_id,
-                    name=catalog_names.get(catalog_id, f"Каталог {catalog_id}"),
-                    items_count=items_count,
-                    headers_count=headers_count,
-                    source_type=catalog.source_type or "default",
-                    headers=headers
-                )
-                
-                catalogs.append(catalog_summary)
-                
-            except Exception as e:
-                print(f"Ошибка получения каталога {catalog_id}: {str(e)}")
-                continue
-        
+        table = await get_catalog_summaries(pyrus_client)
+        etag = make_etag("catalogs", pyrus_client.account, table.updated_at)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+        set_validators(response, etag)
         return CatalogsListResponse(
-            catalogs=catalogs,
-            total_count=len(catalogs)
+            catalogs=table.summaries,
+            total_count=len(table.summaries),
+            updated_at=table.updated_at,
+            age_seconds=table.age_seconds,
         )
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/catalogs/{catalog_id}", response_model=CatalogResponse)
-async def get_catalog_by_id(catalog_id: int, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_catalog_by_id(
+    request: Request,
+    response: Response,
+    catalog_id: int,
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
     """
     Получить конкретный каталог по ID с полной информацией
     """
     try:
-        catalog_response = pyrus_client.get_catalog(catalog_id)
+        entry = await get_catalog_entry(pyrus_client, catalog_id)
+        catalog_response = entry.catalog
         if catalog_response.error_code:
             raise HTTPException(status_code=404, detail=f"Каталог не найден: {catalog_response.error_code}")
         
+        etag = make_etag("catalog", pyrus_client.account, catalog_id, entry.version)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+        set_validators(response, etag)
+        
+        if FAST_JSON_RESPONSES:
+            # Тело ответа сериализуется один раз на версию каталога в кэше
+            if entry.json_body is None:
+                entry.json_body = dumps(catalog_payload(catalog_response))
+            return Response(
+                content=entry.json_body,
+                media_type="application/json",
+                headers={"ETag": etag, "Cache-Control": CACHE_CONTROL},
+            )
+        
         catalog = catalog_response
         
         # Преобразуем заголовки
@@ -623,164 +786,194 @@ async def get_catalog_by_id(catalog_id: int, pyrus_client: client.PyrusAPI = Dep
             source_type=catalog.source_type
         )
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/catalogs/{catalog_id}/items")
+async def get_catalog_items(
+    request: Request,
+    response: Response,
+    catalog_id: int,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=CATALOG_ITEMS_MAX_LIMIT),
+    columns: Optional[str] = None,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
+    """
+    Получить элементы каталога постранично.
+    columns — имена или номера столбцов через запятую; next_cursor передается в cursor для следующей страницы.
+    format=ndjson — потоковая выдача по одному элементу на строку (от cursor до конца каталога или до limit)
+    """
+    try:
+        entry = await get_catalog_entry(pyrus_client, catalog_id)
+        if entry.error_code:
+            raise HTTPException(status_code=404, detail=f"Каталог не найден: {entry.error_code}")
+
+        try:
+            start = resolve_cursor(entry, cursor)
+            column_indexes = resolve_columns(entry.catalog, columns)
+        except CursorError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        etag = make_etag("catalog-items", pyrus_client.account, catalog_id, entry.version, request.url.query)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+
+        if response_format == "ndjson":
+            return StreamingResponse(
+                iter_items_ndjson(entry, start, limit, column_indexes),
+                media_type="application/x-ndjson",
+                headers={"ETag": etag, "Cache-Control": CACHE_CONTROL},
+            )
+        set_validators(response, etag)
+        return build_items_page(entry, start, limit or CATALOG_ITEMS_DEFAULT_LIMIT, column_indexes)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/catalogs/{catalog_id}/search")
+async def search_catalog_items(
+    request: Request,
+    response: Response,
+    catalog_id: int,
+    q: str,
+    limit: int = Query(CATALOG_SEARCH_DEFAULT_LIMIT, ge=1, le=CATALOG_SEARCH_MAX_LIMIT),
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
+    """
+    Поиск элементов каталога для выпадающих списков: по префиксам слов и с допуском опечаток
+    """
+    try:
+        entry = await get_catalog_entry(pyrus_client, catalog_id)
+        if entry.error_code:
+            raise HTTPException(status_code=404, detail=f"Каталог не найден: {entry.error_code}")
+
+        etag = make_etag("catalog-search", pyrus_client.account, catalog_id, entry.version, request.url.query)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+        set_validators(response, etag)
+
+        return {
+            "catalog_id": catalog_id,
+            "query": q,
+            "items": await search_catalog(entry, q, limit),
+        }
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/task/{task_id}/full")
-async def get_task_full(task_id: int, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def get_task_full(task_id: int, pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client)):
     """
     Получить полную информацию о задаче включая все каталоги
     """
     try:
         # Получаем задачу
-        task_response = pyrus_client.get_task(task_id)
+        task_response = await pyrus_client.get_task(task_id)
         if task_response.error_code:
             raise HTTPException(status_code=404, detail="Задача не найдена")
         
         task = task_response.task
         
-        # Получаем все каталоги
-        catalogs_response = await get_catalogs(pyrus_client)
+        # Сводки каталогов берутся из фоново обновляемой таблицы, без обхода форм
+        catalogs_table = await get_catalog_summaries(pyrus_client)
         
         return {
             "task": task,
-            "catalogs": catalogs_response.catalogs,
-            "total_catalogs": catalogs_response.total_count
+            "catalogs": catalogs_table.summaries,
+            "total_catalogs": len(catalogs_table.summaries)
         }
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.get("/api/forms/{form_id}/task-form", response_model=TaskFormResponse)
-async def get_task_form(form_id: int, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
-    """
-    Получить форму задачи с заполненными каталогами для выпадающих списков
-    """
-    try:
-        # Получаем форму
-        form_response = pyrus_client.get_form(form_id)
-        if form_response.error_code:
-            raise HTTPException(status_code=404, detail=f"Форма не найдена: {form_response.error_code}")
-        
-        form = form_response.form
-        
-        # Получаем все каталоги
-        catalogs_response = await get_catalogs(pyrus_client)
-        
-        # Создаем мапу каталогов для быстрого поиска
-        catalogs_map = {catalog.id: catalog for catalog in catalogs_response.catalogs}
-        
-        # Обрабатываем поля формы
-        form_fields = []
-        
-        for field in form.fields:
-            field_data = TaskFormField(
-                id=field.id,
-                name=field.name,
-                type=field.type,
-                required=getattr(field, 'required', False)
-            )
-            
-            # Если поле типа catalog, получаем элементы каталога
-            if field.type == 'catalog' and hasattr(field, 'info'):
-                catalog_info = getattr(field, 'info', {})
-                catalog_id = getattr(catalog_info, 'catalog_id', None) if catalog_info else None
-                
-                if catalog_id:
-                    field_data.catalog_id = catalog_id
-                    
-                    # Получаем элементы каталога
-                    try:
-                        catalog_response = pyrus_client.get_catalog(catalog_id)
-                        if catalog_response.items:
-                            catalog_items = [
-                                CatalogItem(
-                                    item_id=item.item_id if hasattr(item, 'item_id') else None,
-                                    values=item.values if hasattr(item, 'values') else None,
-                                    headers=item.headers if hasattr(item, 'headers') else None,
-                                    rows=item.rows if hasattr(item, 'rows') else None
-                                )
-                                for item in catalog_response.items
-                            ]
-                            field_data.catalog_items = catalog_items
-                    except Exception as e:
-                        print(f"Ошибка получения каталога {catalog_id}: {str(e)}")
-            
-            form_fields.append(field_data)
-        
-        task_form = TaskForm(
-            form_id=form.id,
-            form_name=form.name,
-            fields=form_fields
-        )
-        
-        return TaskFormResponse(
-            form=task_form,
-            catalogs=catalogs_response.catalogs
-        )
-        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/tasks/create")
-async def create_task(task_request: TaskCreateRequest, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+async def create_task(task_request: TaskCreateRequest, pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client)):
     """
     Создать новую задачу с заполненными полями
     """
     try:
-        # Создаем запрос на создание задачи
-        create_request = pyrus.models.requests.TaskCreateRequest(
+        # Ключи field_values — id полей формы (или имена полей)
+        fields = [
+            {"id": int(key), "value": value} if str(key).isdigit() else {"name": key, "value": value}
+            for key, value in task_request.field_values.items()
+        ]
+        create_request = pyrus.models.requests.CreateTaskRequest(
             form_id=task_request.form_id,
-            field_values=task_request.field_values,
+            fields=fields,
             subject=task_request.subject,
             text=task_request.text
         )
         
-        response = pyrus_client.create_task(create_request)
+        response = await pyrus_client.create_task(create_request)
         
         if response.error_code:
-            raise HTTPException(status_code=400, detail=f"Ошибка создания задачи: {response.error_code}")
+            raise HTTPException(status_code=400, detail=f"Ошибка создания задачи: {response.error or response.error_code}")
         
         return {
-            "task_id": response.task_id,
+            "task_id": response.task.id,
             "message": "Задача успешно создана"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/tasks/{task_id}/form")
-async def get_task_form_data(task_id: int, pyrus_client: client.PyrusAPI = Depends(get_pyrus_client)):
+@app.post("/api/tasks/import")
+async def import_tasks(
+    form_id: int,
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
     """
-    Получить данные формы для редактирования существующей задачи
+    Создать задачи формы из файла CSV (первая строка — заголовок) или NDJSON (объект на строку).
+    Столбцы — имена или id полей формы, а также text, subject, responsible.
+    dry_run=true — только проверка строк без создания задач.
+    Отчет по каждой строке: созданный task_id или ошибка; format=ndjson — отчет потоком по мере создания.
+    Ответ JSON приходит только после обработки всего файла (при лимите запросов к Pyrus — минуты на тысячи строк),
+    поэтому он подходит для небольших файлов и dry_run; большие файлы импортируются с format=ndjson
     """
+    form_schema = await get_form_schema(pyrus_client, form_id)
+    if form_schema.error_code:
+        raise HTTPException(status_code=404, detail=f"Форма не найдена: {form_schema.error_code}")
+
+    mapper = FieldMapper(form_schema)
     try:
-        # Получаем задачу
-        task_response = pyrus_client.get_task(task_id)
-        if task_response.error_code:
-            raise HTTPException(status_code=404, detail="Задача не найдена")
-        
-        task = task_response.task
-        form_id = task.form_id
-        
-        # Получаем форму с каталогами
-        form_response = await get_task_form(form_id, pyrus_client)
-        
-        # Добавляем текущие значения полей задачи
-        task_field_values = {}
-        if hasattr(task, 'fields') and task.fields:
-            for field in task.fields:
-                task_field_values[field.id] = field.value
-        
-        return {
-            "form": form_response.form,
-            "catalogs": form_response.catalogs,
-            "current_values": task_field_values,
-            "task_id": task_id
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        file_format = detect_format(file.filename, file.content_type)
+    except TaskImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    source = take_upload_file(file)
+    try:
+        rows = await prepare_rows(source, file_format, mapper)
+    except TaskImportError as e:
+        source.close()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    results = iter_import_results(pyrus_client, form_id, mapper, rows, dry_run=dry_run, source=source)
+    if response_format == "ndjson":
+        return StreamingResponse(
+            iter_report_ndjson(results),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    report = sorted([result async for result in results], key=lambda result: result["row"] or 0)
+    return {"form_id": form_id, "dry_run": dry_run, **summarize_import(report), "results": report}
 
 if __name__ == "__main__":
     import uvicorn
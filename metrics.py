@@ -0,0 +1,163 @@
+"""
+Метрики приложения в текстовом формате Prometheus: задержки запросов и вызовов Pyrus, запросы в обработке, кэши
+"""
+import bisect
+import threading
+import time
+
+from cache import TTLCache
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Счетчики по корзинам (последняя — +Inf), сумма и число наблюдений
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self.header()
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+HTTP_REQUESTS = Counter("http_requests_total", "Число обработанных HTTP-запросов", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Число HTTP-запросов в обработке (включая открытые потоки SSE)")
+PYRUS_CALLS = Counter("pyrus_calls_total", "Число запросов к Pyrus по методу клиента и результату", ("method", "outcome"))
+PYRUS_CALL_SECONDS = Histogram("pyrus_call_duration_seconds", "Время выполнения запроса к Pyrus", ("method",))
+PYRUS_RETRIES = Counter("pyrus_retries_total", "Повторы запросов к Pyrus по методу и причине", ("method", "reason"))
+PYRUS_RATE_LIMIT_WAIT = Histogram("pyrus_rate_limit_wait_seconds", "Ожидание в очереди ограничителя частоты запросов к Pyrus", ("priority",))
+PYRUS_COALESCED = Counter("pyrus_calls_coalesced_total", "Вызовы, объединенные с уже выполняющимся запросом к Pyrus", ("method",))
+
+
+def observe_pyrus_call(method, seconds, outcome):
+    PYRUS_CALLS.inc(method, outcome)
+    PYRUS_CALL_SECONDS.observe(seconds, method)
+
+
+def _render_caches():
+    """Счетчики всех экземпляров TTLCache (собираются в момент запроса /metrics)"""
+    stats = sorted((cache.stats() for cache in list(TTLCache.instances)), key=lambda item: item["name"])
+    lines = []
+    for metric, key, kind, documentation in (
+        ("cache_hits_total", "hits", "counter", "Попадания в кэш"),
+        ("cache_misses_total", "misses", "counter", "Промахи кэша"),
+        ("cache_evictions_total", "evictions", "counter", "Вытеснения из кэша"),
+        ("cache_entries", "entries", "gauge", "Число записей в кэше"),
+    ):
+        lines += [f"# HELP {metric} {documentation}", f"# TYPE {metric} {kind}"]
+        # Кэши с одинаковым именем суммируются
+        totals = {}
+        for item in stats:
+            totals[item["name"]] = totals.get(item["name"], 0) + item[key]
+        lines += [f'{metric}{{cache="{_escape(name)}"}} {value}' for name, value in totals.items()]
+    return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    lines += _render_caches()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Задержка и статус каждого HTTP-запроса по шаблону маршрута, число запросов в обработке"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        HTTP_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            # Шаблон пути (/api/tasks/{task_id}) вместо фактического, чтобы не плодить ряды метрик
+            route_path = getattr(route, "path", None) or "unmatched"
+            elapsed = time.perf_counter() - started
+            HTTP_REQUESTS.inc(scope["method"], route_path, str(status))
+            HTTP_REQUEST_SECONDS.observe(elapsed, scope["method"], route_path, str(status))
@@ -0,0 +1,36 @@
+"""
+ASGI middleware приложения
+"""
+
+
+class PyrusCallsMiddleware:
+    """
+    Добавляет к ответу заголовок X-Pyrus-Calls — число запросов к Pyrus, выполненных при обработке запроса.
+    Реализован на уровне ASGI, чтобы не буферизовать потоковые ответы (SSE, NDJSON).
+    Потоковым ответам (без Content-Length) заголовок не добавляется: он уходит до того,
+    как тело ответа начнет обращаться к Pyrus, и показывал бы заниженное число
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+
+        async def send_with_calls(message):
+            if message["type"] == "http.response.start":
+                pyrus_client = state.get("pyrus_client")
+                headers = message.get("headers", [])
+                streaming = not any(name.lower() == b"content-length" for name, _ in headers)
+                if pyrus_client is not None and not streaming:
+                    headers = list(headers)
+                    headers.append((b"x-pyrus-calls", str(pyrus_client.upstream_calls).encode()))
+                    headers.append((b"x-pyrus-memo-hits", str(pyrus_client.memo_hits).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_calls)
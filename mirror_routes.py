@@ -0,0 +1,67 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from typing import Optional
+from datetime import datetime, timezone
+
+from pyrus_async import AsyncPyrusClient
+from pyrus_clients import get_pyrus_client
+from schemas import MirrorTask, MirrorTasksResponse
+from task_mirror import TASK_MIRROR_MAX_STALENESS_SECONDS, MirrorFormNotFound, MirrorStaleError, ensure_fresh, query_tasks
+
+router = APIRouter(prefix="/mirror", tags=["mirror"])
+
+@router.get("/tasks", response_model=MirrorTasksResponse)
+async def get_mirror_tasks(
+    response: Response,
+    form_id: int,
+    step: Optional[int] = None,
+    closed: Optional[bool] = None,
+    responsible_id: Optional[int] = None,
+    due_before: Optional[datetime] = None,
+    due_after: Optional[datetime] = None,
+    modified_after: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    max_staleness: float = Query(TASK_MIRROR_MAX_STALENESS_SECONDS, ge=0),
+    pyrus_client: AsyncPyrusClient = Depends(get_pyrus_client),
+):
+    """
+    Задачи формы из локального зеркала. Данные не старше max_staleness секунд:
+    более старые сначала синхронизируются с Pyrus; если это не удалось — 503, неизвестная форма — 404
+    """
+    try:
+        sync = await ensure_fresh(pyrus_client, form_id, max_staleness)
+    except MirrorFormNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except MirrorStaleError as e:
+        age = "нет данных" if e.age_seconds is None else f"{e.age_seconds:.0f} с"
+        raise HTTPException(status_code=503, detail=f"Зеркало задач устарело ({age}): {str(e)}")
+
+    rows, total = await query_tasks(
+        pyrus_client.account, form_id,
+        step=step, closed=closed, responsible_id=responsible_id,
+        due_before=due_before, due_after=due_after, modified_after=modified_after,
+        limit=limit, offset=offset,
+    )
+    synced_at = sync.last_sync_at.replace(tzinfo=timezone.utc)
+    age_seconds = round((datetime.now(timezone.utc) - synced_at).total_seconds(), 3)
+    response.headers["X-Mirror-Age"] = str(age_seconds)
+    return MirrorTasksResponse(
+        form_id=form_id,
+        synced_at=synced_at,
+        age_seconds=age_seconds,
+        total=total,
+        tasks=[
+            MirrorTask(
+                id=row.task_id,
+                form_id=row.form_id,
+                step=row.step,
+                due=row.due.replace(tzinfo=timezone.utc) if row.due else None,
+                closed=row.closed,
+                responsible_id=row.responsible_id,
+                create_date=row.create_date.replace(tzinfo=timezone.utc) if row.create_date else None,
+                last_modified_date=row.last_modified_date.replace(tzinfo=timezone.utc),
+                fields=row.fields or {},
+            )
+            for row in rows
+        ],
+    )
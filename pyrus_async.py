@@ -0,0 +1,211 @@
+"""
+Неблокирующий доступ к Pyrus: синхронные вызовы клиента выполняются в ограниченном пуле потоков
+"""
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import PYRUS_COALESCED, PYRUS_RATE_LIMIT_WAIT, PYRUS_RETRIES, observe_pyrus_call
+from rate_limit import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NAMES,
+    PYRUS_RETRY_ATTEMPTS,
+    RETRYABLE_ERROR_CODES,
+    RETRYABLE_STATUSES,
+    call_with_status,
+    get_limiter,
+    retry_delay,
+)
+from server_timing import record_timing
+from singleflight import SingleFlight, freeze
+
+# Максимальное число одновременных HTTP-запросов к Pyrus на процесс
+PYRUS_IO_THREADS = int(os.getenv("PYRUS_IO_THREADS", "32"))
+# Максимальное число одновременных запросов к Pyrus в рамках одного входящего запроса
+PYRUS_FANOUT_CONCURRENCY = int(os.getenv("PYRUS_FANOUT_CONCURRENCY", "8"))
+# Объединение одинаковых одновременных чтений одного аккаунта в один запрос к Pyrus
+PYRUS_SINGLE_FLIGHT = os.getenv("PYRUS_SINGLE_FLIGHT", "1") == "1"
+
+_executor = ThreadPoolExecutor(max_workers=PYRUS_IO_THREADS, thread_name_prefix="pyrus-io")
+
+
+async def run_in_pyrus_pool(func, *args, **kwargs):
+    """Выполнение блокирующей функции в пуле потоков Pyrus без блокировки цикла событий"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def gather_limited(coroutines, limit=PYRUS_FANOUT_CONCURRENCY):
+    """
+    Параллельное выполнение корутин, не более limit одновременно.
+    Результаты возвращаются в исходном порядке, исключения — как значения
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines), return_exceptions=True)
+
+
+# Методы только для чтения, результаты которых можно переиспользовать в рамках одного запроса
+MEMOIZED_METHODS = frozenset({"get_forms", "get_form", "get_catalog", "get_task"})
+# Чтения, одинаковые одновременные вызовы которых объединяются между запросами
+COALESCED_METHODS = MEMOIZED_METHODS | {"get_registry", "get_inbox"}
+
+_flights = SingleFlight(name="pyrus")
+
+
+def single_flight_stats():
+    return {"enabled": PYRUS_SINGLE_FLIGHT, **_flights.stats()}
+
+
+async def _timed_call(method_name, method, args, kwargs):
+    """
+    Фактический запрос к Pyrus с учетом в метриках (число, результат, задержка).
+    Возвращает (результат, HTTP-статус, Retry-After)
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result, status, retry_after = await run_in_pyrus_pool(call_with_status, method, *args, **kwargs)
+        outcome = "error_code" if getattr(result, "error_code", None) else "ok"
+        return result, status, retry_after
+    finally:
+        observe_pyrus_call(method_name, time.perf_counter() - started, outcome)
+
+
+def _retry_reason(method_name, result, status):
+    """Причина повтора запроса или None. 5xx повторяются только для чтений: запись могла дойти до Pyrus"""
+    error_code = getattr(result, "error_code", None)
+    if status == 429 or (status is None and error_code == "too_many_requests"):
+        return "throttled"
+    if not method_name.startswith("get_"):
+        return None
+    if status in RETRYABLE_STATUSES or (status is None and error_code in RETRYABLE_ERROR_CODES):
+        return "server_error"
+    return None
+
+
+async def _scheduled_call(account, priority, method_name, method, args, kwargs):
+    """Запрос к Pyrus в пределах лимита аккаунта, с повторами при 429/5xx и сетевых ошибках"""
+    limiter = get_limiter(account)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            waited = await limiter.acquire(priority)
+            if waited:
+                PYRUS_RATE_LIMIT_WAIT.observe(waited, PRIORITY_NAMES[priority])
+                record_timing("pyrus.queue", waited, method_name)
+        attempt += 1
+        try:
+            result, status, retry_after = await _timed_call(method_name, method, args, kwargs)
+        except (OSError, ValueError):
+            # Сетевая ошибка или ответ не в JSON (страница 502 от прокси)
+            if attempt > PYRUS_RETRY_ATTEMPTS or not method_name.startswith("get_"):
+                raise
+            reason, retry_after = "network", None
+        else:
+            reason = _retry_reason(method_name, result, status)
+            if reason is None or attempt > PYRUS_RETRY_ATTEMPTS:
+                return result
+        PYRUS_RETRIES.inc(method_name, reason)
+        await asyncio.sleep(retry_delay(attempt, retry_after))
+
+
+class AsyncPyrusClient:
+    """
+    Асинхронная обертка над синхронным клиентом Pyrus.
+    С memoize=True (обертка на один входящий запрос) одинаковые чтения выполняются не более одного раза
+    """
+
+    def __init__(self, pyrus_client, account=None, memoize=False, priority=PRIORITY_INTERACTIVE):
+        self.sync_client = pyrus_client
+        self.account = account or getattr(pyrus_client, "login", None)
+        # Фоновые обертки (обновление сводок, опрос inbox) пропускают вперед запросы пользователей
+        self.priority = priority
+        self._memo = {} if memoize else None
+        # Число фактически выполненных запросов к Pyrus и повторных чтений, взятых из memo
+        self.upstream_calls = 0
+        self.memo_hits = 0
+
+    async def call(self, method_name, *args, **kwargs):
+        """Вызов метода синхронного клиента в пуле потоков"""
+        started = time.perf_counter()
+        source, result = self._dispatch(method_name, args, kwargs)
+        try:
+            return await result
+        finally:
+            # Источник результата: upstream — запрос к Pyrus, shared — чужой такой же запрос, memo — повтор в запросе
+            desc = f"{source} {args[0]}" if args and isinstance(args[0], int) else source
+            record_timing(f"pyrus.{method_name}", time.perf_counter() - started, desc, started)
+
+    def _dispatch(self, method_name, args, kwargs):
+        """Источник результата и awaitable с результатом"""
+        if self._memo is None:
+            return self._call_upstream(method_name, args, kwargs)
+        if method_name not in MEMOIZED_METHODS:
+            # Изменяющий вызов: ранее прочитанные данные могли устареть
+            self._memo.clear()
+            return self._call_upstream(method_name, args, kwargs)
+
+        key = (method_name, args, tuple(sorted(kwargs.items())))
+        try:
+            future = self._memo.get(key)
+        except TypeError:
+            # Нехешируемые аргументы — выполняем без memo
+            return self._call_upstream(method_name, args, kwargs)
+        if future is None:
+            source, result = self._call_upstream(method_name, args, kwargs)
+            future = self._memo[key] = asyncio.ensure_future(result)
+        else:
+            source = "memo"
+            self.memo_hits += 1
+        # shield: отмена одного ожидающего не отменяет общий вызов для остальных
+        return source, asyncio.shield(future)
+
+    def _call_upstream(self, method_name, args, kwargs):
+        method = getattr(self.sync_client, method_name)
+        if not PYRUS_SINGLE_FLIGHT or method_name not in COALESCED_METHODS:
+            self.upstream_calls += 1
+            return "upstream", _scheduled_call(self.account, self.priority, method_name, method, args, kwargs)
+
+        key = (self.account, method_name, freeze(args), freeze(kwargs))
+        future, leader = _flights.start(
+            key,
+            lambda: _scheduled_call(self.account, self.priority, method_name, method, args, kwargs),
+            method=method_name,
+        )
+        if leader:
+            # Запрос к Pyrus выполняет только первый из одновременных вызовов
+            self.upstream_calls += 1
+            return "upstream", asyncio.shield(future)
+        PYRUS_COALESCED.inc(method_name)
+        return "shared", asyncio.shield(future)
+
+    async def get_forms(self):
+        return await self.call("get_forms")
+
+    async def get_form(self, form_id):
+        return await self.call("get_form", form_id)
+
+    async def get_registry(self, form_id, form_register_request=None):
+        return await self.call("get_registry", form_id, form_register_request)
+
+    async def get_catalog(self, catalog_id, filters=None):
+        return await self.call("get_catalog", catalog_id, filters)
+
+    async def get_task(self, task_id):
+        return await self.call("get_task", task_id)
+
+    async def get_inbox(self, tasks_count=50):
+        return await self.call("get_inbox", tasks_count=tasks_count)
+
+    async def comment_task(self, task_id, task_comment_request):
+        return await self.call("comment_task", task_id, task_comment_request)
+
+    async def create_task(self, create_task_request):
+        return await self.call("create_task", create_task_request)
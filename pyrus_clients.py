@@ -0,0 +1,153 @@
+"""
+Реестр авторизованных клиентов Pyrus, общий для всех запросов
+"""
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from fastapi import Depends, HTTPException, Request
+from pyrus import client
+from sqlalchemy import event, inspect
+
+from cache import TTLCache
+from pyrus_async import AsyncPyrusClient, run_in_pyrus_pool
+from rate_limit import PRIORITY_BACKGROUND, note_response
+from database import AsyncSessionLocal, User
+from auth_cache import get_user
+from auth_utils import get_current_active_user_from_cookie
+
+# Время, через которое токен Pyrus обновляется заранее (Pyrus не сообщает срок жизни токена)
+PYRUS_TOKEN_TTL_SECONDS = int(os.getenv("PYRUS_TOKEN_TTL_SECONDS", "3600"))
+# Клиент, к которому не обращались дольше этого времени, удаляется из реестра
+PYRUS_CLIENT_IDLE_TTL_SECONDS = int(os.getenv("PYRUS_CLIENT_IDLE_TTL_SECONDS", "1800"))
+PYRUS_CLIENT_CACHE_SIZE = int(os.getenv("PYRUS_CLIENT_CACHE_SIZE", "256"))
+# Адрес Pyrus API вместо api.pyrus.com (например, http://127.0.0.1:8900 для нагрузочных тестов)
+PYRUS_BASE_URL = os.getenv("PYRUS_BASE_URL")
+
+
+class CachedPyrusAPI(client.PyrusAPI):
+    """Клиент Pyrus, который следит за возрастом токена и обновляет его заранее"""
+
+    def __init__(self, *args, token_ttl=PYRUS_TOKEN_TTL_SECONDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token_ttl = token_ttl
+        self.token_obtained_at = None
+        self._auth_lock = threading.RLock()
+        if PYRUS_BASE_URL:
+            url = urlparse(PYRUS_BASE_URL)
+            # И авторизация, и запросы API идут на указанный адрес
+            self._protocol = url.scheme or "http"
+            self._host = self._auth_host = url.netloc
+
+    @property
+    def token_expired(self):
+        if not self.access_token or self.token_obtained_at is None:
+            return True
+        return time.monotonic() - self.token_obtained_at >= self.token_ttl
+
+    def _auth(self):
+        # Вызывается и при первой авторизации, и библиотекой при ответе 401
+        with self._auth_lock:
+            response = super()._auth()
+            self.token_obtained_at = time.monotonic() if self.access_token else None
+            return response
+
+    def _perform_request(self, *args, **kwargs):
+        response = super()._perform_request(*args, **kwargs)
+        # Статус и Retry-After нужны планировщику повторов (библиотека отдает только тело ответа)
+        note_response(response)
+        return response
+
+    def _perform_request_with_retry(self, path, method, *args, **kwargs):
+        if self.token_expired:
+            with self._auth_lock:
+                # Повторная проверка: токен мог обновить соседний поток
+                if self.token_expired:
+                    self._auth()
+        return super()._perform_request_with_retry(path, method, *args, **kwargs)
+
+
+class PyrusClientRegistry:
+    """LRU/TTL-кэш авторизованных клиентов Pyrus по логину пользователя"""
+
+    def __init__(self, max_clients=PYRUS_CLIENT_CACHE_SIZE, idle_ttl=PYRUS_CLIENT_IDLE_TTL_SECONDS):
+        self._clients = TTLCache(max_entries=max_clients, ttl=idle_ttl, sliding=True, name="pyrus_clients")
+
+    def get_cached(self, login: str, security_key: str):
+        """Получение уже авторизованного клиента без обращения к Pyrus"""
+        pyrus_client = self._clients.get(login)
+        if pyrus_client is not None and pyrus_client.security_key == security_key:
+            return pyrus_client
+        return None
+
+    def get_client(self, login: str, security_key: str) -> CachedPyrusAPI:
+        """Получение авторизованного клиента; при первом обращении выполняется auth()"""
+        pyrus_client = self.get_cached(login, security_key)
+        if pyrus_client is not None:
+            return pyrus_client
+
+        pyrus_client = CachedPyrusAPI(login=login, security_key=security_key)
+        try:
+            auth_response = pyrus_client.auth()
+        except Exception as e:
+            raise HTTPException(status_code=401, detail=f"Ошибка подключения к Pyrus: {str(e)}")
+        if not auth_response.success:
+            raise HTTPException(status_code=401, detail=f"Ошибка авторизации в Pyrus: {auth_response.error}")
+
+        self._clients.set(login, pyrus_client)
+        return pyrus_client
+
+    def invalidate(self, login: str):
+        """Удаление клиента пользователя (например, после смены ключа)"""
+        self._clients.pop(login)
+
+    def stats(self):
+        return self._clients.stats()
+
+
+pyrus_clients = PyrusClientRegistry()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_client(mapper, connection, target):
+    # Клиент со старым ключом или деактивированного пользователя больше не должен использоваться
+    state = inspect(target)
+    if state.deleted or state.attrs.security_key.history.has_changes() or state.attrs.is_active.history.has_changes():
+        pyrus_clients.invalidate(target.login)
+
+
+async def get_pyrus_client(
+    request: Request,
+    current_user: User = Depends(get_current_active_user_from_cookie),
+) -> AsyncPyrusClient:
+    """Получение клиента Pyrus для текущего пользователя (новая обертка с memo на каждый запрос)"""
+    pyrus_client = pyrus_clients.get_cached(current_user.login, current_user.security_key)
+    if pyrus_client is None:
+        # auth() — сетевой вызов, выполняем его вне цикла событий
+        pyrus_client = await run_in_pyrus_pool(
+            pyrus_clients.get_client, current_user.login, current_user.security_key
+        )
+    async_client = AsyncPyrusClient(pyrus_client, memoize=True)
+    # Счетчик вызовов Pyrus отдается в заголовке X-Pyrus-Calls (см. middleware)
+    request.state.pyrus_client = async_client
+    return async_client
+
+
+async def get_background_client(account, current=None) -> AsyncPyrusClient:
+    """
+    Клиент Pyrus для фоновой задачи пользователя с актуальным ключом из базы:
+    после смены ключа или вытеснения из реестра клиент авторизуется заново.
+    current — прежняя обертка; возвращается, если клиент не изменился
+    """
+    async with AsyncSessionLocal() as db:
+        user = await get_user(db, account)
+    if user is None or not user.is_active:
+        raise RuntimeError(f"Пользователь {account} не найден или деактивирован")
+    pyrus_client = pyrus_clients.get_cached(user.login, user.security_key)
+    if pyrus_client is None:
+        pyrus_client = await run_in_pyrus_pool(pyrus_clients.get_client, user.login, user.security_key)
+    if current is not None and current.sync_client is pyrus_client:
+        return current
+    return AsyncPyrusClient(pyrus_client, account=account, priority=PRIORITY_BACKGROUND)
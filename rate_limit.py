@@ -0,0 +1,187 @@
+"""
+Ограничение частоты запросов к Pyrus по аккаунту (token bucket) и повтор запросов при 429/5xx.
+Всплески ставятся в очередь, интерактивные вызовы обслуживаются раньше фоновых
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+# Средняя частота запросов к Pyrus на аккаунт в процессе; 0 — без ограничения.
+# По умолчанию рассчитано на квоту 10 запросов/с (600 в минуту) на аккаунт; задается под тариф развертывания
+PYRUS_RATE_LIMIT_PER_SECOND = float(os.getenv("PYRUS_RATE_LIMIT_PER_SECOND", "10"))
+# Сколько запросов можно выполнить подряд без ожидания
+PYRUS_RATE_LIMIT_BURST = int(os.getenv("PYRUS_RATE_LIMIT_BURST", "30"))
+# Токены, которые фоновые запросы (сводки, зеркало, импорт, пакетные комментарии) не расходуют:
+# интерактивные запросы не ждут за фоновой нагрузкой
+PYRUS_RATE_LIMIT_INTERACTIVE_RESERVE = int(os.getenv("PYRUS_RATE_LIMIT_INTERACTIVE_RESERVE", "10"))
+# Повторы после 429, 5xx и сетевых ошибок; пауза — случайная в пределах экспоненциально растущего окна
+PYRUS_RETRY_ATTEMPTS = int(os.getenv("PYRUS_RETRY_ATTEMPTS", "3"))
+PYRUS_RETRY_BASE_DELAY = float(os.getenv("PYRUS_RETRY_BASE_DELAY", "0.5"))
+PYRUS_RETRY_MAX_DELAY = float(os.getenv("PYRUS_RETRY_MAX_DELAY", "10"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Коды ошибок Pyrus, при которых запрос можно повторить, если HTTP-статус неизвестен
+RETRYABLE_ERROR_CODES = frozenset({"too_many_requests", "server_error", "service_unavailable"})
+
+
+class AccountRateLimiter:
+    """
+    Token bucket одного аккаунта. Пока есть токены и нет очереди, запрос проходит сразу;
+    иначе ждет своей очереди по (приоритет, порядок поступления).
+    Фоновым запросам нужно больше reserve токенов, последние токены остаются интерактивным
+    """
+
+    def __init__(self, account, rate=PYRUS_RATE_LIMIT_PER_SECOND, burst=PYRUS_RATE_LIMIT_BURST,
+                 reserve=PYRUS_RATE_LIMIT_INTERACTIVE_RESERVE):
+        self.account = account
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.reserve = max(0, min(reserve, self.burst - 1))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._waiters = []  # куча (приоритет, номер, future)
+        self._order = itertools.count()
+        self._timer = None
+        self._loop = None
+        self.granted = Counter()
+        self.queued = Counter()
+        self.wait_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _needed(self, priority):
+        return 1 if priority == PRIORITY_INTERACTIVE else 1 + self.reserve
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE) -> float:
+        """Ожидание права на запрос; возвращает время ожидания в секундах"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Очередь и таймер привязаны к циклу событий (актуально для тестов с asyncio.run)
+            self._loop, self._waiters, self._timer = loop, [], None
+
+        self._refill()
+        # Очередь из одних менее приоритетных запросов не задерживает этот
+        if (not self._waiters or self._waiters[0][0] > priority) and self._tokens >= self._needed(priority):
+            self._tokens -= 1
+            self.granted[priority] += 1
+            return 0.0
+
+        started = time.monotonic()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self.queued[priority] += 1
+        if self._timer is not None and self._waiters[0][2] is future:
+            # Новая голова очереди: таймер был рассчитан на фоновый запрос, которому нужно больше токенов
+            self._timer.cancel()
+            self._timer = None
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Токен уже выдан, но запрос не состоится — возвращаем его
+                self._tokens = min(self.burst, self._tokens + 1)
+            raise
+        waited = time.monotonic() - started
+        self.wait_seconds += waited
+        self.granted[priority] += 1
+        return waited
+
+    def _schedule(self):
+        if self._timer is None and self._waiters:
+            needed = self._needed(self._waiters[0][0])
+            delay = max(0.0, (needed - self._tokens) / self.rate)
+            self._timer = self._loop.call_later(delay, self._release)
+
+    def _release(self):
+        self._timer = None
+        self._refill()
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # Ожидающий отменен
+                heapq.heappop(self._waiters)
+                continue
+            if self._tokens < self._needed(priority):
+                break
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            future.set_result(None)
+        self._schedule()
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "interactive_reserve": self.reserve,
+            "tokens": round(min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate), 2),
+            "waiting": sum(1 for _, _, future in self._waiters if not future.done()),
+            "granted": {PRIORITY_NAMES[key]: value for key, value in self.granted.items()},
+            "queued": {PRIORITY_NAMES[key]: value for key, value in self.queued.items()},
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+_limiters = {}
+
+
+def get_limiter(account):
+    """Ограничитель аккаунта или None, если ограничение выключено"""
+    if PYRUS_RATE_LIMIT_PER_SECOND <= 0:
+        return None
+    limiter = _limiters.get(account)
+    if limiter is None:
+        limiter = _limiters[account] = AccountRateLimiter(account)
+    return limiter
+
+
+def retry_delay(attempt, retry_after=None):
+    """Пауза перед повтором attempt (с 1): full jitter, но не меньше Retry-After от Pyrus"""
+    window = min(PYRUS_RETRY_MAX_DELAY, PYRUS_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    delay = random.uniform(0, window)
+    if retry_after:
+        delay = max(delay, min(retry_after, PYRUS_RETRY_MAX_DELAY))
+    return delay
+
+
+# HTTP-статус последнего ответа Pyrus в текущем потоке пула (библиотека pyrus его не возвращает)
+_last_response = threading.local()
+
+
+def note_response(response):
+    """Запоминание статуса и Retry-After ответа; вызывается клиентом Pyrus в потоке запроса"""
+    _last_response.status = getattr(response, "status_code", None)
+    retry_after = (getattr(response, "headers", None) or {}).get("Retry-After")
+    try:
+        _last_response.retry_after = float(retry_after) if retry_after else None
+    except ValueError:
+        _last_response.retry_after = None
+
+
+def call_with_status(func, *args, **kwargs):
+    """Вызов метода синхронного клиента; возвращает (результат, HTTP-статус, Retry-After)"""
+    _last_response.status = _last_response.retry_after = None
+    result = func(*args, **kwargs)
+    return result, _last_response.status, _last_response.retry_after
+
+
+def rate_limit_stats():
+    return {
+        "rate_per_second": PYRUS_RATE_LIMIT_PER_SECOND,
+        "burst": PYRUS_RATE_LIMIT_BURST,
+        "interactive_reserve": PYRUS_RATE_LIMIT_INTERACTIVE_RESERVE,
+        "retry_attempts": PYRUS_RETRY_ATTEMPTS,
+        "accounts": {account: limiter.stats() for account, limiter in _limiters.items()},
+    }
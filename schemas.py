@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Any, Dict
 from datetime import datetime
 
@@ -55,6 +55,9 @@ class CatalogSummary(BaseModel):
 class CatalogsListResponse(BaseModel):
     catalogs: List[CatalogSummary]
     total_count: int
+    # Время последнего обновления сводок и их возраст в секундах
+    updated_at: Optional[datetime] = None
+    age_seconds: Optional[float] = None
 
 # Схемы для формы задачи
 class TaskFormField(BaseModel):
@@ -79,3 +82,46 @@ class TaskCreateRequest(BaseModel):
     field_values: Dict[str, Any]
     subject: Optional[str] = None
     text: Optional[str] = None
+
+# Предел числа задач в одном пакетном запросе комментариев
+BULK_COMMENT_MAX_ITEMS = 500
+
+class BulkCommentItem(BaseModel):
+    task_id: int
+    text: str = ""
+    action: Optional[str] = None
+    field_updates: Optional[List[Dict[str, Any]]] = None
+
+class BulkCommentRequest(BaseModel):
+    items: List[BulkCommentItem] = Field(..., min_length=1, max_length=BULK_COMMENT_MAX_ITEMS)
+
+class BulkCommentResult(BaseModel):
+    index: int
+    task_id: int
+    ok: bool
+    error: Optional[str] = None
+    last_modified_date: Optional[datetime] = None
+
+class BulkCommentResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BulkCommentResult]
+
+class MirrorTask(BaseModel):
+    id: int
+    form_id: int
+    step: Optional[int] = None
+    due: Optional[datetime] = None
+    closed: bool
+    responsible_id: Optional[int] = None
+    create_date: Optional[datetime] = None
+    last_modified_date: datetime
+    fields: Dict[str, Any] = {}
+
+class MirrorTasksResponse(BaseModel):
+    form_id: int
+    synced_at: Optional[datetime] = None
+    age_seconds: Optional[float] = None
+    total: int
+    tasks: List[MirrorTask]
@@ -0,0 +1,133 @@
+"""
+Хронология запроса: вызовы Pyrus и обращения к кэшам в заголовке Server-Timing и (по желанию) в журнале
+"""
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from starlette.datastructures import MutableHeaders
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "1") == "1"
+# Строка JSON с хронологией каждого запроса в журнал
+SERVER_TIMING_TRACE_LOG = os.getenv("SERVER_TIMING_TRACE_LOG", "0") == "1"
+# Сколько записей попадает в заголовок; остальные суммируются в одну запись other
+SERVER_TIMING_MAX_ENTRIES = int(os.getenv("SERVER_TIMING_MAX_ENTRIES", "30"))
+# Предел числа записей в хронологии одного запроса
+SERVER_TIMING_MAX_SPANS = 1000
+
+_timeline = contextvars.ContextVar("server_timing", default=None)
+
+
+class Timeline:
+    """Записи (имя, длительность в секундах, пояснение, смещение от начала запроса)"""
+
+    __slots__ = ("started", "spans", "dropped", "closed")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        # После ответа записи не принимаются: фоновые задачи, созданные из запроса, наследуют контекст
+        self.closed = False
+
+    def add(self, name, seconds, desc=None, started=None):
+        if self.closed:
+            return
+        if len(self.spans) >= SERVER_TIMING_MAX_SPANS:
+            self.dropped += 1
+            return
+        offset = (started if started is not None else time.perf_counter() - seconds) - self.started
+        self.spans.append((name, seconds, desc, offset))
+
+    def header_value(self):
+        entries = []
+        spans = self.spans
+        if len(spans) > SERVER_TIMING_MAX_ENTRIES:
+            # В заголовок идут самые долгие записи
+            spans = sorted(spans, key=lambda span: span[1], reverse=True)
+            rest = spans[SERVER_TIMING_MAX_ENTRIES:]
+            spans = spans[:SERVER_TIMING_MAX_ENTRIES]
+            entries.append(_entry("other", sum(span[1] for span in rest), f"{len(rest) + self.dropped} more"))
+        entries[:0] = [_entry(name, seconds, desc) for name, seconds, desc, _ in spans]
+        entries.append(_entry("total", time.perf_counter() - self.started))
+        return ", ".join(entries)
+
+
+def _entry(name, seconds, desc=None):
+    entry = f"{name};dur={seconds * 1000:.1f}"
+    if desc:
+        entry += ';desc="' + str(desc).replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return entry
+
+
+def record_timing(name, seconds, desc=None, started=None):
+    """Запись в хронологию текущего запроса (вне запроса ничего не делает)"""
+    timeline = _timeline.get()
+    if timeline is not None:
+        timeline.add(name, seconds, desc, started)
+
+
+@contextmanager
+def timed(name, desc=None):
+    """Замер блока кода в хронологии текущего запроса"""
+    if _timeline.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - started, desc, started)
+
+
+class ServerTimingMiddleware:
+    """Создает хронологию на каждый HTTP-запрос и добавляет заголовок Server-Timing к ответу"""
+
+    def __init__(self, app, enabled=SERVER_TIMING_ENABLED, trace_log=SERVER_TIMING_TRACE_LOG):
+        self.app = app
+        self.enabled = enabled
+        self.trace_log = trace_log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        timeline = Timeline()
+        token = _timeline.set(timeline)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timeline.header_value())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            timeline.closed = True
+            _timeline.reset(token)
+            if self.trace_log:
+                self._log(scope, status, timeline)
+
+    @staticmethod
+    def _log(scope, status, timeline):
+        route = scope.get("route")
+        print(json.dumps({
+            "trace": "request",
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": getattr(route, "path", None),
+            "status": status,
+            "duration_ms": round((time.perf_counter() - timeline.started) * 1000, 1),
+            "spans": [
+                {"name": name, "start_ms": round(offset * 1000, 1), "dur_ms": round(seconds * 1000, 1), "desc": desc}
+                for name, seconds, desc, offset in timeline.spans
+            ],
+            "dropped": timeline.dropped,
+        }, ensure_ascii=False))
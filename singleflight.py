@@ -0,0 +1,73 @@
+"""
+Объединение одинаковых одновременных запросов: пока запрос выполняется, повторные ждут его результат
+"""
+import asyncio
+from collections import Counter
+
+
+def freeze(value):
+    """Хешируемое представление аргументов вызова (в том числе объектов запросов pyrus)"""
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return value
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [freeze(item) for item in value]
+        return tuple(sorted(items, key=repr) if isinstance(value, (set, frozenset)) else items)
+    if hasattr(value, "__dict__"):
+        return (type(value).__name__, freeze(vars(value)))
+    return repr(value)
+
+
+class SingleFlight:
+    """Не более одного выполняющегося запроса на ключ; остальные вызовы с тем же ключом получают его результат"""
+
+    def __init__(self, name="singleflight"):
+        self.name = name
+        self._in_flight = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.coalesced_by_method = Counter()
+
+    def __contains__(self, key):
+        return key in self._in_flight
+
+    def start(self, key, factory, method=None):
+        """
+        Future с результатом factory() для ключа и признак того, что запрос запущен этим вызовом.
+        factory вызывается, только если такого запроса еще нет
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            if method:
+                self.coalesced_by_method[method] += 1
+            return future, False
+        self.leaders += 1
+        future = self._in_flight[key] = asyncio.ensure_future(factory())
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future, True
+
+    async def do(self, key, factory, method=None):
+        """Результат factory() для ключа; factory вызывается, только если такого запроса еще нет"""
+        future, _ = self.start(key, factory, method)
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled():
+            # Помечаем исключение полученным, даже если все ожидающие уже отменены
+            future.exception()
+
+    def stats(self):
+        total = self.leaders + self.coalesced
+        return {
+            "name": self.name,
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+            "coalesced_by_method": dict(self.coalesced_by_method),
+        }
@@ -0,0 +1,384 @@
+"""
+Массовое создание задач из CSV или NDJSON: файл читается построчно, строки проверяются по схеме формы,
+задачи создаются конвейером из нескольких обработчиков в пределах лимита запросов к Pyrus
+"""
+import asyncio
+import csv
+import io
+import itertools
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+import pyrus.models
+from starlette.concurrency import run_in_threadpool
+
+from pyrus_async import PYRUS_FANOUT_CONCURRENCY, AsyncPyrusClient
+from rate_limit import PRIORITY_BACKGROUND
+
+# Сколько задач создается одновременно
+TASK_IMPORT_CONCURRENCY = int(os.getenv("TASK_IMPORT_CONCURRENCY", str(PYRUS_FANOUT_CONCURRENCY)))
+TASK_IMPORT_MAX_ROWS = int(os.getenv("TASK_IMPORT_MAX_ROWS", "10000"))
+# Строк, читаемых из файла за раз; чтение приостанавливается, пока обработчики заняты
+TASK_IMPORT_READ_BATCH = 200
+
+# Столбцы, которые относятся к самой задаче, а не к полям формы
+TASK_COLUMNS = ("text", "subject", "responsible")
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_TIME_RE = re.compile(r"^\d{1,2}:\d{2}$")
+_TRUE_VALUES = {"1", "true", "yes", "y", "да", "checked", "+"}
+_FALSE_VALUES = {"0", "false", "no", "n", "нет", "unchecked", "-"}
+
+
+class TaskImportError(ValueError):
+    """Ошибка файла целиком (неизвестный столбец, неподдерживаемый тип поля)"""
+
+
+def _number(field, value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    text = str(value).replace(" ", "").replace(" ", "").replace(",", ".")
+    try:
+        number = float(text)
+    except ValueError:
+        raise ValueError(f"{field.name}: ожидается число, получено {value!r}")
+    return int(number) if number.is_integer() else number
+
+
+def _date(field, value):
+    text = str(value).strip()
+    if not _DATE_RE.match(text):
+        raise ValueError(f"{field.name}: ожидается дата ГГГГ-ММ-ДД, получено {value!r}")
+    return text
+
+
+def _date_time(field, value):
+    text = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"{field.name}: ожидается дата и время ISO 8601, получено {value!r}")
+    # Время без часового пояса считается UTC, как в API Pyrus
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _time(field, value):
+    text = str(value).strip()
+    if not _TIME_RE.match(text):
+        raise ValueError(f"{field.name}: ожидается время ЧЧ:ММ, получено {value!r}")
+    return text
+
+
+def _checkmark(field, value):
+    text = str(value).strip().lower()
+    if text in _TRUE_VALUES:
+        return "checked"
+    if text in _FALSE_VALUES:
+        return "unchecked"
+    raise ValueError(f"{field.name}: ожидается да/нет, получено {value!r}")
+
+
+def _catalog(field, value):
+    if isinstance(value, dict):
+        return value
+    try:
+        return {"item_id": int(value)}
+    except (TypeError, ValueError):
+        raise ValueError(f"{field.name}: ожидается item_id элемента каталога, получено {value!r}")
+
+
+def _multiple_choice(field, value):
+    if isinstance(value, dict):
+        return value
+    options = getattr(getattr(field, "info", None), "options", None) or []
+    text = str(value).strip()
+    for option in options:
+        if str(option.choice_id) == text or (option.choice_value or "").strip().lower() == text.lower():
+            return {"choice_ids": [option.choice_id]}
+    raise ValueError(f"{field.name}: нет варианта {value!r}")
+
+
+def _person(field, value):
+    if isinstance(value, dict):
+        return value
+    text = str(value).strip()
+    if text.isdigit():
+        return {"id": int(text)}
+    if "@" in text:
+        return {"email": text}
+    raise ValueError(f"{field.name}: ожидается id или email сотрудника, получено {value!r}")
+
+
+def _text(field, value):
+    return value if isinstance(value, str) else str(value)
+
+
+# Тип поля формы -> преобразование значения ячейки в значение поля для Pyrus
+CONVERTERS = {
+    "text": _text,
+    "email": _text,
+    "phone": _text,
+    "number": _number,
+    "money": _number,
+    "date": _date,
+    "due_date": _date,
+    "due_date_time": _date_time,
+    "time": _time,
+    "checkmark": _checkmark,
+    "catalog": _catalog,
+    "multiple_choice": _multiple_choice,
+    "person": _person,
+}
+
+
+class FieldMapper:
+    """Соответствие столбцов файла полям формы: по имени поля, по id поля или служебный столбец задачи"""
+
+    def __init__(self, form_schema):
+        self.form_schema = form_schema
+        self._columns = {}
+
+    def resolve(self, column):
+        """Поле формы (или имя служебного столбца) для столбца; TaskImportError, если столбец не распознан"""
+        target = self._columns.get(column)
+        if target is not None:
+            return target
+        name = str(column).strip()
+        field_id = self.form_schema.field_id(name)
+        if field_id is None and name.isdigit() and self.form_schema.field(int(name)) is not None:
+            field_id = int(name)
+        if field_id is not None:
+            field = self.form_schema.field(field_id)
+            if field.type not in CONVERTERS:
+                raise TaskImportError(f"Столбец {name!r}: поле типа {field.type} не поддерживается при импорте")
+            target = field
+        elif name.lower() in TASK_COLUMNS:
+            target = name.lower()
+        else:
+            raise TaskImportError(f"Столбец {name!r} не найден среди полей формы {self.form_schema.form.id}")
+        self._columns[column] = target
+        return target
+
+    def build_request(self, form_id, values):
+        """CreateTaskRequest для строки; ValueError с описанием всех ошибок строки"""
+        fields, task, errors = [], {}, []
+        for column, value in values.items():
+            if value is None or value == "":
+                continue
+            target = self.resolve(column)
+            if isinstance(target, str):
+                task[target] = value
+                continue
+            try:
+                fields.append({"id": target.id, "value": CONVERTERS[target.type](target, value)})
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            raise ValueError("; ".join(errors))
+        if not fields:
+            raise ValueError("Пустая строка")
+
+        responsible = task.get("responsible")
+        if isinstance(responsible, str) and responsible.strip().isdigit():
+            responsible = int(responsible)
+        return pyrus.models.requests.CreateTaskRequest(
+            form_id=form_id,
+            fields=fields,
+            text=task.get("text"),
+            subject=task.get("subject"),
+            responsible=responsible,
+        )
+
+
+def detect_format(filename, content_type):
+    """csv или ndjson по расширению файла или типу содержимого"""
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or "") or "jsonl" in (content_type or ""):
+        return "ndjson"
+    if name.endswith((".csv", ".txt")) or "csv" in (content_type or ""):
+        return "csv"
+    raise TaskImportError("Не удалось определить формат файла: ожидается .csv или .ndjson")
+
+
+def iter_rows(binary_file, file_format):
+    """
+    Построчное чтение файла: пары (номер строки, словарь значений или ValueError).
+    Номер строки — номер записи данных начиная с 1 (заголовок CSV не считается)
+    """
+    text_file = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+    if file_format == "ndjson":
+        row_number = 0
+        for line in text_file:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                values = json.loads(line)
+            except ValueError as e:
+                yield row_number, ValueError(f"Некорректный JSON: {e}")
+                continue
+            yield row_number, values if isinstance(values, dict) else ValueError("Строка должна быть JSON-объектом")
+        return
+
+    sample = text_file.read(4096)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    # Заново читаем начало файла уже через csv.reader (прочитанный фрагмент подставляется перед остатком)
+    reader = csv.reader(_chain_text(sample, text_file), dialect)
+    header = next(reader, None)
+    if not header:
+        return
+    for row_number, row in enumerate(reader, start=1):
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) > len(header):
+            yield row_number, ValueError(f"Ячеек больше, чем столбцов в заголовке: {len(row)} > {len(header)}")
+            continue
+        yield row_number, dict(zip(header, row))
+
+
+def _chain_text(prefix, text_file):
+    """Строки из уже прочитанного фрагмента и остатка файла (csv.reader принимает итератор строк)"""
+    # Дочитываем до конца строки, чтобы не разрезать запись на границе фрагмента
+    yield from io.StringIO(prefix + text_file.readline(), newline="")
+    yield from text_file
+
+
+async def prepare_rows(binary_file, file_format, mapper):
+    """
+    Итератор строк файла с проверкой заголовка до начала импорта:
+    неизвестные столбцы и неверная кодировка дают TaskImportError сразу, а не посреди отчета
+    """
+    rows = iter_rows(binary_file, file_format)
+    try:
+        first = await run_in_threadpool(next, rows, None)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise TaskImportError(f"Ошибка чтения файла (ожидается UTF-8): {e}")
+    if first is None:
+        raise TaskImportError("Файл не содержит строк")
+    if isinstance(first[1], dict):
+        for column in first[1]:
+            mapper.resolve(column)
+    return itertools.chain([first], rows)
+
+
+async def iter_import_results(pyrus_client, form_id, mapper, rows, dry_run=False, source=None):
+    """
+    Конвейер импорта: чтение и проверка строк -> очередь -> TASK_IMPORT_CONCURRENCY обработчиков create_task.
+    Результаты ({"row", "ok", "task_id", "error"}) отдаются по мере готовности.
+    Вызовы идут с фоновым приоритетом, чтобы импорт не вытеснял интерактивные запросы пользователей.
+    source — файл загрузки (take_upload_file), закрывается по окончании
+    """
+    worker_client = AsyncPyrusClient(pyrus_client.sync_client, account=pyrus_client.account, priority=PRIORITY_BACKGROUND)
+    # Ограниченная очередь: чтение файла приостанавливается, пока обработчики заняты
+    work = asyncio.Queue(maxsize=TASK_IMPORT_CONCURRENCY * 2)
+    results = asyncio.Queue()
+    done = object()
+
+    def report(row_number, error=None, task_id=None):
+        results.put_nowait({"row": row_number, "ok": error is None, "task_id": task_id, "error": error})
+
+    async def read_rows():
+        try:
+            read = 0
+            while True:
+                batch = await run_in_threadpool(lambda: list(itertools.islice(rows, TASK_IMPORT_READ_BATCH)))
+                if not batch:
+                    break
+                for row_number, values in batch:
+                    read += 1
+                    if read > TASK_IMPORT_MAX_ROWS:
+                        report(row_number, f"Превышен предел {TASK_IMPORT_MAX_ROWS} строк, остаток файла пропущен")
+                        return
+                    try:
+                        if isinstance(values, Exception):
+                            raise values
+                        request = mapper.build_request(form_id, values)
+                    except (ValueError, TypeError) as e:
+                        # В том числе TaskImportError: в NDJSON у разных строк разные ключи
+                        report(row_number, str(e))
+                        continue
+                    if dry_run:
+                        report(row_number)
+                    else:
+                        await work.put((row_number, request))
+        except (UnicodeDecodeError, csv.Error) as e:
+            report(None, f"Ошибка чтения файла: {e}")
+
+    async def produce():
+        await read_rows()
+        # Не в finally: при отмене обработчики уже остановлены и очередь может быть заполнена
+        for _ in range(TASK_IMPORT_CONCURRENCY):
+            await work.put(done)
+
+    async def create():
+        while (item := await work.get()) is not done:
+            row_number, request = item
+            try:
+                response = await worker_client.create_task(request)
+            except Exception as e:
+                report(row_number, str(e))
+                continue
+            task = getattr(response, "task", None)
+            error_code = getattr(response, "error_code", None)
+            if error_code or task is None:
+                report(row_number, str(getattr(response, "error", None) or error_code or "Pyrus не вернул задачу"))
+            else:
+                report(row_number, task_id=task.id)
+
+    async def run():
+        try:
+            await asyncio.gather(produce(), *(create() for _ in range(TASK_IMPORT_CONCURRENCY)))
+        finally:
+            results.put_nowait(done)
+
+    pipeline = asyncio.create_task(run())
+    try:
+        while (result := await results.get()) is not done:
+            yield result
+        await pipeline
+    finally:
+        # Клиент отключился: новые задачи больше не создаются
+        pipeline.cancel()
+        # Дожидаемся чтения файла в пуле потоков, прежде чем его закрыть
+        await asyncio.gather(pipeline, return_exceptions=True)
+        # Вызовы импорта учитываются в X-Pyrus-Calls запроса (для ответа JSON)
+        pyrus_client.upstream_calls += worker_client.upstream_calls
+        if source is not None:
+            source.close()
+
+
+def summarize(results):
+    created = sum(1 for result in results if result["task_id"] is not None)
+    valid = sum(1 for result in results if result["ok"])
+    return {"rows": len(results), "created": created, "valid": valid, "failed": len(results) - valid}
+
+
+def take_upload_file(upload):
+    """
+    Двоичный файл загрузки, который можно читать после возврата из обработчика.
+    FastAPI закрывает файлы формы до начала потоковой выдачи ответа, поэтому файл забираем себе;
+    закрыть его должен вызывающий (iter_import_results(source=...))
+    """
+    source = upload.file
+    upload.file = io.BytesIO()
+    source.seek(0)
+    return source
+
+
+async def iter_report_ndjson(results):
+    """Отчет NDJSON: строка на каждую строку файла по мере обработки и итоговая строка summary"""
+    counts = {"rows": 0, "created": 0, "valid": 0, "failed": 0}
+    async for result in results:
+        counts["rows"] += 1
+        counts["created"] += result["task_id"] is not None
+        counts["valid"] += result["ok"]
+        counts["failed"] += not result["ok"]
+        yield json.dumps({"type": "result", **result}, ensure_ascii=False) + "\n"
+    yield json.dumps({"type": "summary", **counts}, ensure_ascii=False) + "\n"
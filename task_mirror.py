@@ -0,0 +1,373 @@
+"""
+Локальное зеркало задач Pyrus в базе: фоновая инкрементальная синхронизация по last_modified_date
+и быстрые выборки с явной границей устаревания данных
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pyrus.models
+from sqlalchemy import delete, func, select
+
+from database import AsyncSessionLocal, TaskMirror, TaskMirrorSync, async_engine
+from form_cache import get_form_schema
+from pyrus_async import AsyncPyrusClient
+from pyrus_clients import get_background_client
+from rate_limit import PRIORITY_BACKGROUND
+from server_timing import timed
+
+TASK_MIRROR_SYNC_SECONDS = float(os.getenv("TASK_MIRROR_SYNC_SECONDS", "60"))
+# Полная выгрузка формы (находит удаленные задачи и исправляет пропуски инкрементальной синхронизации)
+TASK_MIRROR_FULL_SYNC_SECONDS = float(os.getenv("TASK_MIRROR_FULL_SYNC_SECONDS", "21600"))
+# Граница устаревания для чтения по умолчанию: более старые данные сначала синхронизируются
+TASK_MIRROR_MAX_STALENESS_SECONDS = float(os.getenv("TASK_MIRROR_MAX_STALENESS_SECONDS", "120"))
+# Запас при запросе изменений: часы Pyrus и точность modified_after (секунды)
+TASK_MIRROR_OVERLAP_SECONDS = float(os.getenv("TASK_MIRROR_OVERLAP_SECONDS", "60"))
+# Формы аккаунта, к которым не обращались дольше этого времени, перестают синхронизироваться
+TASK_MIRROR_IDLE_TTL_SECONDS = float(os.getenv("TASK_MIRROR_IDLE_TTL_SECONDS", "86400"))
+# Формы, которые синхронизируются для каждого аккаунта сразу (через запятую); остальные — после первого чтения
+TASK_MIRROR_FORM_IDS = [int(value) for value in os.getenv("TASK_MIRROR_FORM_IDS", "").split(",") if value.strip()]
+# Поля, значения которых хранятся в зеркале (через запятую); пусто — все поля простых типов
+TASK_MIRROR_FIELD_IDS = [int(value) for value in os.getenv("TASK_MIRROR_FIELD_IDS", "").split(",") if value.strip()]
+TASK_MIRROR_PAGE_SIZE = int(os.getenv("TASK_MIRROR_PAGE_SIZE", "20000"))  # предел item_count реестра
+TASK_MIRROR_WRITE_BATCH = 500
+TASK_MIRROR_TEXT_LIMIT = 500
+
+# Типы полей, значения которых попадают в зеркало; таблицы, файлы и т.п. читаются из Pyrus
+MIRRORED_FIELD_TYPES = frozenset({
+    "text", "money", "number", "checkmark", "flag", "step", "status", "email", "phone",
+    "date", "creation_date", "due_date", "due_date_time", "catalog", "person", "author", "multiple_choice",
+})
+DUE_FIELD_TYPES = ("due_date_time", "due_date")
+
+UPDATED_COLUMNS = (
+    "form_id", "step", "due", "closed", "responsible_id", "create_date", "last_modified_date", "fields", "synced_at",
+)
+
+
+class MirrorStaleError(Exception):
+    """Данные зеркала старше допустимого, а синхронизация не удалась"""
+
+    def __init__(self, age_seconds, error):
+        super().__init__(error)
+        self.age_seconds = age_seconds
+
+
+class MirrorFormNotFound(Exception):
+    """Форма не найдена или недоступна аккаунту"""
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _naive_utc(value):
+    """Время для колонок DateTime: UTC без часового пояса"""
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _field_value(field):
+    """Значение поля в виде, пригодном для JSON; ссылки хранятся идентификаторами"""
+    value = field.value
+    if value is None or field.type not in MIRRORED_FIELD_TYPES:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if field.type == "catalog":
+        return getattr(value, "item_id", None)
+    if field.type in ("person", "author"):
+        return getattr(value, "id", None)
+    if field.type == "multiple_choice":
+        return getattr(value, "choice_ids", None)
+    if isinstance(value, str):
+        return value[:TASK_MIRROR_TEXT_LIMIT]
+    return value
+
+
+def build_mirror_row(account, form_id, task, synced_at):
+    """Строка task_mirror для задачи из реестра формы"""
+    fields = {}
+    step = getattr(task, "current_step", None)
+    due = getattr(task, "due", None)
+    for field in getattr(task, "fields", None) or []:
+        if field.type == "step" and step is None:
+            step = field.value
+        if field.type in DUE_FIELD_TYPES and due is None:
+            due = field.value
+        value = _field_value(field)
+        if value is not None:
+            fields[str(field.id)] = value
+    try:
+        step = int(step) if step is not None else None
+    except (TypeError, ValueError):
+        step = None
+    responsible = getattr(task, "responsible", None)
+    return {
+        "account": account,
+        "task_id": task.id,
+        "form_id": form_id,
+        "step": step,
+        "due": _naive_utc(due),
+        "closed": getattr(task, "close_date", None) is not None,
+        "responsible_id": getattr(responsible, "id", None),
+        "create_date": _naive_utc(getattr(task, "create_date", None)),
+        "last_modified_date": _naive_utc(task.last_modified_date) or synced_at,
+        "fields": fields,
+        "synced_at": synced_at,
+    }
+
+
+def _upsert_statement():
+    if async_engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(TaskMirror)
+    return statement.on_conflict_do_update(
+        index_elements=["account", "task_id"],
+        set_={column: statement.excluded[column] for column in UPDATED_COLUMNS},
+    )
+
+
+def _age_seconds(sync):
+    if sync is None or sync.last_sync_at is None:
+        return None
+    return (_utcnow() - sync.last_sync_at).total_seconds()
+
+
+async def load_sync_state(account, form_id):
+    async with AsyncSessionLocal() as db:
+        return await db.get(TaskMirrorSync, (account, form_id))
+
+
+class MirrorAccount:
+    """Формы одного аккаунта, которые держатся в зеркале"""
+
+    def __init__(self, account):
+        self.account = account
+        self.pyrus_client = None
+        self.forms = {form_id: time.monotonic() for form_id in TASK_MIRROR_FORM_IDS}  # form_id -> последнее чтение
+        self.locks = {}
+        self.last_results = {}
+        # form_id -> время полной выгрузки, обрезанной до TASK_MIRROR_PAGE_SIZE: зеркало такой формы неполное
+        self.degraded = {}
+
+    def touch(self, form_id):
+        self.forms[form_id] = time.monotonic()
+
+    async def sync_form(self, form_id, full=False, if_older_than=None, pyrus_client=None):
+        """
+        Синхронизация формы: изменения с момента прошлой синхронизации (с запасом) или полная выгрузка.
+        if_older_than — пропустить, если данные уже свежее (их мог обновить параллельный запрос)
+        """
+        pyrus_client = pyrus_client or self.pyrus_client
+        lock = self.locks.setdefault(form_id, asyncio.Lock())
+        async with lock:
+            sync = await load_sync_state(self.account, form_id)
+            age = _age_seconds(sync)
+            if if_older_than is not None and age is not None and age <= if_older_than:
+                return sync
+            if sync is None:
+                sync = TaskMirrorSync(account=self.account, form_id=form_id, task_count=0)
+
+            started = _utcnow()
+            timer = time.perf_counter()
+            full = full or sync.cursor is None or sync.last_full_sync_at is None or (
+                (started - sync.last_full_sync_at).total_seconds() > TASK_MIRROR_FULL_SYNC_SECONDS
+            )
+            request = pyrus.models.requests.FormRegisterRequest(
+                include_archived=True,
+                item_count=TASK_MIRROR_PAGE_SIZE,
+                field_ids=TASK_MIRROR_FIELD_IDS or None,
+                modified_after=None if full else sync.cursor - timedelta(seconds=TASK_MIRROR_OVERLAP_SECONDS),
+            )
+            try:
+                response = await pyrus_client.get_registry(form_id, request)
+                if response.error_code:
+                    raise RuntimeError(f"Ошибка получения реестра формы {form_id}: {response.error_code}")
+                tasks = response.tasks or []
+                rows = [build_mirror_row(self.account, form_id, task, started) for task in tasks]
+                truncated = len(tasks) >= TASK_MIRROR_PAGE_SIZE
+
+                async with AsyncSessionLocal() as db:
+                    statement = _upsert_statement()
+                    for offset in range(0, len(rows), TASK_MIRROR_WRITE_BATCH):
+                        await db.execute(statement, rows[offset:offset + TASK_MIRROR_WRITE_BATCH])
+                    if full and not truncated:
+                        # Задачи, которых нет в полной выгрузке, удалены в Pyrus или переведены в другую форму
+                        await db.execute(
+                            delete(TaskMirror).where(
+                                TaskMirror.account == self.account,
+                                TaskMirror.form_id == form_id,
+                                TaskMirror.synced_at < started,
+                            )
+                        )
+                        sync.last_full_sync_at = started
+                        self.degraded.pop(form_id, None)
+                    elif full:
+                        # Форма больше страницы реестра: зеркало неполное. Следующая полная выгрузка —
+                        # по обычному расписанию, а не на каждом проходе, иначе она съедает лимит запросов аккаунта
+                        sync.last_full_sync_at = started
+                        self.degraded[form_id] = started
+                    if truncated and not full and form_id not in self.degraded:
+                        # Реестр не упорядочен по изменению: пропущенные изменения подберет полная выгрузка,
+                        # курсор не сдвигается
+                        sync.last_full_sync_at = None
+                    elif rows:
+                        newest = max(row["last_modified_date"] for row in rows)
+                        sync.cursor = max(sync.cursor, newest) if sync.cursor else newest
+                    elif sync.cursor is None:
+                        sync.cursor = started
+                    sync.last_sync_at = started
+                    if form_id in self.degraded:
+                        sync.last_error = (
+                            f"Реестр обрезан до {TASK_MIRROR_PAGE_SIZE} задач, зеркало неполное "
+                            f"(полная выгрузка раз в {TASK_MIRROR_FULL_SYNC_SECONDS:.0f} с)"
+                        )
+                    else:
+                        sync.last_error = f"Реестр обрезан до {TASK_MIRROR_PAGE_SIZE} задач" if truncated else None
+                    sync.task_count = await db.scalar(
+                        select(func.count()).select_from(TaskMirror).where(
+                            TaskMirror.account == self.account, TaskMirror.form_id == form_id
+                        )
+                    )
+                    sync = await db.merge(sync)
+                    await db.commit()
+            except Exception as e:
+                self.last_results[form_id] = {"error": str(e), "at": started.isoformat()}
+                print(f"Ошибка синхронизации зеркала задач {self.account}/{form_id}: {str(e)}")
+                await self._save_error(form_id, str(e))
+                raise
+
+            self.last_results[form_id] = {
+                "full": full,
+                "tasks": len(rows),
+                "truncated": truncated,
+                "degraded": form_id in self.degraded,
+                "seconds": round(time.perf_counter() - timer, 3),
+                "at": started.isoformat(),
+            }
+            return sync
+
+    async def _save_error(self, form_id, error):
+        try:
+            async with AsyncSessionLocal() as db:
+                sync = await db.get(TaskMirrorSync, (self.account, form_id))
+                if sync is not None:
+                    sync.last_error = error[:500]
+                    await db.commit()
+        except Exception:
+            pass
+
+
+_accounts = {}
+
+
+def get_mirror_account(pyrus_client) -> MirrorAccount:
+    mirror = _accounts.get(pyrus_client.account)
+    if mirror is None:
+        mirror = _accounts[pyrus_client.account] = MirrorAccount(pyrus_client.account)
+    if mirror.pyrus_client is None:
+        # Для фоновой синхронизации используем отдельную обертку, не привязанную к запросу
+        mirror.pyrus_client = AsyncPyrusClient(pyrus_client.sync_client, account=pyrus_client.account, priority=PRIORITY_BACKGROUND)
+    return mirror
+
+
+async def ensure_fresh(pyrus_client, form_id, max_staleness=TASK_MIRROR_MAX_STALENESS_SECONDS) -> TaskMirrorSync:
+    """
+    Состояние синхронизации формы не старше max_staleness секунд; при необходимости синхронизирует сразу.
+    Если синхронизация не удалась, а данные старше границы, — MirrorStaleError
+    """
+    mirror = get_mirror_account(pyrus_client)
+    sync = await load_sync_state(mirror.account, form_id)
+    age = _age_seconds(sync)
+    if age is not None and age <= max_staleness:
+        mirror.touch(form_id)
+        return sync
+    if sync is None:
+        # Форма еще не синхронизировалась для аккаунта: в фоновую синхронизацию попадают только доступные формы
+        form_schema = await get_form_schema(pyrus_client, form_id)
+        if form_schema.error_code:
+            raise MirrorFormNotFound(f"Форма не найдена: {form_schema.error_code}")
+    try:
+        with timed("mirror.sync", f"form {form_id}"):
+            # Синхронизация по запросу идет через клиент запроса, чтобы ее вызовы учитывались в X-Pyrus-Calls
+            sync = await mirror.sync_form(form_id, if_older_than=max_staleness, pyrus_client=pyrus_client)
+    except Exception as e:
+        if sync is not None:
+            mirror.touch(form_id)
+        raise MirrorStaleError(age, str(e))
+    mirror.touch(form_id)
+    return sync
+
+
+async def query_tasks(account, form_id, step=None, closed=None, responsible_id=None,
+                      due_before=None, due_after=None, modified_after=None, limit=100, offset=0):
+    """Задачи формы из зеркала, новые изменения первыми; возвращает (строки, всего)"""
+    conditions = [TaskMirror.account == account, TaskMirror.form_id == form_id]
+    if step is not None:
+        conditions.append(TaskMirror.step == step)
+    if closed is not None:
+        conditions.append(TaskMirror.closed == closed)
+    if responsible_id is not None:
+        conditions.append(TaskMirror.responsible_id == responsible_id)
+    if due_before is not None:
+        conditions.append(TaskMirror.due < _naive_utc(due_before))
+    if due_after is not None:
+        conditions.append(TaskMirror.due >= _naive_utc(due_after))
+    if modified_after is not None:
+        conditions.append(TaskMirror.last_modified_date > _naive_utc(modified_after))
+
+    with timed("mirror.query", f"form {form_id}"):
+        async with AsyncSessionLocal() as db:
+            total = await db.scalar(select(func.count()).select_from(TaskMirror).where(*conditions))
+            result = await db.execute(
+                select(TaskMirror)
+                .where(*conditions)
+                .order_by(TaskMirror.last_modified_date.desc(), TaskMirror.task_id.desc())
+                .limit(limit)
+                .offset(offset)
+            )
+            return result.scalars().all(), total
+
+
+async def sync_task_mirror_forever():
+    """Фоновая задача: периодическая синхронизация форм активных аккаунтов"""
+    while True:
+        await asyncio.sleep(TASK_MIRROR_SYNC_SECONDS)
+        now = time.monotonic()
+        for account, mirror in list(_accounts.items()):
+            for form_id, last_access in list(mirror.forms.items()):
+                if now - last_access > TASK_MIRROR_IDLE_TTL_SECONDS and form_id not in TASK_MIRROR_FORM_IDS:
+                    del mirror.forms[form_id]
+            if not mirror.forms:
+                del _accounts[account]
+                continue
+            try:
+                # Актуальный ключ пользователя: после смены ключа старый клиент больше не авторизован
+                mirror.pyrus_client = await get_background_client(account, mirror.pyrus_client)
+            except Exception as e:
+                print(f"Зеркало задач: нет клиента Pyrus для {account}: {str(e)}")
+                continue
+            for form_id in list(mirror.forms):
+                try:
+                    # Формы, только что синхронизированные чтением, пропускаются
+                    await mirror.sync_form(form_id, if_older_than=TASK_MIRROR_SYNC_SECONDS / 2)
+                except Exception:
+                    pass
+
+
+def task_mirror_stats():
+    return {
+        "sync_seconds": TASK_MIRROR_SYNC_SECONDS,
+        "max_staleness_seconds": TASK_MIRROR_MAX_STALENESS_SECONDS,
+        "accounts": {
+            account: {str(form_id): mirror.last_results.get(form_id) for form_id in mirror.forms}
+            for account, mirror in _accounts.items()
+        },
+    }
@@ -0,0 +1,202 @@
+"""
+Фильтры, сортировка и постраничная выдача списков задач.
+То, что умеет реестр Pyrus, передается в FormRegisterRequest; остальное (и точная проверка) — на сервере
+"""
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+import pyrus.models
+from pyrus.models import entities
+
+TASK_LIST_MAX_LIMIT = 1000
+SORT_FIELDS = ("id", "create_date", "last_modified_date", "due")
+DATETIME_SORT_FIELDS = ("create_date", "last_modified_date", "due")
+DUE_FIELD_TYPES = ("due_date_time", "due_date")
+# Фильтры реестра по полям дат работают с точностью до дня: границы расширяются, точная проверка на сервере
+_DAY = timedelta(days=1)
+
+
+class TaskQueryError(ValueError):
+    """Некорректные параметры выборки (сортировка, курсор)"""
+
+
+def as_utc(value):
+    """Время с часовым поясом; значения без пояса считаются UTC"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _as_int(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TaskQuery:
+    """Параметры выборки списка задач"""
+
+    def __init__(self, form_ids=None, steps=None, due_after=None, due_before=None, responsible_id=None,
+                 modified_after=None, include_archived=False, sort=None, limit=None, cursor=None):
+        self.form_ids = set(form_ids) if form_ids else None
+        self.steps = set(steps) if steps else None
+        self.due_after = as_utc(due_after)
+        self.due_before = as_utc(due_before)
+        self.responsible_id = responsible_id
+        self.modified_after = as_utc(modified_after)
+        self.include_archived = include_archived
+        self.limit = limit
+        if sort is None and (limit is not None or cursor):
+            # Постраничной выдаче нужен устойчивый порядок
+            sort = "id"
+        self.sort = sort
+        self.sort_field = sort.lstrip("-") if sort else None
+        self.descending = bool(sort) and sort.startswith("-")
+        if self.sort_field is not None and self.sort_field not in SORT_FIELDS:
+            raise TaskQueryError(f"Сортировка возможна по полям: {', '.join(SORT_FIELDS)} (с '-' — по убыванию)")
+        self.after = self._decode_cursor(cursor) if cursor else None
+
+    # Передача в Pyrus
+
+    def register_request(self, form) -> pyrus.models.requests.FormRegisterRequest:
+        """Запрос реестра формы: этапы, даты, архивные задачи, диапазон id по курсору и только нужные поля"""
+        due_id = form_field_id(form, DUE_FIELD_TYPES)
+        step_id = form_field_id(form, ("step",))
+        filters = []
+        if due_id is not None and (self.due_after or self.due_before):
+            if self.due_after and self.due_before:
+                filters.append(entities.RangeFilter(due_id, [self.due_after - _DAY, self.due_before + _DAY]))
+            elif self.due_after:
+                filters.append(entities.GreaterThanFilter(due_id, self.due_after - _DAY))
+            else:
+                filters.append(entities.LessThanFilter(due_id, self.due_before + _DAY))
+        if self.after is not None and self.sort_field == "id":
+            last_id = self.after[-1]
+            filters.append(entities.LessThanTaskIdFilter(last_id) if self.descending else entities.GreaterThanTaskIdFilter(last_id))
+
+        # Поля задач в ответе не нужны, кроме срока и этапа; пустой field_ids вернул бы все поля
+        field_ids = [field_id for field_id in (due_id, step_id) if field_id is not None]
+        if not field_ids and getattr(form, "fields", None):
+            field_ids = [form.fields[0].id]
+        return pyrus.models.requests.FormRegisterRequest(
+            include_archived=self.include_archived,
+            steps=sorted(self.steps) if self.steps else None,
+            # Pyrus принимает время с точностью до секунды, точная граница проверяется на сервере
+            modified_after=self.modified_after.replace(tzinfo=None, microsecond=0) if self.modified_after else None,
+            filters=filters or None,
+            field_ids=field_ids or None,
+        )
+
+    def wants_form(self, form_id):
+        return self.form_ids is None or form_id in self.form_ids
+
+    # Проверка на сервере
+
+    def matches(self, values) -> bool:
+        if self.steps is not None and values.get("step") not in self.steps:
+            return False
+        due = values.get("due")
+        if self.due_after is not None and (due is None or due < self.due_after):
+            return False
+        if self.due_before is not None and (due is None or due >= self.due_before):
+            return False
+        if self.responsible_id is not None and values.get("responsible_id") != self.responsible_id:
+            return False
+        modified = values.get("last_modified_date")
+        if self.modified_after is not None and (modified is None or modified <= self.modified_after):
+            return False
+        return True
+
+    def sort_key(self, values):
+        value = values.get(self.sort_field) if self.sort_field != "id" else None
+        return (value is None, value if value is not None else 0, values["id"])
+
+    def select(self, items, values_of):
+        """Отбор, сортировка и страница; возвращает (элементы, курсор следующей страницы или None)"""
+        keyed = []
+        for item in items:
+            values = values_of(item)
+            if self.matches(values):
+                keyed.append((self.sort_key(values) if self.sort else None, item))
+        if self.sort:
+            keyed.sort(key=lambda pair: pair[0], reverse=self.descending)
+            if self.after is not None:
+                after = self.after
+                keyed = [pair for pair in keyed if (pair[0] < after if self.descending else pair[0] > after)]
+        if self.limit is None or len(keyed) <= self.limit:
+            return [item for _, item in keyed], None
+        page = keyed[:self.limit]
+        return [item for _, item in page], self._encode_cursor(page[-1][0])
+
+    # Курсор: последний выданный ключ сортировки
+
+    def _encode_cursor(self, key):
+        is_none, value, task_id = key
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        raw = json.dumps([self.sort, is_none, value, task_id], separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def _decode_cursor(self, cursor):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            sort, is_none, value, task_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if sort != self.sort:
+                raise TaskQueryError("Курсор выдан для другой сортировки")
+            if not is_none and self.sort_field in DATETIME_SORT_FIELDS:
+                value = as_utc(value)
+                if value is None:
+                    raise ValueError(value)
+            return (bool(is_none), value, int(task_id))
+        except TaskQueryError:
+            raise
+        except Exception:
+            raise TaskQueryError("Некорректный курсор")
+
+
+def form_field_id(form, types):
+    """id первого поля формы одного из типов types"""
+    for field in getattr(form, "fields", None) or []:
+        if getattr(field, "type", None) in types:
+            return field.id
+    return None
+
+
+def registry_task_values(task, due_field_id=None):
+    """Значения задачи из реестра для фильтров и сортировки"""
+    fields = {field.id: field for field in (getattr(task, "fields", None) or [])}
+    step = getattr(task, "current_step", None)
+    if step is None:
+        step = next((field.value for field in fields.values() if field.type == "step"), None)
+    if due_field_id is not None:
+        due = getattr(fields.get(due_field_id), "value", None)
+    else:
+        due = getattr(task, "due", None) or getattr(task, "due_date", None)
+    responsible = getattr(task, "responsible", None)
+    return {
+        "id": task.id,
+        "step": _as_int(step),
+        "due": as_utc(due),
+        "responsible_id": getattr(responsible, "id", None),
+        "create_date": as_utc(getattr(task, "create_date", None)),
+        "last_modified_date": as_utc(getattr(task, "last_modified_date", None)),
+    }
+
+
+def inbox_row_values(row):
+    """Значения строки расширенного inbox для фильтров и сортировки"""
+    return {
+        "id": row["id"],
+        "step": _as_int(row.get("step")),
+        "due": as_utc(row.get("due")),
+        "last_modified_date": as_utc(row.get("last_modified_date")),
+    }
@@ -0,0 +1,79 @@
+"""
+Проверка поиска по каталогу: префиксы слов, триграммы для опечаток, ранжирование и перестроение индекса
+"""
+import asyncio
+
+from pyrus.models import responses
+
+from catalog_cache import CachedCatalog
+from catalog_search import CatalogSearchIndex, search_catalog
+
+ITEMS = [
+    (1, ["Москва", "Россия"]),
+    (2, ["Московская область", "Россия"]),
+    (3, ["Новосибирск", "Россия"]),
+    (4, ["Нижний Новгород", "Россия"]),
+    (5, ["Орёл", "Россия"]),
+    (6, ["Москва-Сити", "Бизнес-центр"]),
+]
+
+
+def catalog(items=ITEMS):
+    return responses.CatalogResponse(
+        catalog_id=78,
+        catalog_headers=[{"name": "Название", "type": "text"}, {"name": "Страна", "type": "text"}],
+        items=[{"item_id": item_id, "values": values} for item_id, values in items],
+    )
+
+
+def item_ids(index, query, limit=20):
+    return [index.items[position].item_id for _, position in index.search(query, limit)]
+
+
+def test_every_query_word_must_prefix_a_word():
+    index = CatalogSearchIndex(catalog())
+    assert set(item_ids(index, "моск")) == {1, 2, 6}
+    assert item_ids(index, "моск обл") == [2]
+    assert item_ids(index, "нов") == [3, 4]
+    # Регистр и ё не важны
+    assert item_ids(index, "ОРЕЛ") == [5]
+    assert item_ids(index, "   ") == []
+
+
+def test_exact_and_leading_matches_rank_first():
+    index = CatalogSearchIndex(catalog())
+    scores = dict((index.items[position].item_id, score) for score, position in index.search("москва"))
+    # Полное совпадение значения, затем начало значения, затем совпадение слова в середине
+    ranked = item_ids(index, "москва")
+    assert ranked[0] == 1
+    assert scores[1] > scores[6] >= scores.get(2, 0)
+    assert item_ids(index, "моск", limit=2) == [1, 6]
+
+
+def test_typos_match_by_trigrams():
+    index = CatalogSearchIndex(catalog())
+    assert item_ids(index, "навосибирск") == [3]
+    # Короткий запрос с опечаткой не дает случайных совпадений
+    assert item_ids(index, "xq") == []
+
+
+def test_index_is_rebuilt_for_a_new_catalog_version():
+    async def run():
+        first = CachedCatalog(catalog())
+        found_before = await search_catalog(first, "орел")
+        again = await search_catalog(first, "москва")
+        reused = first.search_index_future
+
+        # Каталог перезагружен из Pyrus: новая версия записи кэша получает свой индекс
+        second = CachedCatalog(catalog(ITEMS + [(7, ["Орехово-Зуево", "Россия"])]))
+        found_after = await search_catalog(second, "оре")
+        return found_before, again, reused, first, second, found_after
+
+    found_before, again, reused, first, second, found_after = asyncio.run(run())
+    assert [item["item_id"] for item in found_before] == [5]
+    assert found_before[0]["values"] == ["Орёл", "Россия"]
+    assert again[0]["item_id"] == 1
+    assert reused is first.search_index_future
+    assert second.version != first.version
+    assert second.search_index_future is not first.search_index_future
+    assert {item["item_id"] for item in found_after} == {5, 7}
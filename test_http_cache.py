@@ -0,0 +1,59 @@
+"""
+Проверка HTTP-кэширования: потоковые ответы без задержки заголовков и версии задач для 304
+"""
+import asyncio
+from datetime import datetime
+
+from http_cache import HTTPCacheMiddleware, forget_task_version, known_task_version, remember_task_version
+
+
+def run_middleware(content_type, body_delay=0.2):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        await asyncio.sleep(body_delay)
+        await send({"type": "http.response.body", "body": b"data: 1\n\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent = []
+
+        async def send(message):
+            sent.append((message["type"], loop.time() - started))
+
+        scope = {"type": "http", "method": "GET", "path": "/api/inbox_full/stream", "headers": []}
+        await HTTPCacheMiddleware(app)(scope, None, send)
+        return sent
+
+    return asyncio.run(run())
+
+
+def test_event_stream_headers_are_not_held_back():
+    sent = run_middleware(b"text/event-stream")
+    assert sent[0][0] == "http.response.start"
+    assert sent[0][1] < 0.1
+
+
+def test_regular_response_start_waits_for_body():
+    sent = run_middleware(b"application/json", body_delay=0.1)
+    assert sent[0][0] == "http.response.start"
+    assert sent[0][1] >= 0.1
+
+
+def test_task_version_is_forgotten_on_change():
+    account = "versions@example.com"
+    modified = datetime(2026, 10, 1, 10, 0)
+    remember_task_version(account, 1, 829354, modified)
+    assert known_task_version(account, 1) == (829354, modified)
+
+    # Та же версия в inbox ничего не сбрасывает, более новая — сбрасывает
+    forget_task_version(account, 1, modified)
+    assert known_task_version(account, 1) == (829354, modified)
+    forget_task_version(account, 1, datetime(2026, 10, 2, 10, 0))
+    assert known_task_version(account, 1) is None
+
+    # Изменение через приложение сбрасывает версию без сравнения
+    remember_task_version(account, 2, 829354, modified)
+    forget_task_version(account, 2)
+    assert known_task_version(account, 2) is None
@@ -0,0 +1,180 @@
+"""
+Проверка снапшота расширенного inbox: ошибки Pyrus не меняют снапшот, задачи других форм запоминаются
+"""
+import asyncio
+
+from pyrus.models import responses
+
+from inbox import INBOX_FORM_ID, InboxSnapshot, get_inbox_snapshot, load_inbox, sync_inbox
+from inbox_stream import InboxPoller, _Subscriber
+
+FORM = {
+    "id": INBOX_FORM_ID,
+    "name": "Заявка",
+    "fields": [
+        {"id": 1, "name": "Описание/ Description", "type": "text"},
+        {"id": 2, "name": "Срок/Term", "type": "due_date_time"},
+        {"id": 3, "name": "Этап/Stage", "type": "step"},
+    ],
+}
+
+
+def task(task_id, modified="2026-10-01T10:00:00Z"):
+    return {
+        "id": task_id,
+        "last_modified_date": modified,
+        "fields": [
+            {"id": 1, "type": "text", "value": f"Задача {task_id}"},
+            {"id": 3, "type": "step", "value": 1},
+        ],
+    }
+
+
+class FakePyrusClient:
+    """Асинхронный клиент с inbox и реестром формы из словарей"""
+
+    def __init__(self, account):
+        self.account = account
+        self.inbox = {}         # task_id -> задача в inbox
+        self.form_tasks = set()  # задачи inbox, относящиеся к форме
+        self.inbox_error = None
+        self.registry_error = None
+        self.registry_calls = 0
+        self.inbox_calls = 0
+        self.delay = 0
+
+    async def get_form(self, form_id):
+        return responses.FormResponse(**FORM)
+
+    async def get_inbox(self, tasks_count=50):
+        self.inbox_calls += 1
+        await asyncio.sleep(self.delay)
+        if self.inbox_error:
+            return responses.TaskListResponse(error="ошибка", error_code=self.inbox_error)
+        return responses.TaskListResponse(tasks=list(self.inbox.values()))
+
+    async def get_registry(self, form_id, request):
+        self.registry_calls += 1
+        if self.registry_error:
+            return responses.FormRegisterResponse(error="ошибка", error_code=self.registry_error)
+        return responses.FormRegisterResponse(
+            tasks=[self.inbox[task_id] for task_id in request.task_ids if task_id in self.form_tasks]
+        )
+
+
+def refresh(snapshot, pyrus_client):
+    return asyncio.run(snapshot.refresh(pyrus_client, 50))
+
+
+def test_inbox_error_keeps_snapshot():
+    pyrus_client = FakePyrusClient("inbox-error@example.com")
+    pyrus_client.inbox = {1: task(1), 2: task(2)}
+    pyrus_client.form_tasks = {1, 2}
+    snapshot = InboxSnapshot()
+    assert refresh(snapshot, pyrus_client) == [1, 2]
+    version = snapshot.version
+
+    pyrus_client.inbox_error = "server_error"
+    try:
+        refresh(snapshot, pyrus_client)
+        assert False, "ошибка inbox должна прерывать синхронизацию"
+    except RuntimeError:
+        pass
+
+    assert snapshot.version == version
+    assert set(snapshot.entries) == {1, 2}
+    assert snapshot.removed == {}
+
+
+def test_registry_error_does_not_mark_tasks_foreign():
+    pyrus_client = FakePyrusClient("registry-error@example.com")
+    pyrus_client.inbox = {1: task(1)}
+    pyrus_client.form_tasks = {1}
+    pyrus_client.registry_error = "server_error"
+    snapshot = InboxSnapshot()
+    try:
+        refresh(snapshot, pyrus_client)
+        assert False, "ошибка реестра должна прерывать синхронизацию"
+    except RuntimeError:
+        pass
+    assert snapshot.foreign == {}
+    assert snapshot.entries == {}
+
+    # После восстановления задача появляется в inbox без изменения last_modified_date
+    pyrus_client.registry_error = None
+    assert refresh(snapshot, pyrus_client) == [1]
+
+
+def test_foreign_tasks_are_not_refetched():
+    pyrus_client = FakePyrusClient("foreign@example.com")
+    pyrus_client.inbox = {1: task(1), 7: task(7)}
+    pyrus_client.form_tasks = {1}
+    snapshot = InboxSnapshot()
+    assert refresh(snapshot, pyrus_client) == [1]
+    assert set(snapshot.foreign) == {7}
+    calls = pyrus_client.registry_calls
+
+    assert refresh(snapshot, pyrus_client) == [1]
+    assert pyrus_client.registry_calls == calls
+
+    # Изменившаяся задача другой формы запрашивается снова
+    pyrus_client.inbox[7] = task(7, "2026-10-02T10:00:00Z")
+    refresh(snapshot, pyrus_client)
+    assert pyrus_client.registry_calls == calls + 1
+
+
+def test_concurrent_requests_share_one_refresh():
+    pyrus_client = FakePyrusClient("shared@example.com")
+    pyrus_client.inbox = {1: task(1), 2: task(2)}
+    pyrus_client.form_tasks = {1, 2}
+    pyrus_client.delay = 0.05
+
+    async def run():
+        full = await sync_inbox(pyrus_client, 50)
+        calls = pyrus_client.inbox_calls
+        results = await asyncio.gather(
+            *(load_inbox(pyrus_client, 50) for _ in range(5)),
+            *(sync_inbox(pyrus_client, 50, full["sync_token"]) for _ in range(5)),
+        )
+        return calls, results
+
+    calls, results = asyncio.run(run())
+    # Десять одновременных запросов обслуживаются одним обращением к inbox
+    assert pyrus_client.inbox_calls == calls + 1
+    assert all([row["id"] for row in rows] == [1, 2] for rows in results[:5])
+    assert all(delta["added"] == [] and delta["removed"] == [] for delta in results[5:])
+
+
+def test_rows_and_delta_follow_inbox_order():
+    pyrus_client = FakePyrusClient("order@example.com")
+    pyrus_client.inbox = {3: task(3), 1: task(1), 2: task(2)}
+    pyrus_client.form_tasks = {1, 2, 3}
+
+    async def run():
+        full = await sync_inbox(pyrus_client, 50)
+        # Задача 1 изменилась и поднялась в начало inbox
+        pyrus_client.inbox = {1: task(1, "2026-10-02T10:00:00Z"), 3: task(3), 2: task(2)}
+        delta = await sync_inbox(pyrus_client, 50, full["sync_token"])
+        return full, delta
+
+    full, delta = asyncio.run(run())
+    assert [row["id"] for row in full["added"]] == [3, 1, 2]
+    assert full["order"] == [3, 1, 2]
+    assert delta["order"] == [1, 3, 2]
+    assert [row["id"] for row in delta["changed"]] == [1]
+
+
+def test_empty_inbox_still_sends_snapshot():
+    account = "empty@example.com"
+    pyrus_client = FakePyrusClient(account)
+    snapshot = get_inbox_snapshot(account, 50)
+    assert refresh(snapshot, pyrus_client) == []
+    assert snapshot.version == 0
+
+    poller = InboxPoller(account, 50)
+    subscriber = _Subscriber()
+    poller.subscribers.add(subscriber)
+    poller._send_snapshots()
+    message = subscriber.queue.get_nowait()
+    assert message.startswith("event: snapshot")
+    assert '"rows": []' in message
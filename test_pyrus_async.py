@@ -0,0 +1,183 @@
+"""
+Проверка неблокирующего слоя Pyrus: медленные вызовы выполняются параллельно и не замораживают цикл событий
+"""
+import asyncio
+import time
+
+import rate_limit
+from pyrus_async import AsyncPyrusClient, single_flight_stats
+from rate_limit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, AccountRateLimiter
+
+UPSTREAM_DELAY = 0.3
+CONCURRENT_CALLS = 8
+
+
+class SlowPyrusClient:
+    """Синхронный клиент, имитирующий медленный ответ Pyrus"""
+
+    login = "user@example.com"
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_form(self, form_id):
+        self.calls += 1
+        time.sleep(UPSTREAM_DELAY)
+        return form_id
+
+
+def test_slow_calls_overlap():
+    pyrus_client = AsyncPyrusClient(SlowPyrusClient())
+
+    async def run():
+        started = time.monotonic()
+        results = await asyncio.gather(*(pyrus_client.get_form(i) for i in range(CONCURRENT_CALLS)))
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(run())
+
+    assert results == list(range(CONCURRENT_CALLS))
+    # Последовательно это заняло бы CONCURRENT_CALLS * UPSTREAM_DELAY = 2.4 с
+    assert elapsed < UPSTREAM_DELAY * 2
+
+
+def test_event_loop_stays_responsive():
+    pyrus_client = AsyncPyrusClient(SlowPyrusClient())
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        await pyrus_client.get_form(1)
+        ticker_task.cancel()
+        return ticks
+
+    # Пока поток ждет Pyrus, цикл событий продолжает обслуживать другие корутины
+    assert asyncio.run(run()) >= 10
+
+
+def test_identical_concurrent_calls_are_coalesced():
+    sync_client = SlowPyrusClient()
+    # Разные входящие запросы одного аккаунта — разные обертки над одним клиентом
+    wrappers = [AsyncPyrusClient(sync_client, memoize=True) for _ in range(CONCURRENT_CALLS)]
+
+    async def run():
+        return await asyncio.gather(*(wrapper.get_form(42) for wrapper in wrappers))
+
+    before = single_flight_stats()["coalesced_by_method"].get("get_form", 0)
+    results = asyncio.run(run())
+
+    assert results == [42] * CONCURRENT_CALLS
+    assert sync_client.calls == 1
+    assert sum(wrapper.upstream_calls for wrapper in wrappers) == 1
+    assert single_flight_stats()["coalesced_by_method"]["get_form"] - before == CONCURRENT_CALLS - 1
+
+
+class ThrottledPyrusClient:
+    """Синхронный клиент, который первые throttled вызовов отвечает ошибкой лимита Pyrus"""
+
+    login = "throttled@example.com"
+
+    class Error:
+        error_code = "too_many_requests"
+
+    def __init__(self, throttled):
+        self.throttled = throttled
+        self.calls = 0
+
+    def get_task(self, task_id):
+        self.calls += 1
+        return self.Error() if self.calls <= self.throttled else task_id
+
+
+def test_throttled_calls_are_retried():
+    rate_limit.PYRUS_RETRY_BASE_DELAY, base_delay = 0.01, rate_limit.PYRUS_RETRY_BASE_DELAY
+    try:
+        sync_client = ThrottledPyrusClient(throttled=2)
+        assert asyncio.run(AsyncPyrusClient(sync_client).get_task(7)) == 7
+        assert sync_client.calls == 3
+    finally:
+        rate_limit.PYRUS_RETRY_BASE_DELAY = base_delay
+
+
+def test_rate_limiter_queues_bursts_and_prefers_interactive():
+    limiter = AccountRateLimiter("limited@example.com", rate=50, burst=2)
+    order = []
+
+    async def call(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+
+    async def run():
+        started = time.monotonic()
+        # Два запроса проходят сразу, остальные ждут токенов; фоновые поставлены в очередь раньше
+        await asyncio.gather(
+            call("first", PRIORITY_INTERACTIVE),
+            call("second", PRIORITY_INTERACTIVE),
+            call("background-1", PRIORITY_BACKGROUND),
+            call("background-2", PRIORITY_BACKGROUND),
+            call("interactive", PRIORITY_INTERACTIVE),
+        )
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(run())
+
+    assert order == ["first", "second", "interactive", "background-1", "background-2"]
+    # Три запроса сверх burst при 50 запросах в секунду — не меньше 60 мс
+    assert elapsed >= 0.05
+
+
+def test_background_calls_leave_reserve_for_interactive():
+    limiter = AccountRateLimiter("reserve@example.com", rate=10, burst=5, reserve=2)
+
+    async def run():
+        background = [asyncio.ensure_future(limiter.acquire(PRIORITY_BACKGROUND)) for _ in range(5)]
+        await asyncio.sleep(0)
+        immediate = sum(1 for future in background if future.done())
+        # Фоновые запросы исчерпали свою часть токенов, интерактивный проходит без ожидания
+        interactive_wait = await limiter.acquire(PRIORITY_INTERACTIVE)
+        for future in background:
+            future.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        return immediate, interactive_wait
+
+    immediate, interactive_wait = asyncio.run(run())
+
+    assert immediate == 3
+    assert interactive_wait == 0.0
+
+
+def test_interactive_call_does_not_inherit_background_timer():
+    limiter = AccountRateLimiter("timer@example.com", rate=10, burst=30, reserve=10)
+
+    async def run():
+        limiter._loop = asyncio.get_running_loop()
+        limiter._tokens = 0.0
+        background = asyncio.ensure_future(limiter.acquire(PRIORITY_BACKGROUND))
+        await asyncio.sleep(0)
+        # Фоновому запросу нужно 11 токенов (1,1 с), интерактивному — один (0,1 с)
+        interactive_wait = await limiter.acquire(PRIORITY_INTERACTIVE)
+        background.cancel()
+        await asyncio.gather(background, return_exceptions=True)
+        return interactive_wait
+
+    interactive_wait = asyncio.run(run())
+
+    assert 0.05 < interactive_wait < 0.3
+
+
+if __name__ == "__main__":
+    test_slow_calls_overlap()
+    test_event_loop_stays_responsive()
+    test_identical_concurrent_calls_are_coalesced()
+    test_throttled_calls_are_retried()
+    test_rate_limiter_queues_bursts_and_prefers_interactive()
+    test_background_calls_leave_reserve_for_interactive()
+    test_interactive_call_does_not_inherit_background_timer()
+    print("OK")
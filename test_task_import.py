@@ -0,0 +1,124 @@
+"""
+Проверка импорта задач: сопоставление столбцов полям формы, чтение CSV/NDJSON и остановка конвейера
+"""
+import asyncio
+import io
+import itertools
+import threading
+
+from pyrus.models import responses
+
+from form_cache import FormSchema
+from task_import import FieldMapper, TaskImportError, iter_import_results, iter_rows
+
+FORM = {
+    "id": 829354,
+    "name": "Заявка",
+    "fields": [
+        {"id": 1, "name": "Описание/ Description", "type": "text"},
+        {"id": 2, "name": "Срок/Term", "type": "due_date_time"},
+        {"id": 3, "name": "Сумма", "type": "money"},
+        {"id": 4, "name": "Срочно", "type": "checkmark"},
+        {"id": 5, "name": "Файлы", "type": "file"},
+    ],
+}
+
+
+def mapper():
+    return FieldMapper(FormSchema(responses.FormResponse(**FORM)))
+
+
+def test_columns_resolve_by_name_id_and_task_column():
+    field_mapper = mapper()
+    assert field_mapper.resolve("Срок/Term").id == 2
+    assert field_mapper.resolve("3").id == 3
+    assert field_mapper.resolve(" Text ") == "text"
+    for column in ("Нет такого", "Файлы"):
+        try:
+            field_mapper.resolve(column)
+            assert False, f"столбец {column!r} должен отклоняться"
+        except TaskImportError:
+            pass
+
+
+def test_build_request_converts_values_and_collects_errors():
+    request = mapper().build_request(829354, {
+        "Описание/ Description": "Первая",
+        "Срок/Term": "2026-11-01T10:00:00+03:00",
+        "Сумма": "1 234,50",
+        "Срочно": "да",
+        "text": "комментарий",
+    })
+    assert request.form_id == 829354
+    assert request.text == "комментарий"
+    assert {field["id"]: field["value"] for field in request.fields} == {
+        1: "Первая", 2: "2026-11-01T07:00:00Z", 3: 1234.5, 4: "checked",
+    }
+
+    try:
+        mapper().build_request(829354, {"Срок/Term": "не дата", "Сумма": "abc"})
+        assert False, "ошибки значений должны давать ValueError"
+    except ValueError as e:
+        assert "Срок/Term" in str(e) and "Сумма" in str(e)
+
+
+def test_csv_rows_with_sniffed_delimiter():
+    data = "Описание/ Description;Сумма\nПервая;1\n\n\"много\nстрок\";2\nлишняя;3;4\n"
+    rows = list(iter_rows(io.BytesIO(data.encode()), "csv"))
+    assert rows[:2] == [
+        (1, {"Описание/ Description": "Первая", "Сумма": "1"}),
+        (3, {"Описание/ Description": "много\nстрок", "Сумма": "2"}),
+    ]
+    assert rows[2][0] == 4 and isinstance(rows[2][1], ValueError)
+
+
+def test_ndjson_bad_lines_are_reported_per_row():
+    data = '{"1": "a"}\nnot json\n[1, 2]\n\n{"1": "b"}\n'
+    rows = list(iter_rows(io.BytesIO(data.encode()), "ndjson"))
+    assert [row_number for row_number, _ in rows] == [1, 2, 3, 4]
+    assert rows[0][1] == {"1": "a"} and rows[3][1] == {"1": "b"}
+    assert isinstance(rows[1][1], ValueError) and isinstance(rows[2][1], ValueError)
+
+
+class BlockingPyrusClient:
+    """Синхронный клиент, у которого create_task ждет, пока тест его не отпустит"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def create_task(self, request):
+        self.release.wait(5)
+        return responses.TaskResponse(error="отменено", error_code="cancelled")
+
+
+class RequestClient:
+    """Клиент запроса: только то, что использует iter_import_results"""
+
+    def __init__(self):
+        self.sync_client = BlockingPyrusClient()
+        self.account = "import@example.com"
+        self.upstream_calls = 0
+
+
+def test_disconnect_stops_pipeline_and_closes_source():
+    async def run():
+        source = io.BytesIO(b"")
+        pyrus_client = RequestClient()
+        rows = itertools.chain(
+            [(1, ValueError("Пустая строка"))],
+            ((row_number, {"Описание/ Description": f"row {row_number}"}) for row_number in range(2, 1000)),
+        )
+        results = iter_import_results(pyrus_client, 829354, mapper(), rows, source=source)
+        # Обработчики заняты, очередь заполнена; клиент отключается после первой строки отчета
+        assert not (await results.__anext__())["ok"]
+        await asyncio.sleep(0.2)
+        try:
+            await asyncio.wait_for(results.aclose(), timeout=5)
+            # Ни чтение, ни обработчики не остаются висеть после отключения
+            await asyncio.sleep(0)
+            assert asyncio.all_tasks() == {asyncio.current_task()}
+        finally:
+            pyrus_client.sync_client.release.set()
+        return source
+
+    assert asyncio.run(run()).closed
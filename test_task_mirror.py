@@ -0,0 +1,171 @@
+"""
+Проверка зеркала задач: строка из задачи реестра, выборка, неизвестная форма и обрезанная синхронизация
+"""
+import asyncio
+from datetime import datetime
+
+from pyrus.models import responses
+
+import task_mirror
+from database import async_engine
+from task_mirror import MirrorFormNotFound, build_mirror_row, ensure_fresh, get_mirror_account, query_tasks
+
+FORM = {
+    "id": 321,
+    "name": "Заявка",
+    "fields": [
+        {"id": 1, "name": "Описание", "type": "text"},
+        {"id": 2, "name": "Срок", "type": "due_date_time"},
+        {"id": 3, "name": "Этап", "type": "step"},
+        {"id": 4, "name": "Клиент", "type": "catalog"},
+        {"id": 5, "name": "Таблица", "type": "table"},
+    ],
+}
+SYNCED_AT = datetime(2026, 10, 1, 12, 0)
+
+
+def task(task_id, modified="2026-10-01T10:00:00Z", step=1, due="2026-10-05T09:00:00Z", closed=False):
+    value = {
+        "id": task_id,
+        "create_date": "2026-09-01T08:00:00Z",
+        "last_modified_date": modified,
+        "responsible": {"id": 42},
+        "fields": [
+            {"id": 1, "type": "text", "value": "x" * 600},
+            {"id": 2, "type": "due_date_time", "value": due},
+            {"id": 3, "type": "step", "value": step},
+            {"id": 4, "type": "catalog", "value": {"item_id": 7700001}},
+            {"id": 5, "type": "table", "value": []},
+        ],
+    }
+    if closed:
+        value["close_date"] = modified
+    return value
+
+
+def registry_tasks(*tasks):
+    return responses.FormRegisterResponse(tasks=list(tasks)).tasks
+
+
+class FakePyrusClient:
+    """Асинхронный клиент с формой и реестром из словарей"""
+
+    def __init__(self, account, tasks=(), known_forms=(FORM["id"],)):
+        self.account = account
+        self.sync_client = None
+        self.tasks = list(tasks)
+        self.known_forms = set(known_forms)
+        self.requests = []
+
+    async def get_form(self, form_id):
+        if form_id not in self.known_forms:
+            return responses.FormResponse(error="форма не найдена", error_code="not_found")
+        return responses.FormResponse(**FORM)
+
+    async def get_registry(self, form_id, request):
+        self.requests.append(request)
+        return responses.FormRegisterResponse(tasks=self.tasks)
+
+
+def test_build_mirror_row_keeps_simple_fields():
+    (registry_task,) = registry_tasks(task(1, step=2))
+    row = build_mirror_row("mirror@example.com", FORM["id"], registry_task, SYNCED_AT)
+    assert row["task_id"] == 1 and row["form_id"] == FORM["id"]
+    assert row["step"] == 2
+    assert row["due"] == datetime(2026, 10, 5, 9, 0)
+    assert row["responsible_id"] == 42
+    assert row["closed"] is False
+    assert row["last_modified_date"] == datetime(2026, 10, 1, 10, 0)
+    # Текст обрезается, каталог хранится item_id, таблицы в зеркало не попадают
+    assert row["fields"] == {"1": "x" * task_mirror.TASK_MIRROR_TEXT_LIMIT, "2": "2026-10-05T09:00:00+00:00",
+                             "3": 2, "4": 7700001}
+
+
+def test_query_tasks_filters_and_orders():
+    account = "query@example.com"
+
+    async def run():
+        pyrus_client = FakePyrusClient(account, [
+            task(1, modified="2026-10-01T10:00:00Z", step=1, due="2026-10-03T00:00:00Z"),
+            task(2, modified="2026-10-02T10:00:00Z", step=2, due="2026-10-04T00:00:00Z"),
+            task(3, modified="2026-10-03T10:00:00Z", step=2, due="2026-10-05T00:00:00Z", closed=True),
+        ])
+        await ensure_fresh(pyrus_client, FORM["id"])
+        results = [
+            await query_tasks(account, FORM["id"]),
+            await query_tasks(account, FORM["id"], step=2, closed=False),
+            await query_tasks(account, FORM["id"], due_after=datetime(2026, 10, 4), due_before=datetime(2026, 10, 5)),
+            await query_tasks(account, FORM["id"], limit=1, offset=1),
+        ]
+        await async_engine.dispose()
+        return [([row.task_id for row in rows], total) for rows, total in results]
+
+    everything, open_second_step, due_range, page = asyncio.run(run())
+    assert everything == ([3, 2, 1], 3)
+    assert open_second_step == ([2], 1)
+    assert due_range == ([2], 1)
+    assert page == ([2], 3)
+
+
+def test_unknown_form_is_not_registered():
+    account = "unknown-form@example.com"
+    pyrus_client = FakePyrusClient(account)
+    try:
+        asyncio.run(ensure_fresh(pyrus_client, 999))
+        assert False, "неизвестная форма должна давать MirrorFormNotFound"
+    except MirrorFormNotFound:
+        pass
+    assert pyrus_client.requests == []
+    assert 999 not in get_mirror_account(pyrus_client).forms
+
+
+def test_truncated_incremental_sync_keeps_cursor(monkeypatch):
+    account = "truncated@example.com"
+    monkeypatch.setattr(task_mirror, "TASK_MIRROR_PAGE_SIZE", 2)
+
+    async def run():
+        pyrus_client = FakePyrusClient(account, [task(1, modified="2026-10-01T10:00:00Z")])
+        mirror = get_mirror_account(pyrus_client)
+        first = await mirror.sync_form(FORM["id"], pyrus_client=pyrus_client)
+        cursor = first.cursor
+
+        pyrus_client.tasks = [task(2, modified="2026-10-02T10:00:00Z"), task(3, modified="2026-10-03T10:00:00Z")]
+        second = await mirror.sync_form(FORM["id"], pyrus_client=pyrus_client)
+        await mirror.sync_form(FORM["id"], pyrus_client=pyrus_client)
+        await async_engine.dispose()
+        return pyrus_client.requests, cursor, second
+
+    requests, cursor, second = asyncio.run(run())
+    assert getattr(requests[1], "modified_after", None) is not None
+    assert second.cursor == cursor
+    assert second.last_full_sync_at is None
+    # Следующая синхронизация — полная выгрузка
+    assert getattr(requests[2], "modified_after", None) is None
+
+
+def test_truncated_full_sync_is_not_repeated_every_pass(monkeypatch):
+    account = "truncated-full@example.com"
+    monkeypatch.setattr(task_mirror, "TASK_MIRROR_PAGE_SIZE", 2)
+
+    async def run():
+        pyrus_client = FakePyrusClient(account, [
+            task(1, modified="2026-10-01T10:00:00Z"),
+            task(2, modified="2026-10-02T10:00:00Z"),
+        ])
+        mirror = get_mirror_account(pyrus_client)
+        first = await mirror.sync_form(FORM["id"], pyrus_client=pyrus_client)
+        # Изменений по-прежнему больше страницы: неполное зеркало обновляется инкрементально, курсор движется
+        pyrus_client.tasks = [task(3, modified="2026-10-03T10:00:00Z"), task(4, modified="2026-10-04T10:00:00Z")]
+        second = await mirror.sync_form(FORM["id"], pyrus_client=pyrus_client)
+        third = await mirror.sync_form(FORM["id"], pyrus_client=pyrus_client)
+        await async_engine.dispose()
+        return pyrus_client.requests, mirror, first, second, third
+
+    requests, mirror, first, second, third = asyncio.run(run())
+    assert getattr(requests[0], "modified_after", None) is None
+    assert first.last_full_sync_at is not None
+    assert FORM["id"] in mirror.degraded
+    assert "неполное" in first.last_error
+    assert all(getattr(request, "modified_after", None) is not None for request in requests[1:])
+    assert second.cursor == datetime(2026, 10, 4, 10, 0)
+    assert third.last_full_sync_at == first.last_full_sync_at
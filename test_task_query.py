@@ -0,0 +1,89 @@
+"""
+Проверка выборки списка задач: курсор, сортировка с пустыми ключами и фильтры реестра с запасом в день
+"""
+from datetime import datetime, timedelta, timezone
+
+from pyrus.models import responses
+
+from task_query import TaskQuery, TaskQueryError
+
+FORM = responses.FormResponse(
+    id=1,
+    name="Заявка",
+    fields=[
+        {"id": 1, "name": "Описание", "type": "text"},
+        {"id": 2, "name": "Срок", "type": "due_date_time"},
+        {"id": 3, "name": "Этап", "type": "step"},
+    ],
+)
+START = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+
+def items():
+    # Срок есть у задач с четным id; у нескольких задач срок совпадает
+    return [
+        {"id": task_id, "due": START + timedelta(days=task_id // 4) if task_id % 2 == 0 else None}
+        for task_id in range(1, 21)
+    ]
+
+
+def pages(sort, limit):
+    """Все страницы выборки по курсору"""
+    result, cursor = [], None
+    while True:
+        page, cursor = TaskQuery(sort=sort, limit=limit, cursor=cursor).select(items(), lambda item: item)
+        result.append([item["id"] for item in page])
+        if cursor is None:
+            return result
+
+
+def test_cursor_pages_cover_all_items_in_order():
+    for sort in ("due", "-due", "id", "-id"):
+        query = TaskQuery(sort=sort)
+        expected, _ = query.select(items(), lambda item: item)
+        ids = [task_id for page in pages(sort, 3) for task_id in page]
+        assert ids == [item["id"] for item in expected], sort
+        assert len(set(ids)) == 20
+
+
+def test_empty_due_sorts_last_ascending_and_first_descending():
+    ascending = [task_id for page in pages("due", 5) for task_id in page]
+    descending = [task_id for page in pages("-due", 5) for task_id in page]
+    assert all(task_id % 2 == 1 for task_id in ascending[-10:])
+    assert all(task_id % 2 == 1 for task_id in descending[:10])
+    assert descending == ascending[::-1]
+
+
+def test_cursor_is_bound_to_sort():
+    _, cursor = TaskQuery(sort="-due", limit=2).select(items(), lambda item: item)
+    assert TaskQuery(sort="-due", cursor=cursor).after is not None
+    for sort, bad_cursor in (("due", cursor), ("-due", "не курсор")):
+        try:
+            TaskQuery(sort=sort, cursor=bad_cursor)
+            assert False, "курсор должен отклоняться"
+        except TaskQueryError:
+            pass
+
+
+def test_due_filters_are_widened_by_a_day():
+    due_after = datetime(2026, 10, 5, 10, 0, tzinfo=timezone.utc)
+    due_before = datetime(2026, 10, 7, 10, 0, tzinfo=timezone.utc)
+    assert vars(TaskQuery(due_after=due_after).register_request(FORM))["fld2"] == "gt2026-10-04"
+    assert vars(TaskQuery(due_before=due_before).register_request(FORM))["fld2"] == "lt2026-10-08"
+    assert vars(TaskQuery(due_after=due_after, due_before=due_before).register_request(FORM))["fld2"] == \
+        "gt2026-10-04,lt2026-10-08"
+
+    # Точная граница проверяется на сервере
+    query = TaskQuery(due_after=due_after, due_before=due_before)
+    assert query.matches({"due": due_after})
+    assert not query.matches({"due": due_after - timedelta(minutes=1)})
+    assert not query.matches({"due": due_before})
+    assert not query.matches({"due": None})
+
+
+def test_id_cursor_and_archived_are_passed_to_registry():
+    _, cursor = TaskQuery(sort="-id", limit=5).select(items(), lambda item: item)
+    request = vars(TaskQuery(sort="-id", limit=5, cursor=cursor, include_archived=True).register_request(FORM))
+    assert request["include_archived"] is True
+    assert request["id"] == "lt16"
+    assert request["field_ids"] == [2, 3]
@@ -0,0 +1,79 @@
+"""
+Проверка отложенной записи: объединение изменений одной строки и дозапись буфера при остановке
+"""
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, User, async_engine
+from write_behind import WriteBehindBuffer
+
+
+async def create_users(*logins):
+    async with AsyncSessionLocal() as db:
+        users = [User(login=login, security_key="key") for login in logins]
+        db.add_all(users)
+        await db.commit()
+        return [user.id for user in users]
+
+
+async def load_users(*ids):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.id.in_(ids)))
+        return {user.id: user for user in result.scalars()}
+
+
+def test_updates_of_one_row_are_coalesced():
+    async def run():
+        first, second = await create_users("coalesce-1@example.com", "coalesce-2@example.com")
+        buffer = WriteBehindBuffer(User, name="test")
+        buffer.update(first, last_login=datetime(2026, 1, 1))
+        buffer.update(first, last_login=datetime(2026, 1, 2))
+        buffer.update(first, is_active=False)
+        buffer.update(second, last_login=datetime(2026, 1, 3))
+        assert buffer.stats()["pending"] == 2
+
+        written = await buffer.flush()
+        users = await load_users(first, second)
+        await async_engine.dispose()
+        return buffer, written, users, first, second
+
+    buffer, written, users, first, second = asyncio.run(run())
+    assert written == 2
+    assert buffer.stats()["pending"] == 0
+    # Последнее значение столбца побеждает, изменения разных столбцов объединяются
+    assert users[first].last_login == datetime(2026, 1, 2)
+    assert users[first].is_active is False
+    assert users[second].last_login == datetime(2026, 1, 3)
+
+
+def test_pending_writes_are_flushed_on_shutdown():
+    async def run():
+        (user_id,) = await create_users("shutdown@example.com")
+        buffer = WriteBehindBuffer(User, name="test")
+        task = asyncio.create_task(buffer.run_forever(interval=3600))
+        await asyncio.sleep(0)
+        buffer.update(user_id, last_login=datetime(2026, 2, 1))
+
+        # Как в lifespan: остановка фоновой задачи и финальный flush
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert buffer.stats()["pending"] == 1
+        await buffer.flush()
+        users = await load_users(user_id)
+        await async_engine.dispose()
+        return buffer, users[user_id]
+
+    buffer, user = asyncio.run(run())
+    assert buffer.stats()["pending"] == 0
+    assert user.last_login == datetime(2026, 2, 1)
+
+
+def test_full_buffer_drops_new_rows_but_merges_known_ones():
+    buffer = WriteBehindBuffer(User, name="test", max_pending=1)
+    assert buffer.update(1, last_login=datetime(2026, 3, 1))
+    assert not buffer.update(2, last_login=datetime(2026, 3, 1))
+    assert buffer.update(1, last_login=datetime(2026, 3, 2))
+    assert buffer.stats()["dropped"] == 1
+    assert buffer._pending == {1: {"last_login": datetime(2026, 3, 2)}}
@@ -0,0 +1,113 @@
+"""
+Отложенная запись некритичных изменений (например, users.last_login) пакетами в фоне
+"""
+import asyncio
+import os
+from collections import defaultdict
+
+from sqlalchemy import update
+
+from database import AsyncSessionLocal, User
+
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "2"))
+# Предел числа строк, ожидающих записи; при переполнении новые изменения отбрасываются
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+
+
+class WriteBehindBuffer:
+    """
+    Буфер изменений строк модели по первичному ключу.
+    Повторные изменения одной строки объединяются (последнее значение побеждает),
+    сброс — одним UPDATE ... executemany на набор столбцов
+    """
+
+    def __init__(self, model, name, max_pending=WRITE_BEHIND_MAX_PENDING):
+        self.model = model
+        self.name = name
+        self.max_pending = max_pending
+        self._pending = {}  # первичный ключ -> {столбец: значение}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = None
+        self.flushes = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def update(self, pk, **values) -> bool:
+        """Постановка изменения в очередь; False — очередь переполнена и изменение отброшено"""
+        if pk not in self._pending and len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            self._request_flush()
+            return False
+        self._pending.setdefault(pk, {}).update(values)
+        if len(self._pending) >= self.max_pending:
+            self._request_flush()
+        return True
+
+    def _request_flush(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Запись всех накопленных изменений; при ошибке они возвращаются в очередь"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+
+            # Строки с одинаковым набором столбцов пишутся одним executemany
+            groups = defaultdict(list)
+            for pk, values in batch.items():
+                groups[tuple(sorted(values))].append({"id": pk, **values})
+            try:
+                async with AsyncSessionLocal() as db:
+                    for rows in groups.values():
+                        await db.execute(update(self.model), rows)
+                    await db.commit()
+            except asyncio.CancelledError:
+                # Остановка во время записи: изменения допишет финальный flush при завершении
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"Ошибка отложенной записи {self.name}: {str(e)}")
+                self._requeue(batch)
+                return 0
+
+            self.flushes += 1
+            self.written += len(batch)
+            return len(batch)
+
+    def _requeue(self, batch):
+        # Более новые изменения, пришедшие во время записи, не перетираем
+        for pk, values in batch.items():
+            self._pending[pk] = {**values, **self._pending.get(pk, {})}
+
+    async def run_forever(self, interval=WRITE_BEHIND_FLUSH_SECONDS):
+        """Фоновая задача: сброс раз в interval секунд или сразу при заполнении очереди"""
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+        finally:
+            self._wakeup = None
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "flushes": self.flushes,
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+
+# Некритичные изменения пользователей (last_login); изменения ключа и активности пишутся сразу
+user_writes = WriteBehindBuffer(User, name="users")